@@ -1,28 +1,57 @@
-from flask import Flask, request, jsonify, send_from_directory, current_app
+import os
+
+# 加载.env文件中的环境变量
+from dotenv import load_dotenv
+load_dotenv()
+
+# 多进程部署时 Socket.IO 通过消息队列转发广播，监听队列需要在导入其他模块前给标准库打上 eventlet 补丁；
+# 数据库连接池的 green 模式同样需要补丁，使等待连接和 MySQL 查询不阻塞事件循环
+if os.environ.get('SOCKETIO_MESSAGE_QUEUE') or os.environ.get('DB_POOL_MODE') == 'green':
+    import eventlet
+    eventlet.monkey_patch()
+
+from flask import Flask, request, jsonify, send_from_directory, current_app, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.record_queries import get_recorded_queries
 from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity, create_access_token
 from flask_migrate import Migrate
-from flask_socketio import SocketIO, join_room, leave_room, emit, send
-import os
+from flask_socketio import SocketIO, join_room, leave_room, emit, send, rooms
 import logging
+import click
 import uuid
+import time
 from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
 from openai import OpenAI
-from sqlalchemy import text
+from sqlalchemy import text, func, or_
+from sqlalchemy.orm import load_only, selectinload, joinedload, defer
 import eventlet
 from eventlet import wsgi
 import threading
-
-# 加载.env文件中的环境变量
-from dotenv import load_dotenv
-load_dotenv()
+import atexit
 
 # 导入自定义模块
 from config import get_config
-from models import db, bcrypt, User, Note, NoteVersion, Category, Tag, Flowchart, FlowchartVersion, TableDocument, TableDocumentVersion, Whiteboard, WhiteboardVersion, Mindmap, MindmapVersion, ShareLink
+from models import db, bcrypt, User, Note, NoteVersion, Category, Tag, Flowchart, FlowchartVersion, TableDocument, TableDocumentVersion, Whiteboard, WhiteboardVersion, Mindmap, MindmapVersion, ShareLink, ContentItem
+from search import INDEXED_MODELS, search_documents, rebuild_index, escape_like
+from catalog import CATALOG_MODELS, find_content, rebuild_catalog
+from query_plans import check_query_plans
+from db_pool import engine_options, init_pool_metrics, pool_status, eventlet_patched
+from projections import FieldError, parse_fields, list_summaries
+from pagination import PageError, parse_page_args, list_filters, paginate
+from exporter import (
+    EXPORT_FORMATS, validate_export, export_filename, export_stream, start_export_job, get_export_job,
+    export_folder, clean_export_jobs
+)
+from stats import refresh_daily_stats, dashboard_stats
+from collab import COLLAB_DOC_TYPES, CollabDocument, SyncError, content_to_delta
+from collab_store import create_store, LockTimeout, PRESENCE_TIMEOUT, SAVE_RETRIES
+from collab_persist import flush_documents, evict_documents, request_flush
+from broadcast import RoomBroadcaster
+from payload_codec import PayloadCodec
+from socket_auth import RoomAuthorizer, RoomGrant
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -31,9 +60,12 @@ logger = logging.getLogger(__name__)
 # 初始化应用
 app = Flask(__name__)
 app.config.from_object(get_config())
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
 
 # 初始化扩展
 db.init_app(app)
+with app.app_context():
+    init_pool_metrics(db.engine, app.config)
 bcrypt.init_app(app)
 JWTManager(app)
 CORS(app, origins=app.config['CORS_ORIGINS'], supports_credentials=app.config['CORS_SUPPORTS_CREDENTIALS'])
@@ -42,18 +74,125 @@ Migrate(app, db)
 # 初始化SocketIO
 # 配置CORS以允许所有来源
 CORS(app, resources={"*": {"origins": "*"}})
-socketio = SocketIO(app, cors_allowed_origins="*")
+# 配置了消息队列时，房间广播经由消息队列发送到所有进程
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'])
+
+# 高频的房间事件先合并，每隔 SOCKETIO_BATCH_MS 毫秒按房间批量发送
+broadcaster = RoomBroadcaster(
+    socketio,
+    interval_ms=app.config['SOCKETIO_BATCH_MS'],
+    room_limit=app.config['SOCKETIO_ROOM_QUEUE_LIMIT'],
+    client_limit=app.config['SOCKETIO_CLIENT_QUEUE_LIMIT']
+)
 
-# 在线用户字典，用于跟踪每个房间的在线用户
-online_users = {}
+# 大消息（完整文档、补取的操作）按连接时协商的编码以二进制发送
+payload_codec = PayloadCodec(threshold=app.config['SOCKETIO_COMPRESS_THRESHOLD'],
+                             max_decoded_bytes=app.config['SOCKETIO_MAX_DECODED_BYTES'])
 
-# 协作文档状态，用于存储当前文档的最新状态
-collaborative_docs = {}
+# 协作状态存储：房间在线用户和协作文档（当前内容、版本号和最近的操作），多进程部署时使用Redis共享
+collab_store = create_store(app.config['COLLAB_STATE_URL'])
 
 # 初始化定时任务调度器
 scheduler = BackgroundScheduler()
 scheduler.start()
 
+# -------------------------- 通用工具函数 --------------------------
+@app.after_request
+def report_query_count(response):
+    """开启 SQLALCHEMY_RECORD_QUERIES 时在响应头 X-Query-Count 中返回本次请求执行的SQL数，
+    超过 QUERY_COUNT_WARNING 时记录警告，用于发现列表接口中随行数增长的 N+1 查询"""
+    if app.config.get('SQLALCHEMY_RECORD_QUERIES'):
+        count = len(get_recorded_queries())
+        response.headers['X-Query-Count'] = str(count)
+        if count > app.config['QUERY_COUNT_WARNING']:
+            logger.warning(f"{request.method} {request.path} 执行了 {count} 条SQL查询")
+    return response
+
+def list_response(items, next_cursor, total=None):
+    """列表接口的响应：data 为本页内容，next_cursor 为下一页的游标（没有更多时为 null），请求了总数时附带 total"""
+    response = {
+        'code': 200,
+        'message': '获取成功',
+        'data': items,
+        'next_cursor': next_cursor
+    }
+    if total is not None:
+        response['total'] = total
+    return jsonify(response), 200
+
+def paginate_versions(query, version_model):
+    """版本历史游标分页：按版本ID倒序，只读取元数据列，版本内容通过单个版本接口获取"""
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    cursor = request.args.get('cursor', type=int)
+
+    query = query.options(
+        load_only(
+            version_model.id,
+            version_model.updater_id,
+            version_model.updated_at,
+            version_model.content_size,
+            version_model.preview
+        ),
+        selectinload(version_model.updater)
+    )
+    if cursor:
+        query = query.filter(version_model.id < cursor)
+
+    versions = query.order_by(version_model.id.desc()).limit(limit + 1).all()
+    has_more = len(versions) > limit
+    versions = versions[:limit]
+
+    return jsonify({
+        'code': 200,
+        'message': '获取成功',
+        'data': [version.to_summary_dict() for version in versions],
+        'next_cursor': versions[-1].id if has_more else None,
+        'has_more': has_more
+    }), 200
+
+# 共享链接的外键 -> 内容目录中的类型
+SHARE_LINK_CONTENT = (
+    ('note_id', 'note'),
+    ('flowchart_id', 'flowchart'),
+    ('mindmap_id', 'mindmap'),
+    ('table_document_id', 'table'),
+    ('whiteboard_id', 'whiteboard'),
+)
+
+def share_link_owner_id(share_link):
+    """共享链接所分享内容的所有者ID，内容不存在时返回 None"""
+    for column, content_type in SHARE_LINK_CONTENT:
+        content_id = getattr(share_link, column)
+        if content_id:
+            items = find_content(content_id, content_type)
+            return items[0].user_id if items else None
+    return None
+
+def load_room_grant(room_id):
+    """从共享链接读取协作房间的授权信息，房间不存在时返回 None"""
+    share_link = ShareLink.query.filter_by(room_id=room_id, is_collaborative=True).first()
+    if not share_link:
+        return None
+    for column, content_type in SHARE_LINK_CONTENT:
+        content_id = getattr(share_link, column)
+        if content_id:
+            return RoomGrant(room_id, content_type, content_id, share_link_owner_id(share_link),
+                             share_link.permission, share_link.token, share_link.expire_at)
+    return None
+
+# Socket.IO 连接认证和房间授权，房间授权缓存 COLLAB_ROOM_AUTH_TTL 秒
+room_auth = RoomAuthorizer(load_room_grant, ttl=app.config['COLLAB_ROOM_AUTH_TTL'])
+
+def revoke_room(room_id):
+    """共享链接删除或关闭协作后，清除房间授权缓存并把所有连接移出房间"""
+    if not room_id:
+        return
+    room_auth.invalidate(room_id)
+    socketio.emit('room_revoked', {'room_id': room_id}, to=room_id)
+    for member in collab_store.members(room_id):
+        collab_store.leave(room_id, member['sid'])
+    socketio.close_room(room_id)
+
 # -------------------------- 用户认证接口 --------------------------
 @app.route('/api/login', methods=['POST'])
 def login():
@@ -154,16 +293,23 @@ def get_user_profile():
 @app.route('/api/notes', methods=['GET'])
 @jwt_required()
 def get_notes():
-    """获取用户的笔记列表"""
+    """获取用户的笔记列表：按最近修改排序，支持游标分页和 category_id、tag_id、type、is_public 筛选"""
     try:
         user_id = get_jwt_identity()
-        notes = Note.query.filter_by(user_id=user_id).order_by(Note.updated_at.desc()).all()
+        try:
+            page = parse_page_args(request.args)
+            filters = list_filters(Note, request.args)
+        except PageError as e:
+            return jsonify({'code': 400, 'message': str(e)}), 400
         
-        return jsonify({
-            'code': 200,
-            'message': '获取成功',
-            'data': [note.to_dict() for note in notes]
-        }), 200
+        # 列表不返回笔记正文，不读取 content 列
+        query = db.select(Note).options(defer(Note.content)).where(Note.user_id == user_id, *filters)
+        rows, next_cursor, total = paginate(query, Note.updated_at, Note.id, page)
+        notes = [row[0] for row in rows]
+        # 标签ID按批读取，避免每篇笔记单独查询一次标签
+        Note.preload_tag_ids(notes)
+        
+        return list_response([note.to_dict() for note in notes], next_cursor, total)
     except Exception as e:
         logger.error(f"获取笔记列表接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
@@ -174,7 +320,8 @@ def get_note_detail(note_id):
     """获取笔记详情"""
     try:
         user_id = get_jwt_identity()
-        note = Note.query.filter_by(id=note_id, user_id=user_id).first()
+        note = Note.query.options(joinedload(Note.category), selectinload(Note.tags)) \
+            .filter_by(id=note_id, user_id=user_id).first()
         
         if not note:
             return jsonify({'code': 404, 'message': '笔记不存在'}), 404
@@ -268,12 +415,16 @@ def update_note(note_id):
             if existing_note:
                 return jsonify({'code': 400, 'message': '已存在同名笔记，请使用其他名称'}), 400
         
-        # 保存旧版本
-        note.save_version(user_id)
+        # 保存旧版本（内容未变化时跳过）；前端自动保存时请求带 autosave，连续自动保存在合并窗口内只保留一个版本，
+        # 手动保存总是保留一个版本
+        new_content = data.get('content', note.content)
+        content_changed = new_content != note.content
+        if content_changed:
+            note.save_version(user_id, coalesce=data.get('autosave') is True)
         
         # 更新笔记字段
         note.title = new_title
-        note.content = data.get('content', note.content)
+        note.content = new_content
         note.type = data.get('type', note.type)
         note.is_public = data.get('is_public', note.is_public)
         note.category_id = data.get('category_id', note.category_id)
@@ -305,6 +456,8 @@ def update_note(note_id):
             note.tags = []
         
         db.session.commit()
+        if content_changed:
+            reload_collab_document(note)
         
         return jsonify({
             'code': 200,
@@ -327,15 +480,35 @@ def get_note_versions(note_id):
         if not note:
             return jsonify({'code': 404, 'message': '笔记不存在或无权限访问'}), 404
         
-        versions = note.versions.order_by(NoteVersion.updated_at.desc()).all()
+        return paginate_versions(NoteVersion.query.filter_by(note_id=note_id), NoteVersion)
+    except Exception as e:
+        logger.error(f"获取笔记版本历史接口异常: {str(e)}", exc_info=True)
+        return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
+
+
+@app.route('/api/notes/<int:note_id>/versions/<int:version_id>', methods=['GET'])
+@jwt_required()
+def get_note_version(note_id, version_id):
+    """获取笔记特定版本"""
+    try:
+        user_id = get_jwt_identity()
+        note = Note.query.filter_by(id=note_id, user_id=user_id).first()
+        
+        if not note:
+            return jsonify({'code': 404, 'message': '笔记不存在或无权限访问'}), 404
+        
+        version = NoteVersion.query.filter_by(id=version_id, note_id=note_id).first()
+        
+        if not version:
+            return jsonify({'code': 404, 'message': '版本不存在'}), 404
         
         return jsonify({
             'code': 200,
             'message': '获取成功',
-            'data': [version.to_dict() for version in versions]
+            'data': version.to_dict()
         }), 200
     except Exception as e:
-        logger.error(f"获取笔记版本历史接口异常: {str(e)}", exc_info=True)
+        logger.error(f"获取笔记特定版本接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
 
 
@@ -380,9 +553,10 @@ def rollback_note_version(note_id, version_id):
         if not version:
             return jsonify({'code': 404, 'message': '版本不存在'}), 404
         
-        # 回滚内容
-        note.content = version.content
+        # 回滚内容（差量版本需要从最近的关键帧还原）
+        note.content = version.get_content()
         db.session.commit()
+        reload_collab_document(note)
         
         return jsonify({
             'code': 200,
@@ -408,9 +582,12 @@ def delete_note(note_id):
         # 删除笔记版本记录
         NoteVersion.query.filter_by(note_id=note_id).delete()
         
-        # 删除笔记
+        # 删除笔记（共享链接随之删除）
+        room_ids = [share_link.room_id for share_link in ShareLink.query.filter_by(note_id=note_id)]
         db.session.delete(note)
         db.session.commit()
+        for room_id in room_ids:
+            revoke_room(room_id)
         
         return jsonify({
             'code': 200,
@@ -425,16 +602,17 @@ def delete_note(note_id):
 @app.route('/api/categories', methods=['GET'])
 @jwt_required()
 def get_categories():
-    """获取用户的分类列表"""
+    """获取用户的分类列表：按创建时间排序，支持游标分页"""
     try:
         user_id = get_jwt_identity()
-        categories = Category.query.filter_by(user_id=user_id).all()
+        try:
+            page = parse_page_args(request.args)
+        except PageError as e:
+            return jsonify({'code': 400, 'message': str(e)}), 400
         
-        return jsonify({
-            'code': 200,
-            'message': '获取成功',
-            'data': [category.to_dict() for category in categories]
-        }), 200
+        query = db.select(Category).where(Category.user_id == user_id)
+        rows, next_cursor, total = paginate(query, Category.created_at, Category.id, page, descending=False)
+        return list_response([row[0].to_dict() for row in rows], next_cursor, total)
     except Exception as e:
         logger.error(f"获取分类列表接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
@@ -471,16 +649,17 @@ def create_category():
 @app.route('/api/tags', methods=['GET'])
 @jwt_required()
 def get_tags():
-    """获取用户的标签列表"""
+    """获取用户的标签列表：按创建时间排序，支持游标分页"""
     try:
         user_id = get_jwt_identity()
-        tags = Tag.query.filter_by(user_id=user_id).all()
+        try:
+            page = parse_page_args(request.args)
+        except PageError as e:
+            return jsonify({'code': 400, 'message': str(e)}), 400
         
-        return jsonify({
-            'code': 200,
-            'message': '获取成功',
-            'data': [tag.to_dict() for tag in tags]
-        }), 200
+        query = db.select(Tag).where(Tag.user_id == user_id)
+        rows, next_cursor, total = paginate(query, Tag.created_at, Tag.id, page, descending=False)
+        return list_response([row[0].to_dict() for row in rows], next_cursor, total)
     except Exception as e:
         logger.error(f"获取标签列表接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
@@ -537,16 +716,17 @@ def get_tag(tag_id):
 @app.route('/api/flowcharts', methods=['GET'])
 @jwt_required()
 def get_flowcharts():
-    """获取用户的流程图列表"""
+    """获取用户的流程图列表：只返回摘要字段，可用 ?fields= 指定字段，支持游标分页和筛选"""
     try:
         user_id = get_jwt_identity()
-        flowcharts = Flowchart.query.filter_by(user_id=user_id).order_by(Flowchart.updated_at.desc()).all()
+        try:
+            fields = parse_fields('flowchart', request.args.get('fields'))
+            page = parse_page_args(request.args)
+            filters = list_filters(Flowchart, request.args)
+        except (FieldError, PageError) as e:
+            return jsonify({'code': 400, 'message': str(e)}), 400
         
-        return jsonify({
-            'code': 200,
-            'message': '获取成功',
-            'data': [flowchart.to_dict() for flowchart in flowcharts]
-        }), 200
+        return list_response(*list_summaries('flowchart', user_id, fields, filters, page))
     except Exception as e:
         logger.error(f"获取流程图列表接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
@@ -628,13 +808,16 @@ def update_flowchart(flowchart_id):
             if existing_flowchart:
                 return jsonify({'code': 400, 'message': '已存在同名流程图，请使用其他名称'}), 400
         
-        # 保存旧版本
-        flowchart.save_version(user_id)
+        # 保存旧版本（内容未变化时跳过）；前端自动保存时请求带 autosave，连续自动保存在合并窗口内只保留一个版本，
+        # 手动保存总是保留一个版本
+        new_flow_data = data.get('flow_data', flowchart.flow_data)
+        if new_flow_data != flowchart.flow_data:
+            flowchart.save_version(user_id, coalesce=data.get('autosave') is True)
         
         # 更新流程图数据
         flowchart.title = new_title
         flowchart.description = data.get('description', flowchart.description)
-        flowchart.flow_data = data.get('flow_data', flowchart.flow_data)
+        flowchart.flow_data = new_flow_data
         flowchart.thumbnail = data.get('thumbnail', flowchart.thumbnail)
         flowchart.is_public = data.get('is_public', flowchart.is_public)
         
@@ -821,6 +1004,7 @@ def share_note(note_id):
         
         # 创建或更新共享链接
         share_link = ShareLink.query.filter_by(note_id=note_id, permission=permission).first()
+        previous_room_id = None
         
         if not share_link:
             share_link = ShareLink(
@@ -833,6 +1017,7 @@ def share_note(note_id):
             )
             db.session.add(share_link)
         else:
+            previous_room_id = share_link.room_id
             share_link.expire_at = expire_at
             share_link.is_collaborative = is_collaborative
             # 如果开启了协作但没有房间ID，生成一个
@@ -843,6 +1028,11 @@ def share_note(note_id):
                 share_link.room_id = None
         
         db.session.commit()
+        if share_link.room_id:
+            # 过期时间可能已修改
+            room_auth.invalidate(share_link.room_id)
+        elif previous_room_id:
+            revoke_room(previous_room_id)
         
         return jsonify({
             'code': 200,
@@ -877,8 +1067,10 @@ def delete_note_share(note_id, token):
         if not share_link:
             return jsonify({'code': 404, 'message': '分享链接不存在'}), 404
         
+        room_id = share_link.room_id
         db.session.delete(share_link)
         db.session.commit()
+        revoke_room(room_id)
         
         return jsonify({
             'code': 200,
@@ -900,13 +1092,7 @@ def get_flowchart_versions(flowchart_id):
         if not flowchart:
             return jsonify({'code': 404, 'message': '流程图不存在'}), 404
         
-        versions = FlowchartVersion.query.filter_by(flowchart_id=flowchart_id).order_by(FlowchartVersion.updated_at.desc()).all()
-        
-        return jsonify({
-            'code': 200,
-            'message': '获取成功',
-            'data': [version.to_dict() for version in versions]
-        }), 200
+        return paginate_versions(FlowchartVersion.query.filter_by(flowchart_id=flowchart_id), FlowchartVersion)
     except Exception as e:
         logger.error(f"获取流程图版本历史接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
@@ -957,8 +1143,8 @@ def rollback_flowchart_version(flowchart_id, version_id):
         # 保存当前版本
         flowchart.save_version(user_id)
         
-        # 回滚内容
-        flowchart.flow_data = version.flow_data
+        # 回滚内容（按需从最近的关键帧还原快照）
+        flowchart.flow_data = version.get_data()
         
         db.session.commit()
         
@@ -975,16 +1161,17 @@ def rollback_flowchart_version(flowchart_id, version_id):
 @app.route('/api/tables', methods=['GET'])
 @jwt_required()
 def get_tables():
-    """获取用户的表格列表"""
+    """获取用户的表格列表：只返回摘要字段，可用 ?fields= 指定字段，支持游标分页和筛选"""
     try:
         user_id = get_jwt_identity()
-        tables = TableDocument.query.filter_by(user_id=user_id).order_by(TableDocument.updated_at.desc()).all()
+        try:
+            fields = parse_fields('table', request.args.get('fields'))
+            page = parse_page_args(request.args)
+            filters = list_filters(TableDocument, request.args)
+        except (FieldError, PageError) as e:
+            return jsonify({'code': 400, 'message': str(e)}), 400
         
-        return jsonify({
-            'code': 200,
-            'message': '获取成功',
-            'data': [table.to_dict() for table in tables]
-        }), 200
+        return list_response(*list_summaries('table', user_id, fields, filters, page))
     except Exception as e:
         logger.error(f"获取表格列表接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
@@ -1065,14 +1252,21 @@ def update_table(table_id):
             if existing_table:
                 return jsonify({'code': 400, 'message': '已存在同名表格，请使用其他名称'}), 400
         
-        # 保存旧版本
-        table.save_version(user_id)
+        # 保存旧版本（内容未变化时跳过）；前端自动保存时请求带 autosave，连续自动保存在合并窗口内只保留一个版本，
+        # 手动保存总是保留一个版本
+        new_snapshot = {
+            'columns': data.get('columns', table.columns_data),
+            'rows': data.get('rows', table.rows_data),
+            'cellStyles': data.get('cellStyles', table.cell_styles)
+        }
+        if new_snapshot != table.snapshot():
+            table.save_version(user_id, coalesce=data.get('autosave') is True)
         
         # 更新表格数据
         table.title = new_title
-        table.columns_data = data.get('columns', table.columns_data)
-        table.rows_data = data.get('rows', table.rows_data)
-        table.cell_styles = data.get('cellStyles', table.cell_styles)
+        table.columns_data = new_snapshot['columns']
+        table.rows_data = new_snapshot['rows']
+        table.cell_styles = new_snapshot['cellStyles']
         
         db.session.commit()
         
@@ -1124,13 +1318,7 @@ def get_table_versions(table_id):
         if not table:
             return jsonify({'code': 404, 'message': '表格不存在'}), 404
         
-        versions = TableDocumentVersion.query.filter_by(table_document_id=table_id).order_by(TableDocumentVersion.updated_at.desc()).all()
-        
-        return jsonify({
-            'code': 200,
-            'message': '获取成功',
-            'data': [version.to_dict() for version in versions]
-        }), 200
+        return paginate_versions(TableDocumentVersion.query.filter_by(table_document_id=table_id), TableDocumentVersion)
     except Exception as e:
         logger.error(f"获取表格版本历史接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
@@ -1181,10 +1369,11 @@ def rollback_table_version(table_id, version_id):
         # 保存当前版本
         table.save_version(user_id)
         
-        # 回滚内容
-        table.columns_data = version.columns_data
-        table.rows_data = version.rows_data
-        table.cell_styles = version.cell_styles
+        # 回滚内容（按需从最近的关键帧还原快照）
+        snapshot = version.get_data()
+        table.columns_data = snapshot.get('columns')
+        table.rows_data = snapshot.get('rows')
+        table.cell_styles = snapshot.get('cellStyles')
         
         db.session.commit()
         
@@ -1201,16 +1390,17 @@ def rollback_table_version(table_id, version_id):
 @app.route('/api/whiteboards', methods=['GET'])
 @jwt_required()
 def get_whiteboards():
-    """获取用户的白板列表"""
+    """获取用户的白板列表：只返回摘要字段，可用 ?fields= 指定字段，支持游标分页和筛选"""
     try:
         user_id = get_jwt_identity()
-        whiteboards = Whiteboard.query.filter_by(user_id=user_id).order_by(Whiteboard.updated_at.desc()).all()
+        try:
+            fields = parse_fields('whiteboard', request.args.get('fields'))
+            page = parse_page_args(request.args)
+            filters = list_filters(Whiteboard, request.args)
+        except (FieldError, PageError) as e:
+            return jsonify({'code': 400, 'message': str(e)}), 400
         
-        return jsonify({
-            'code': 200,
-            'message': '获取成功',
-            'data': [whiteboard.to_dict() for whiteboard in whiteboards]
-        }), 200
+        return list_response(*list_summaries('whiteboard', user_id, fields, filters, page))
     except Exception as e:
         logger.error(f"获取白板列表接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
@@ -1290,13 +1480,16 @@ def update_whiteboard(whiteboard_id):
             if existing_whiteboard:
                 return jsonify({'code': 400, 'message': '已存在同名白板，请使用其他名称'}), 400
         
-        # 保存旧版本
-        whiteboard.save_version(user_id)
+        # 保存旧版本（内容未变化时跳过）；前端自动保存时请求带 autosave，连续自动保存在合并窗口内只保留一个版本，
+        # 手动保存总是保留一个版本
+        new_data = data.get('data', whiteboard.data)
+        if new_data != whiteboard.data:
+            whiteboard.save_version(user_id, coalesce=data.get('autosave') is True)
         
         # 更新白板数据
         whiteboard.title = new_title
         whiteboard.room_key = data.get('room_key', whiteboard.room_key)
-        whiteboard.data = data.get('data', whiteboard.data)
+        whiteboard.data = new_data
         
         db.session.commit()
         
@@ -1348,13 +1541,7 @@ def get_whiteboard_versions(whiteboard_id):
         if not whiteboard:
             return jsonify({'code': 404, 'message': '白板不存在'}), 404
         
-        versions = WhiteboardVersion.query.filter_by(whiteboard_id=whiteboard_id).order_by(WhiteboardVersion.updated_at.desc()).all()
-        
-        return jsonify({
-            'code': 200,
-            'message': '获取成功',
-            'data': [version.to_dict() for version in versions]
-        }), 200
+        return paginate_versions(WhiteboardVersion.query.filter_by(whiteboard_id=whiteboard_id), WhiteboardVersion)
     except Exception as e:
         logger.error(f"获取白板版本历史接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
@@ -1405,8 +1592,8 @@ def rollback_whiteboard_version(whiteboard_id, version_id):
         # 保存当前版本
         whiteboard.save_version(user_id)
         
-        # 回滚内容
-        whiteboard.data = version.data
+        # 回滚内容（按需从最近的关键帧还原快照）
+        whiteboard.data = version.get_data()
         
         db.session.commit()
         
@@ -1446,16 +1633,17 @@ def get_wbo_token():
 @app.route('/api/mindmaps', methods=['GET'])
 @jwt_required()
 def get_mindmaps():
-    """获取用户的脑图列表"""
+    """获取用户的脑图列表：只返回摘要字段，可用 ?fields= 指定字段，支持游标分页和筛选"""
     try:
         user_id = get_jwt_identity()
-        mindmaps = Mindmap.query.filter_by(user_id=user_id).order_by(Mindmap.updated_at.desc()).all()
+        try:
+            fields = parse_fields('mindmap', request.args.get('fields'))
+            page = parse_page_args(request.args)
+            filters = list_filters(Mindmap, request.args)
+        except (FieldError, PageError) as e:
+            return jsonify({'code': 400, 'message': str(e)}), 400
         
-        return jsonify({
-            'code': 200,
-            'message': '获取成功',
-            'data': [mindmap.to_dict() for mindmap in mindmaps]
-        }), 200
+        return list_response(*list_summaries('mindmap', user_id, fields, filters, page))
     except Exception as e:
         logger.error(f"获取脑图列表接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
@@ -1587,12 +1775,15 @@ def update_mindmap(mindmap_id):
             if existing_mindmap:
                 return jsonify({'code': 400, 'message': '已存在同名脑图，请使用其他名称'}), 400
         
-        # 保存旧版本
-        mindmap.save_version(user_id)
+        # 保存旧版本（内容未变化时跳过）；前端自动保存时请求带 autosave，连续自动保存在合并窗口内只保留一个版本，
+        # 手动保存总是保留一个版本
+        new_data = data.get('data', mindmap.data)
+        if new_data != mindmap.data:
+            mindmap.save_version(user_id, coalesce=data.get('autosave') is True)
         
         # 更新脑图数据
         mindmap.title = new_title
-        mindmap.data = data.get('data', mindmap.data)
+        mindmap.data = new_data
         mindmap.is_public = data.get('is_public', mindmap.is_public)
         
         db.session.commit()
@@ -1645,13 +1836,7 @@ def get_mindmap_versions(mindmap_id):
         if not mindmap:
             return jsonify({'code': 404, 'message': '脑图不存在'}), 404
         
-        versions = MindmapVersion.query.filter_by(mindmap_id=mindmap_id).order_by(MindmapVersion.updated_at.desc()).all()
-        
-        return jsonify({
-            'code': 200,
-            'message': '获取成功',
-            'data': [version.to_dict() for version in versions]
-        }), 200
+        return paginate_versions(MindmapVersion.query.filter_by(mindmap_id=mindmap_id), MindmapVersion)
     except Exception as e:
         logger.error(f"获取脑图版本历史接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
@@ -1702,8 +1887,8 @@ def rollback_mindmap_version(mindmap_id, version_id):
         # 保存当前版本
         mindmap.save_version(user_id)
         
-        # 回滚内容
-        mindmap.data = version.data
+        # 回滚内容（按需从最近的关键帧还原快照）
+        mindmap.data = version.get_data()
         
         db.session.commit()
         
@@ -1716,6 +1901,71 @@ def rollback_mindmap_version(mindmap_id, version_id):
         logger.error(f"回滚脑图版本接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
 
+# -------------------------- 全文检索接口 --------------------------
+@app.route('/api/search', methods=['GET'])
+@jwt_required()
+def search_content():
+    """检索当前用户的笔记、流程图、脑图和表格，按相关度（BM25）排序并返回高亮摘要
+
+    参数：q 关键词（空格分隔的多个关键词需同时命中），type 文档类型（note/flowchart/mindmap/table，默认全部），
+    limit 每页条数，offset 偏移量
+    """
+    try:
+        user_id = get_jwt_identity()
+        keyword = request.args.get('q', '').strip()
+        doc_type = request.args.get('type', 'all')
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+
+        if not keyword:
+            return jsonify({'code': 400, 'message': '检索关键词不能为空'}), 400
+        if doc_type != 'all' and doc_type not in INDEXED_MODELS:
+            return jsonify({'code': 400, 'message': '不支持的文档类型'}), 400
+
+        results, has_more = search_documents(
+            user_id, keyword, None if doc_type == 'all' else doc_type, limit, offset
+        )
+        return jsonify({
+            'code': 200,
+            'message': '检索成功',
+            'data': results,
+            'next_offset': offset + limit if has_more else None,
+            'has_more': has_more
+        }), 200
+    except Exception as e:
+        logger.error(f"全文检索接口异常: {str(e)}", exc_info=True)
+        return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
+
+@app.cli.command('rebuild-search-index')
+@click.option('--type', 'doc_types', multiple=True, type=click.Choice(list(INDEXED_MODELS)),
+              help='只重建指定类型的文档，可重复指定，默认全部')
+def rebuild_search_index_command(doc_types):
+    """重建全文检索索引：flask rebuild-search-index [--type note]"""
+    counts = rebuild_index(doc_types or None)
+    for doc_type, count in counts.items():
+        click.echo(f'{doc_type}: {count} 个文档')
+    click.echo(f'检索索引重建完成，共 {sum(counts.values())} 个文档')
+
+@app.cli.command('rebuild-content-catalog')
+def rebuild_content_catalog_command():
+    """重建内容目录：flask rebuild-content-catalog"""
+    counts = rebuild_catalog()
+    for content_type, count in counts.items():
+        click.echo(f'{content_type}: {count} 条')
+    click.echo(f'内容目录重建完成，共 {sum(counts.values())} 条')
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """检查列表、重名检查等热点查询是否使用了索引：flask check-query-plans"""
+    results = check_query_plans()
+    for result in results:
+        status = '通过' if result['used'] else f"未使用 {result['index']}"
+        click.echo(f"[{status}] {result['name']}: {'; '.join(result['plan'])}")
+    failed = sum(1 for result in results if not result['used'])
+    if failed:
+        raise click.ClickException(f'{failed} 个查询未使用预期的索引')
+    click.echo(f'{len(results)} 个查询都使用了预期的索引')
+
 # -------------------------- 共享链接管理接口 --------------------------
 @app.route('/api/share-links', methods=['POST'])
 @jwt_required()
@@ -1789,21 +2039,182 @@ def create_share_link():
         logger.error(f"创建共享链接接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': f'服务器内部错误: {str(e)}'}), 500
 
+# -------------------------- 协作房间接口 --------------------------
+@app.route('/api/rooms/<string:room_id>/occupancy', methods=['GET'])
+@jwt_required()
+def get_room_occupancy(room_id):
+    """查询协作房间的在线用户（内容所有者或管理员）"""
+    try:
+        user_id = get_jwt_identity()
+        user = User.query.get(user_id)
+        
+        share_link = ShareLink.query.filter_by(room_id=room_id).first()
+        if not share_link:
+            return jsonify({'code': 404, 'message': '房间不存在'}), 404
+        if not user or (not user.is_admin and share_link_owner_id(share_link) != user.id):
+            return jsonify({'code': 403, 'message': '无权限查看该房间'}), 403
+        
+        members = collab_store.members(room_id)
+        return jsonify({
+            'code': 200,
+            'message': '获取成功',
+            'data': {
+                'room_id': room_id,
+                'count': len(members),
+                'users': members
+            }
+        }), 200
+    except Exception as e:
+        logger.error(f"查询房间在线用户接口异常: {str(e)}", exc_info=True)
+        return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
+
+@app.route('/api/admin/rooms', methods=['GET'])
+@jwt_required()
+def get_admin_rooms():
+    """所有有人在线的协作房间及在线人数（管理员）"""
+    try:
+        user_id = get_jwt_identity()
+        user = User.query.get(user_id)
+        
+        if not user or not user.is_admin:
+            return jsonify({'code': 403, 'message': '无管理员权限'}), 403
+        
+        occupancy = collab_store.occupancy()
+        room_list = [
+            {'room_id': room_id, 'count': count}
+            for room_id, count in sorted(occupancy.items(), key=lambda item: item[1], reverse=True)
+        ]
+        return jsonify({
+            'code': 200,
+            'message': '获取成功',
+            'data': room_list,
+            'total_online': sum(occupancy.values())
+        }), 200
+    except Exception as e:
+        logger.error(f"获取协作房间列表接口异常: {str(e)}", exc_info=True)
+        return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
+
+@app.route('/api/admin/db', methods=['GET'])
+@jwt_required()
+def get_admin_db_status():
+    """数据库连接池状态和一次探活查询的耗时（管理员）"""
+    try:
+        user_id = get_jwt_identity()
+        user = User.query.get(user_id)
+        
+        if not user or not user.is_admin:
+            return jsonify({'code': 403, 'message': '无管理员权限'}), 403
+        
+        start = time.perf_counter()
+        db.session.execute(text('SELECT 1'))
+        ping_ms = round((time.perf_counter() - start) * 1000, 3)
+        return jsonify({
+            'code': 200,
+            'message': '获取成功',
+            'data': {
+                'ping_ms': ping_ms,
+                'pool': pool_status(db.engine, app.config)
+            }
+        }), 200
+    except Exception as e:
+        logger.error(f"获取数据库连接池状态接口异常: {str(e)}", exc_info=True)
+        return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
+
 # -------------------------- 定时任务 --------------------------
 def clean_expired_share_links():
     """清理过期的共享链接"""
     try:
         with app.app_context():
             expired_links = ShareLink.query.filter(ShareLink.expire_at < datetime.now()).all()
+            room_ids = [link.room_id for link in expired_links if link.room_id]
             for link in expired_links:
                 db.session.delete(link)
             db.session.commit()
+            for room_id in room_ids:
+                revoke_room(room_id)
             logger.info(f"清理了 {len(expired_links)} 个过期共享链接")
     except Exception as e:
         logger.error(f"清理过期共享链接任务异常: {str(e)}", exc_info=True)
 
+def prune_document_versions():
+    """按保留策略清理各类文档的历史版本"""
+    try:
+        with app.app_context():
+            keep_recent = app.config.get('VERSION_KEEP_RECENT', 50)
+            removed = 0
+            for version_model in (NoteVersion, FlowchartVersion, TableDocumentVersion, WhiteboardVersion, MindmapVersion):
+                parent_column = getattr(version_model, version_model.parent_key)
+                parent_ids = [
+                    row[0] for row in db.session.query(parent_column)
+                    .group_by(parent_column)
+                    .having(db.func.count(version_model.id) > keep_recent)
+                ]
+                for parent_id in parent_ids:
+                    removed += version_model.prune(parent_id)
+                    db.session.commit()
+            logger.info(f"清理了 {removed} 个历史版本")
+    except Exception as e:
+        logger.error(f"清理历史版本任务异常: {str(e)}", exc_info=True)
+
+def clean_export_files():
+    """清理过期的导出任务和导出文件"""
+    try:
+        removed = clean_export_jobs(app)
+        logger.info(f"清理了 {removed} 个过期导出文件")
+    except Exception as e:
+        logger.error(f"清理导出文件任务异常: {str(e)}", exc_info=True)
+
+def refresh_admin_stats():
+    """刷新管理后台统计表"""
+    try:
+        with app.app_context():
+            refresh_daily_stats()
+    except Exception as e:
+        logger.error(f"刷新管理后台统计任务异常: {str(e)}", exc_info=True)
+
+def expire_presence():
+    """清理超时没有心跳的在线连接，并通知所在房间"""
+    try:
+        removed = collab_store.expire()
+        for room_id, sid in removed:
+            socketio.emit('user_left', {'user_id': sid}, room=room_id)
+        if removed:
+            with app.app_context():
+                for room_id in {room_id for room_id, _ in removed}:
+                    close_room(room_id)
+            logger.info(f"清理了 {len(removed)} 个超时的在线连接")
+    except Exception as e:
+        logger.error(f"清理在线连接任务异常: {str(e)}", exc_info=True)
+
+def flush_collab_documents():
+    """把到期的协作文档写回数据库，并淘汰空闲的协作文档"""
+    try:
+        with app.app_context():
+            flushed = flush_documents(collab_store, app.config)
+            evicted = evict_documents(collab_store, app.config)
+            if flushed or evicted:
+                logger.info(f"写回了 {flushed} 个协作文档，淘汰了 {evicted} 个空闲协作文档")
+    except Exception as e:
+        logger.error(f"写回协作文档任务异常: {str(e)}", exc_info=True)
+
+def flush_collab_documents_on_exit():
+    """进程退出前写回所有未写回的协作文档"""
+    try:
+        with app.app_context():
+            flush_documents(collab_store, app.config, force=True)
+    except Exception as e:
+        logger.error(f"退出时写回协作文档异常: {str(e)}", exc_info=True)
+
 # 添加定时任务（每天凌晨执行）
 scheduler.add_job(clean_expired_share_links, 'interval', days=1, start_date=datetime.now() + timedelta(seconds=5))
+scheduler.add_job(prune_document_versions, 'interval', hours=1, start_date=datetime.now() + timedelta(minutes=1))
+scheduler.add_job(clean_export_files, 'interval', hours=1, start_date=datetime.now() + timedelta(minutes=2))
+scheduler.add_job(refresh_admin_stats, 'interval', minutes=app.config.get('ADMIN_STATS_REFRESH_MINUTES', 5),
+                  start_date=datetime.now() + timedelta(seconds=10))
+scheduler.add_job(expire_presence, 'interval', seconds=PRESENCE_TIMEOUT // 3)
+# 写回检查很轻（只读取协作状态存储），频繁执行以便操作数阈值及时生效
+scheduler.add_job(flush_collab_documents, 'interval', seconds=2, max_instances=1, coalesce=True)
+atexit.register(flush_collab_documents_on_exit)
 
 # -------------------------- AI聊天接口 --------------------------
 # 导入OpenAI SDK
@@ -1973,9 +2384,12 @@ def clean_expired_share_links():
     try:
         with app.app_context():
             expired_links = ShareLink.query.filter(ShareLink.expire_at < datetime.now()).all()
+            room_ids = [link.room_id for link in expired_links if link.room_id]
             for link in expired_links:
                 db.session.delete(link)
             db.session.commit()
+            for room_id in room_ids:
+                revoke_room(room_id)
             logger.info(f"清理了 {len(expired_links)} 个过期共享链接")
     except Exception as e:
         logger.error(f"清理过期共享链接任务异常: {str(e)}", exc_info=True)
@@ -1992,34 +2406,11 @@ def get_admin_stats():
         if not user or not user.is_admin:
             return jsonify({'code': 403, 'message': '无管理员权限'}), 403
         
-        # 统计数据
-        user_count = User.query.count()
-        today_users = User.query.filter(User.created_at >= datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)).count()
-        
-        # 计算最近7天用户增长
-        recent_user_growth = []
-        today = datetime.now()
-        for i in range(6, -1, -1):
-            date = today - timedelta(days=i)
-            start_of_day = date.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_of_day = date.replace(hour=23, minute=59, second=59, microsecond=999999)
-            count = User.query.filter(
-                User.created_at >= start_of_day,
-                User.created_at <= end_of_day
-            ).count()
-            recent_user_growth.append(count)
-        
-        stats = {
-            'userCount': user_count,
-            'todayUsers': today_users,
-            'totalNotes': Note.query.count(),
-            'normalNotes': Note.query.count(),
-            'totalTables': TableDocument.query.count(),
-            'totalWhiteboards': Whiteboard.query.count(),
-            'totalMindmaps': Mindmap.query.count(),
-            'totalFlowcharts': Flowchart.query.count(),
-            'recentUserGrowth': recent_user_growth  # 最近7天用户增长
-        }
+        # 统计数据由定时任务写入统计表，这里只读统计表（带进程内缓存）
+        stats = dashboard_stats(
+            refresh_minutes=app.config.get('ADMIN_STATS_REFRESH_MINUTES', 5),
+            cache_seconds=app.config.get('ADMIN_STATS_CACHE_SECONDS', 30)
+        )
         
         return jsonify({
             'code': 200,
@@ -2097,10 +2488,23 @@ def update_user_status(user_id):
         logger.error(f"更新用户状态接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
 
+# 管理员接口的内容类型参数 -> 内容目录中的类型
+ADMIN_CONTENT_TYPES = {
+    'notes': 'note',
+    'tables': 'table',
+    'whiteboards': 'whiteboard',
+    'mindmaps': 'mindmap',
+    'flowcharts': 'flowchart',
+}
+_ADMIN_TYPE_KEYS = {content_type: key for key, content_type in ADMIN_CONTENT_TYPES.items()}
+
 @app.route('/api/admin/content', methods=['GET'])
 @jwt_required()
 def get_admin_content():
-    """获取内容列表（管理员）"""
+    """获取内容列表（管理员）
+
+    直接查询内容目录表，在数据库中完成搜索、排序和分页，只关联一次用户表
+    """
     try:
         user_id = get_jwt_identity()
         user = User.query.get(user_id)
@@ -2109,103 +2513,53 @@ def get_admin_content():
             return jsonify({'code': 403, 'message': '无管理员权限'}), 403
         
         # 获取查询参数
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('page_size', 10))
-        search = request.args.get('search', '')
+        page = max(request.args.get('page', 1, type=int), 1)
+        page_size = min(max(request.args.get('page_size', 10, type=int), 1), 100)
+        search = request.args.get('search', '').strip()
         content_type = request.args.get('type', 'all')
         sort_by = request.args.get('sort_by', 'created_at')
         
-        # 构建查询
-        all_content = []
-        
-        # 查询笔记
-        if content_type == 'all' or content_type == 'notes':
-            notes = Note.query.all()
-            for note in notes:
-                all_content.append({
-                    'id': note.id,
-                    'title': note.title,
-                    'type': '笔记',
-                    'creator': note.author.username if note.author else '未知',
-                    'created_at': note.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                    'updated_at': note.updated_at.strftime('%Y-%m-%d %H:%M:%S')
-                })
-        
-        # 查询表格
-        if content_type == 'all' or content_type == 'tables':
-            tables = TableDocument.query.all()
-            for table in tables:
-                all_content.append({
-                    'id': table.id,
-                    'title': table.title,
-                    'type': '表格',
-                    'creator': table.author.username if table.author else '未知',
-                    'created_at': table.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                    'updated_at': table.updated_at.strftime('%Y-%m-%d %H:%M:%S')
-                })
-        
-        # 查询白板
-        if content_type == 'all' or content_type == 'whiteboards':
-            whiteboards = Whiteboard.query.all()
-            for whiteboard in whiteboards:
-                all_content.append({
-                    'id': whiteboard.id,
-                    'title': whiteboard.title,
-                    'type': '白板',
-                    'creator': whiteboard.author.username if whiteboard.author else '未知',
-                    'created_at': whiteboard.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                    'updated_at': whiteboard.updated_at.strftime('%Y-%m-%d %H:%M:%S')
-                })
-        
-        # 查询脑图
-        if content_type == 'all' or content_type == 'mindmaps':
-            mindmaps = Mindmap.query.all()
-            for mindmap in mindmaps:
-                all_content.append({
-                    'id': mindmap.id,
-                    'title': mindmap.title,
-                    'type': '脑图',
-                    'creator': mindmap.author.username if mindmap.author else '未知',
-                    'created_at': mindmap.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                    'updated_at': mindmap.updated_at.strftime('%Y-%m-%d %H:%M:%S')
-                })
-        
-        # 查询流程图
-        if content_type == 'all' or content_type == 'flowcharts':
-            flowcharts = Flowchart.query.all()
-            for flowchart in flowcharts:
-                all_content.append({
-                    'id': flowchart.id,
-                    'title': flowchart.title,
-                    'type': '流程图',
-                    'creator': flowchart.author.username if flowchart.author else '未知',
-                    'created_at': flowchart.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                    'updated_at': flowchart.updated_at.strftime('%Y-%m-%d %H:%M:%S')
-                })
-        
-        # 搜索过滤
+        filters = []
+        if content_type != 'all':
+            filters.append(ContentItem.content_type == ADMIN_CONTENT_TYPES.get(content_type))
         if search:
-            all_content = [item for item in all_content if search.lower() in item['title'].lower() or search.lower() in item['creator'].lower()]
-        
-        # 排序
-        if sort_by == 'created_at':
-            all_content.sort(key=lambda x: x['created_at'], reverse=True)
-        elif sort_by == 'updated_at':
-            all_content.sort(key=lambda x: x['updated_at'], reverse=True)
-        elif sort_by == 'title':
-            all_content.sort(key=lambda x: x['title'])
-        
-        # 分页
-        total = len(all_content)
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_content = all_content[start:end]
+            # 搜索标题或创建者用户名
+            pattern = f'%{escape_like(search)}%'
+            matched_users = db.select(User.id).where(User.username.like(pattern, escape='\\'))
+            filters.append(or_(ContentItem.title.like(pattern, escape='\\'), ContentItem.user_id.in_(matched_users)))
+        
+        total = db.session.execute(db.select(func.count(ContentItem.id)).where(*filters)).scalar()
+        
+        # 排序：同一时间/标题的内容再按ID排序，保证翻页结果稳定
+        order = {
+            'updated_at': ContentItem.updated_at.desc(),
+            'title': ContentItem.title.asc()
+        }.get(sort_by, ContentItem.created_at.desc())
+        rows = db.session.execute(
+            db.select(ContentItem, User.username)
+            .outerjoin(User, User.id == ContentItem.user_id)
+            .where(*filters)
+            .order_by(order, ContentItem.id.desc())
+            .limit(page_size)
+            .offset((page - 1) * page_size)
+        ).all()
+        
+        items = [{
+            'id': item.content_id,
+            'title': item.title,
+            'type': CATALOG_MODELS[item.content_type][1],
+            'content_type': _ADMIN_TYPE_KEYS[item.content_type],
+            'size': item.size,
+            'creator': username or '未知',
+            'created_at': item.created_at.strftime('%Y-%m-%d %H:%M:%S') if item.created_at else None,
+            'updated_at': item.updated_at.strftime('%Y-%m-%d %H:%M:%S') if item.updated_at else None
+        } for item, username in rows]
         
         return jsonify({
             'code': 200,
             'message': '获取成功',
             'data': {
-                'items': paginated_content,
+                'items': items,
                 'total': total,
                 'page': page,
                 'page_size': page_size
@@ -2218,7 +2572,11 @@ def get_admin_content():
 @app.route('/api/admin/content/<int:content_id>', methods=['DELETE'])
 @jwt_required()
 def delete_admin_content(content_id):
-    """删除内容（管理员）"""
+    """删除内容（管理员）
+
+    参数：type 内容类型（notes/tables/whiteboards/mindmaps/flowcharts），不同类型的内容ID可能相同，
+    未指定类型且ID对应多个内容时拒绝删除
+    """
     try:
         user_id = get_jwt_identity()
         user = User.query.get(user_id)
@@ -2226,42 +2584,24 @@ def delete_admin_content(content_id):
         if not user or not user.is_admin:
             return jsonify({'code': 403, 'message': '无管理员权限'}), 403
         
-        # 尝试删除笔记
-        note = Note.query.get(content_id)
-        if note:
-            db.session.delete(note)
-            db.session.commit()
-            return jsonify({'code': 200, 'message': '删除成功'}), 200
+        content_type = request.args.get('type')
+        if content_type and content_type not in ADMIN_CONTENT_TYPES:
+            return jsonify({'code': 400, 'message': '不支持的内容类型'}), 400
         
-        # 尝试删除表格
-        table = TableDocument.query.get(content_id)
-        if table:
-            db.session.delete(table)
-            db.session.commit()
-            return jsonify({'code': 200, 'message': '删除成功'}), 200
+        items = find_content(content_id, ADMIN_CONTENT_TYPES.get(content_type))
+        if not items:
+            return jsonify({'code': 404, 'message': '内容不存在'}), 404
+        if len(items) > 1:
+            return jsonify({'code': 400, 'message': '存在多个相同ID的内容，请指定内容类型'}), 400
         
-        # 尝试删除白板
-        whiteboard = Whiteboard.query.get(content_id)
-        if whiteboard:
-            db.session.delete(whiteboard)
-            db.session.commit()
-            return jsonify({'code': 200, 'message': '删除成功'}), 200
-        
-        # 尝试删除脑图
-        mindmap = Mindmap.query.get(content_id)
-        if mindmap:
-            db.session.delete(mindmap)
-            db.session.commit()
-            return jsonify({'code': 200, 'message': '删除成功'}), 200
+        model = CATALOG_MODELS[items[0].content_type][0]
+        content = db.session.get(model, content_id)
+        if not content:
+            return jsonify({'code': 404, 'message': '内容不存在'}), 404
         
-        # 尝试删除流程图
-        flowchart = Flowchart.query.get(content_id)
-        if flowchart:
-            db.session.delete(flowchart)
-            db.session.commit()
-            return jsonify({'code': 200, 'message': '删除成功'}), 200
-        
-        return jsonify({'code': 404, 'message': '内容不存在'}), 404
+        db.session.delete(content)
+        db.session.commit()
+        return jsonify({'code': 200, 'message': '删除成功'}), 200
     except Exception as e:
         logger.error(f"删除内容接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
@@ -2269,7 +2609,11 @@ def delete_admin_content(content_id):
 @app.route('/api/admin/export', methods=['GET'])
 @jwt_required()
 def export_admin_data():
-    """导出数据（管理员）"""
+    """导出数据（管理员），边查询边输出
+
+    参数：format 导出格式（ndjson/csv，默认ndjson），dataset 数据集（all/users/content，CSV不支持all），
+    gzip=1 时输出 gzip 压缩文件
+    """
     try:
         user_id = get_jwt_identity()
         user = User.query.get(user_id)
@@ -2277,144 +2621,96 @@ def export_admin_data():
         if not user or not user.is_admin:
             return jsonify({'code': 403, 'message': '无管理员权限'}), 403
         
-        # 准备导出数据
-        export_data = {
-            'users': {
-                'data': [],
-                'summary': {
-                    'total_users': 0,
-                    'today_users': 0,
-                    'recent_users': 0
-                }
-            },
-            'content': {
-                'data': [],
-                'summary': {
-                    'total_content': 0,
-                    'notes': 0,
-                    'tables': 0,
-                    'whiteboards': 0,
-                    'mindmaps': 0,
-                    'flowcharts': 0
-                }
-            }
-        }
+        export_format = request.args.get('format', 'ndjson')
+        dataset = request.args.get('dataset', 'all')
+        compress = request.args.get('gzip', '0') in ('1', 'true')
+        error = validate_export(export_format, dataset)
+        if error:
+            return jsonify({'code': 400, 'message': error}), 400
+        
+        filename = export_filename(export_format, dataset, compress)
+        mimetype = 'application/gzip' if compress else f'{EXPORT_FORMATS[export_format][0]}; charset=utf-8'
+        return Response(
+            stream_with_context(export_stream(export_format, dataset, compress)),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+    except Exception as e:
+        logger.error(f"导出数据接口异常: {str(e)}", exc_info=True)
+        return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
+
+@app.route('/api/admin/export/jobs', methods=['POST'])
+@jwt_required()
+def create_export_job():
+    """创建异步导出任务（管理员），数据写入服务器上的文件，完成后通过下载接口获取"""
+    try:
+        user_id = get_jwt_identity()
+        user = User.query.get(user_id)
         
-        # 导出用户数据
-        users = User.query.all()
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        recent_7_days = today - timedelta(days=7)
-        today_users_count = 0
-        recent_users_count = 0
+        if not user or not user.is_admin:
+            return jsonify({'code': 403, 'message': '无管理员权限'}), 403
         
-        for u in users:
-            user_data = {
-                'id': u.id,
-                'username': u.username,
-                'email': u.email,
-                'is_admin': u.is_admin,
-                'created_at': u.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                'last_login': u.last_login.strftime('%Y-%m-%d %H:%M:%S') if u.last_login else 'N/A'
-            }
-            export_data['users']['data'].append(user_data)
-            
-            # 统计今日新增用户
-            if u.created_at >= today:
-                today_users_count += 1
-            
-            # 统计近日新增用户（最近7天）
-            if u.created_at >= recent_7_days:
-                recent_users_count += 1
-        
-        # 填充用户统计数据
-        export_data['users']['summary']['total_users'] = len(users)
-        export_data['users']['summary']['today_users'] = today_users_count
-        export_data['users']['summary']['recent_users'] = recent_users_count
-        
-        # 导出内容数据
-        all_content = []
-        
-        # 导出笔记
-        notes = Note.query.all()
-        for note in notes:
-            content_data = {
-                'id': note.id,
-                'title': note.title,
-                'type': '笔记',
-                'creator': note.author.username if note.author else '未知',
-                'created_at': note.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                'updated_at': note.updated_at.strftime('%Y-%m-%d %H:%M:%S')
-            }
-            all_content.append(content_data)
-        
-        # 导出表格
-        tables = TableDocument.query.all()
-        for table in tables:
-            content_data = {
-                'id': table.id,
-                'title': table.title,
-                'type': '表格',
-                'creator': table.author.username if table.author else '未知',
-                'created_at': table.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                'updated_at': table.updated_at.strftime('%Y-%m-%d %H:%M:%S')
-            }
-            all_content.append(content_data)
-        
-        # 导出白板
-        whiteboards = Whiteboard.query.all()
-        for whiteboard in whiteboards:
-            content_data = {
-                'id': whiteboard.id,
-                'title': whiteboard.title,
-                'type': '白板',
-                'creator': whiteboard.author.username if whiteboard.author else '未知',
-                'created_at': whiteboard.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                'updated_at': whiteboard.updated_at.strftime('%Y-%m-%d %H:%M:%S')
-            }
-            all_content.append(content_data)
-        
-        # 导出脑图
-        mindmaps = Mindmap.query.all()
-        for mindmap in mindmaps:
-            content_data = {
-                'id': mindmap.id,
-                'title': mindmap.title,
-                'type': '脑图',
-                'creator': mindmap.author.username if mindmap.author else '未知',
-                'created_at': mindmap.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                'updated_at': mindmap.updated_at.strftime('%Y-%m-%d %H:%M:%S')
-            }
-            all_content.append(content_data)
-        
-        # 导出流程图
-        flowcharts = Flowchart.query.all()
-        for flowchart in flowcharts:
-            content_data = {
-                'id': flowchart.id,
-                'title': flowchart.title,
-                'type': '流程图',
-                'creator': flowchart.author.username if flowchart.author else '未知',
-                'created_at': flowchart.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                'updated_at': flowchart.updated_at.strftime('%Y-%m-%d %H:%M:%S')
-            }
-            all_content.append(content_data)
+        data = request.json or {}
+        export_format = data.get('format', 'ndjson')
+        dataset = data.get('dataset', 'all')
+        error = validate_export(export_format, dataset)
+        if error:
+            return jsonify({'code': 400, 'message': error}), 400
         
-        # 填充内容数据
-        export_data['content']['data'] = all_content
-        export_data['content']['summary']['total_content'] = len(all_content)
-        export_data['content']['summary']['notes'] = len(notes)
-        export_data['content']['summary']['tables'] = len(tables)
-        export_data['content']['summary']['whiteboards'] = len(whiteboards)
-        export_data['content']['summary']['mindmaps'] = len(mindmaps)
-        export_data['content']['summary']['flowcharts'] = len(flowcharts)
+        job = start_export_job(app, user.id, export_format, dataset, bool(data.get('gzip')))
+        return jsonify({
+            'code': 202,
+            'message': '导出任务已创建',
+            'data': job
+        }), 202
+    except Exception as e:
+        logger.error(f"创建导出任务接口异常: {str(e)}", exc_info=True)
+        return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
+
+@app.route('/api/admin/export/jobs/<string:job_id>', methods=['GET'])
+@jwt_required()
+def get_export_job_status(job_id):
+    """查询导出任务进度（管理员）"""
+    try:
+        user_id = get_jwt_identity()
+        user = User.query.get(user_id)
+        
+        if not user or not user.is_admin:
+            return jsonify({'code': 403, 'message': '无管理员权限'}), 403
+        
+        job = get_export_job(job_id)
+        if not job:
+            return jsonify({'code': 404, 'message': '导出任务不存在'}), 404
         
         return jsonify({
             'code': 200,
-            'message': '导出成功',
-            'data': export_data
+            'message': '获取成功',
+            'data': job.to_dict()
         }), 200
     except Exception as e:
-        logger.error(f"导出数据接口异常: {str(e)}", exc_info=True)
+        logger.error(f"查询导出任务接口异常: {str(e)}", exc_info=True)
+        return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
+
+@app.route('/api/admin/export/jobs/<string:job_id>/download', methods=['GET'])
+@jwt_required()
+def download_export_job(job_id):
+    """下载已完成的导出文件（管理员）"""
+    try:
+        user_id = get_jwt_identity()
+        user = User.query.get(user_id)
+        
+        if not user or not user.is_admin:
+            return jsonify({'code': 403, 'message': '无管理员权限'}), 403
+        
+        job = get_export_job(job_id)
+        if not job:
+            return jsonify({'code': 404, 'message': '导出任务不存在'}), 404
+        if job.status != 'finished':
+            return jsonify({'code': 409, 'message': '导出任务尚未完成'}), 409
+        
+        return send_from_directory(export_folder(app), job.stored_name, as_attachment=True, download_name=job.filename)
+    except Exception as e:
+        logger.error(f"下载导出文件接口异常: {str(e)}", exc_info=True)
         return jsonify({'code': 500, 'message': '服务器内部错误'}), 500
 
 # -------------------------- 错误处理 --------------------------
@@ -2459,7 +2755,8 @@ def get_shared_content(token):
         
         # 根据类型获取内容
         if share_link.note_id:
-            note = Note.query.get(share_link.note_id)
+            note = Note.query.options(joinedload(Note.category), selectinload(Note.tags)) \
+                .filter_by(id=share_link.note_id).first()
             if not note:
                 return jsonify({'code': 404, 'message': '分享的笔记不存在'}), 404
             response.update({
@@ -2727,60 +3024,95 @@ def get_shared_content_html(token):
 
 # -------------------------- WebSocket事件处理 --------------------------
 @socketio.on('connect')
-def handle_connect():
-    """处理客户端连接"""
-    print(f'客户端 {request.sid} 已连接')
-    emit('connected', {'message': '连接成功', 'sid': request.sid})
+def handle_connect(auth=None):
+    """处理客户端连接
+
+    auth 中的 token 为登录用户的 JWT，无效时拒绝连接，未携带时作为访客；encodings 为客户端支持的消息编码
+    """
+    identity = room_auth.authenticate(request.sid, auth)
+    logger.debug(f'客户端 {request.sid} 已连接（用户 {identity.user_id or "访客"}）')
+    encoding = payload_codec.negotiate(request.sid, (auth or {}).get('encodings') if isinstance(auth, dict) else None)
+    # 客户端按 heartbeat_interval（秒）发送心跳，超过 PRESENCE_TIMEOUT 没有心跳视为离线
+    emit('connected', {
+        'message': '连接成功',
+        'sid': request.sid,
+        'heartbeat_interval': PRESENCE_TIMEOUT // 3,
+        'encoding': encoding
+    })
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """处理客户端断开连接"""
-    print(f'客户端 {request.sid} 已断开连接')
-    # 从所有房间中移除用户
-    for room_id in online_users.keys():
-        if request.sid in online_users[room_id]:
-            online_users[room_id].remove(request.sid)
-            # 通知房间内其他用户有用户离开
-            emit('user_left', {'user_id': request.sid}, room=room_id)
-            # 如果房间为空，删除房间
-            if not online_users[room_id]:
-                del online_users[room_id]
-            break
+    logger.debug(f'客户端 {request.sid} 已断开连接')
+    broadcaster.discard(request.sid)
+    payload_codec.forget(request.sid)
+    room_auth.forget(request.sid)
+    # 按 sid 索引找到该连接所在的房间，逐个移除
+    for room_id in collab_store.leave_all(request.sid):
+        # 通知房间内其他用户有用户离开
+        emit('user_left', {'user_id': request.sid}, room=room_id, include_self=False)
+        close_room(room_id)
+
+@socketio.on('heartbeat')
+def handle_heartbeat(data=None):
+    """处理客户端心跳；连接已因超时被清理时重新加入房间"""
+    if collab_store.heartbeat(request.sid):
+        return
+    if data and data.get('room_id'):
+        handle_join_room({**data, 'rejoin': True})
 
 @socketio.on('join_room')
 def handle_join_room(data):
-    """处理用户加入房间"""
+    """处理用户加入房间：房间的所有者可直接加入，其他人需要提供共享链接的 share_token
+
+    加入后直接收到房间所分享文档的状态，不需要再请求 get_document_state；
+    重连的客户端可以带上 since（已有的版本号），只补取错过的操作
+    """
     room_id = data.get('room_id')
-    user_info = data.get('user_info', {})
+    user_info = data.get('user_info') or {}
     if not room_id:
         emit('error', {'message': '房间ID不能为空'})
         return
     
+    try:
+        room_auth.authorize(request.sid, room_id, data.get('share_token'))
+    except PermissionError as e:
+        emit('error', {'message': str(e), 'room_id': room_id})
+        return
+    if (room_id not in rooms() and
+            len(collab_store.members(room_id)) >= app.config['COLLAB_ROOM_MAX_CONNECTIONS']):
+        room_auth.leave(request.sid, room_id)
+        emit('error', {'message': '房间人数已满', 'room_id': room_id})
+        return
+    
     # 加入房间
     join_room(room_id)
     
-    # 更新在线用户列表
-    if room_id not in online_users:
-        online_users[room_id] = []
-    online_users[room_id].append({
+    # 更新在线用户列表：登录用户以认证结果为准，访客只使用客户端提供的显示名称
+    identity = room_auth.identity(request.sid)
+    if identity.is_guest:
+        username = str(user_info.get('username') or f'访客{request.sid[:5]}')[:50]
+    else:
+        username = identity.username
+    member = {
         'sid': request.sid,
-        'user_id': user_info.get('id', request.sid),
-        'username': user_info.get('username', f'用户{request.sid[:5]}')
-    })
+        'user_id': identity.user_id or request.sid,
+        'username': username
+    }
+    collab_store.join(room_id, request.sid, member)
     
     # 通知房间内其他用户有新用户加入
-    emit('user_joined', {
-        'user': {
-            'sid': request.sid,
-            'user_id': user_info.get('id', request.sid),
-            'username': user_info.get('username', f'用户{request.sid[:5]}')
-        }
-    }, room=room_id)
+    emit('user_joined', {'user': member}, room=room_id)
     
     # 发送当前房间的在线用户列表给新加入的用户
-    emit('online_users', {'users': online_users[room_id]})
+    emit('online_users', {'users': collab_store.members(room_id)})
+    
+    # 发送房间文档的状态（心跳重新加入时客户端的文档状态仍然有效，不需要发送）
+    grant = room_auth.grant(room_id)
+    if grant and grant.content_type in COLLAB_DOC_TYPES and not data.get('rejoin'):
+        emit_document_state(grant.content_type, grant.content_id, data.get('since'))
     
-    print(f'客户端 {request.sid} 加入了房间 {room_id}')
+    logger.debug(f'客户端 {request.sid} 加入了房间 {room_id}')
 
 @socketio.on('leave_room')
 def handle_leave_room(data):
@@ -2792,95 +3124,275 @@ def handle_leave_room(data):
     
     # 离开房间
     leave_room(room_id)
+    room_auth.leave(request.sid, room_id)
     
     # 更新在线用户列表
-    if room_id in online_users:
-        online_users[room_id] = [user for user in online_users[room_id] if user['sid'] != request.sid]
+    if collab_store.leave(room_id, request.sid):
         # 通知房间内其他用户有用户离开
         emit('user_left', {'user_id': request.sid}, room=room_id)
-        # 如果房间为空，删除房间
-        if not online_users[room_id]:
-            del online_users[room_id]
+        close_room(room_id)
     
-    print(f'客户端 {request.sid} 离开了房间 {room_id}')
+    logger.debug(f'客户端 {request.sid} 离开了房间 {room_id}')
 
 @socketio.on('send_message')
 def handle_send_message(data):
     """处理发送消息"""
     room_id = data.get('room_id')
     message = data.get('message')
-    sender_id = data.get('sender_id', request.sid)
     timestamp = data.get('timestamp', datetime.now().isoformat())
     
     if not room_id or not message:
         emit('error', {'message': '房间ID和消息不能为空'})
         return
+    if not room_auth.permission(request.sid, room_id):
+        emit('error', {'message': '未加入该房间'})
+        return
+    identity = room_auth.identity(request.sid)
+    sender_id = identity.user_id or request.sid
     
-    # 广播消息给房间内所有用户（除了发送者）
-    emit('new_message', {
+    # 批量广播给房间内所有用户，发送过快时拒绝
+    if not broadcaster.publish(room_id, 'new_message', {
         'sender_id': sender_id,
         'message': message,
         'timestamp': timestamp
-    }, room=room_id)
+    }, sender=request.sid):
+        emit('error', {'message': '消息发送过于频繁，请稍后再试'})
+        return
     
-    print(f'客户端 {sender_id} 在房间 {room_id} 发送了消息: {message}')
+    logger.debug(f'客户端 {sender_id} 在房间 {room_id} 发送了消息')
+
+@socketio.on('cursor')
+def handle_cursor(data):
+    """处理光标位置变化：同一用户只发送最新的位置"""
+    room_id = data.get('room_id')
+    if not room_id or not room_auth.permission(request.sid, room_id):
+        return
+    broadcaster.publish(room_id, 'cursor_moved', {
+        'user_id': request.sid,
+        'doc_id': data.get('doc_id'),
+        'range': data.get('range')
+    }, skip=request.sid, sender=request.sid, ephemeral=True)
+
+@socketio.on('typing')
+def handle_typing(data):
+    """处理输入状态变化：同一用户只发送最新的状态"""
+    room_id = data.get('room_id')
+    if not room_id or not room_auth.permission(request.sid, room_id):
+        return
+    broadcaster.publish(room_id, 'user_typing', {
+        'user_id': request.sid,
+        'typing': bool(data.get('typing'))
+    }, skip=request.sid, sender=request.sid, ephemeral=True)
+
+def close_room(room_id):
+    """房间最后一个用户离开后，要求尽快写回房间对应的协作文档"""
+    if collab_store.members(room_id):
+        return
+    share_link = ShareLink.query.filter_by(room_id=room_id).first()
+    if share_link and share_link.note_id:
+        request_flush(collab_store, f'note:{share_link.note_id}')
+
+def note_delta(note):
+    """笔记内容转换为协作文档的 Delta"""
+    content = content_to_delta(note.content)
+    # Quill 编辑器中的富文本总是以换行结尾
+    last_insert = content.ops[-1].get('insert') if content.ops else None
+    if note.type != 'markdown' and not (isinstance(last_insert, str) and last_insert.endswith('\n')):
+        content.push({'insert': '\n'})
+    return content
+
+def get_collab_document(doc_type, doc_id):
+    """获取协作文档，首次访问时从数据库加载；文档不存在时返回 None"""
+    doc_key = f'{doc_type}:{doc_id}'
+    doc = collab_store.get_document(doc_key)
+    if doc is None:
+        note = Note.query.get(doc_id)
+        if not note:
+            return None
+        # 其他请求可能同时加载了同一文档，以先保存的为准；被淘汰过的文档沿用原来的版本号
+        collab_store.add_document(doc_key, CollabDocument(note_delta(note), collab_store.revision(doc_key)))
+        doc = collab_store.get_document(doc_key)
+    return doc
+
+def reload_collab_document(note):
+    """编辑、回滚接口修改了笔记内容后，用数据库中的内容替换协作文档
+
+    缓存中的文档（包括房间已空、尚未淘汰的）如果保留，之后加入的用户会拿到旧内容，
+    其编辑写回时会覆盖接口保存的内容。新文档的版本号在原有基础上递增，基于旧版本的操作超出历史而被拒绝，
+    房间内的连接收到新的 document_state。从未参与协作的笔记不需要处理
+    """
+    doc_key = f'note:{note.id}'
+    with collab_store.lock(doc_key):
+        current = collab_store.get_document(doc_key, touch=False)
+        base_version = current.version if current is not None else collab_store.revision(doc_key)
+        if current is None and not base_version:
+            return
+        doc = CollabDocument(note_delta(note), base_version + 1)
+        collab_store.save_document(doc_key, doc)
+        # 读取一次以登记访问时间，文档空闲后照常被淘汰
+        collab_store.get_document(doc_key)
+    
+    state = {'doc_id': note.id, 'doc_type': 'note', 'reloaded': True, **doc.state()}
+    for share_link in ShareLink.query.filter(ShareLink.note_id == note.id, ShareLink.room_id.isnot(None)):
+        broadcaster.publish(share_link.room_id, 'document_state', state)
 
 @socketio.on('sync_document')
 def handle_sync_document(data):
-    """处理文档同步"""
+    """处理文档同步：合并客户端的编辑操作，只向房间广播变换后的操作
+
+    version 是操作所基于的版本号，落后时服务端把操作变换到最新版本之上（ack 中 rebased 为 true）；
+    op_id 是客户端生成的操作ID，重发已合并过的操作时只返回确认，不会重复合并
+    """
+    if not isinstance(data, dict):
+        emit('error', {'message': '消息格式不正确'})
+        return
     room_id = data.get('room_id')
     doc_id = data.get('doc_id')
     doc_type = data.get('doc_type')
-    doc_content = data.get('content')
-    version = data.get('version', 0)
     
-    if not room_id or not doc_id or not doc_type or doc_content is None:
-        emit('error', {'message': '房间ID、文档ID、文档类型和内容不能为空'})
+    if not room_id or not doc_id or not doc_type:
+        emit('error', {'message': '房间ID、文档ID、文档类型、操作和版本号不能为空'})
+        return
+    if doc_type not in COLLAB_DOC_TYPES:
+        emit('error', {'message': '不支持的文档类型'})
+        return
+    # 只有已加入分享该文档的房间、且有编辑权限的连接可以提交操作；房间被撤销后连接已被移出房间。
+    # 权限检查在解码消息体之前，未授权的连接发来的编码消息不会被解压
+    permission = room_auth.permission(request.sid, room_id, doc_type, doc_id)
+    if permission is None or room_id not in rooms():
+        emit('error', {'message': '无权限编辑该文档'})
+        return
+    if permission != 'edit':
+        emit('error', {'message': '只读权限不能编辑'})
         return
     
-    # 更新文档状态
+    try:
+        data = payload_codec.decode(data)
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+        return
+    ops = data.get('ops')
+    version = data.get('version')
+    op_id = data.get('op_id')
+    if ops is None or not isinstance(version, int):
+        emit('error', {'message': '房间ID、文档ID、文档类型、操作和版本号不能为空'})
+        return
+    
+    if get_collab_document(doc_type, doc_id) is None:
+        emit('error', {'message': '文档不存在'})
+        return
+    
+    # 多个进程可能同时合并同一文档，加锁后读取最新状态再合并；
+    # 保存时比较版本号，锁超时后被其他进程抢先写入时重新读取再合并
     doc_key = f'{doc_type}:{doc_id}'
-    collaborative_docs[doc_key] = {
-        'content': doc_content,
-        'version': version,
-        'last_updated': datetime.now().isoformat()
-    }
+    timestamp = datetime.now().isoformat()
+    identity = room_auth.identity(request.sid)
+    editor = identity.user_id if identity else None
+    try:
+        with collab_store.lock(doc_key):
+            for _ in range(SAVE_RETRIES):
+                # 加入房间后文档可能已被后台任务淘汰，此时从数据库重新加载
+                doc = collab_store.get_document(doc_key) or get_collab_document(doc_type, doc_id)
+                if doc is None:
+                    raise SyncError('文档不存在')
+                applied_version = doc.find_operation(op_id)
+                if applied_version is not None:
+                    emit('document_ack', {'doc_id': doc_id, 'doc_type': doc_type, 'version': applied_version,
+                                          'op_id': op_id, 'duplicate': True, 'timestamp': timestamp})
+                    return
+                current_version = doc.version
+                new_version, applied_ops = doc.apply(version, ops, op_id, editor=editor)
+                if collab_store.save_document(doc_key, doc, expected_version=current_version):
+                    break
+            else:
+                raise SyncError('文档正在被频繁修改，请重新获取文档')
+    except (SyncError, LockTimeout) as e:
+        # 无法合并或等待文档锁超时时拒绝该操作，把完整文档发回给客户端，由客户端重新开始
+        message = '文档正忙，请稍后重试' if isinstance(e, LockTimeout) else str(e)
+        doc = collab_store.get_document(doc_key) or get_collab_document(doc_type, doc_id)
+        if doc is None:
+            emit('error', {'message': '文档不存在'})
+            return
+        emit('document_state', payload_codec.encode(request.sid, {
+            'doc_id': doc_id, 'doc_type': doc_type, 'rejected': True, 'op_id': op_id, 'message': message, **doc.state()
+        }))
+        return
     
-    # 广播文档更新给房间内所有用户（除了发送者）
-    emit('document_updated', {
+    ack = {
         'doc_id': doc_id,
         'doc_type': doc_type,
-        'content': doc_content,
-        'version': version,
-        'timestamp': datetime.now().isoformat()
-    }, room=room_id)
-    
-    print(f'文档 {doc_key} 已更新，版本: {version}')
+        'version': new_version,
+        'op_id': op_id,
+        'rebased': version < new_version - 1,
+        'timestamp': timestamp
+    }
+    # 变换后的操作发给房间内的其他用户，确认发给发送者；两者进入同一个发送队列，
+    # 发送者收到确认之前一定已经收到了版本号更小的其他人的操作
+    broadcaster.publish(room_id, 'document_operation', {
+        'doc_id': doc_id,
+        'doc_type': doc_type,
+        'ops': applied_ops,
+        'version': new_version,
+        'sender': request.sid,
+        'timestamp': timestamp
+    }, skip=request.sid)
+    broadcaster.publish(room_id, 'document_ack', ack, to=request.sid)
 
 @socketio.on('get_document_state')
 def handle_get_document_state(data):
-    """获取文档当前状态"""
+    """获取文档当前状态
+
+    带 since（客户端已有的版本号）时只返回之后合并的操作（document_operations），
+    断线重连的客户端不需要重新下载整篇文档；since 超出服务端保留的历史时仍返回完整文档
+    """
+    if not isinstance(data, dict):
+        emit('error', {'message': '消息格式不正确'})
+        return
     doc_id = data.get('doc_id')
     doc_type = data.get('doc_type')
     
     if not doc_id or not doc_type:
         emit('error', {'message': '文档ID和类型不能为空'})
         return
+    if doc_type not in COLLAB_DOC_TYPES:
+        emit('error', {'message': '不支持的文档类型'})
+        return
+    if not room_auth.can_read(request.sid, doc_type, doc_id):
+        emit('error', {'message': '无权限查看该文档'})
+        return
     
-    # 获取文档状态
-    doc_key = f'{doc_type}:{doc_id}'
-    doc_state = collaborative_docs.get(doc_key, {
-        'content': None,
-        'version': 0,
-        'last_updated': datetime.now().isoformat()
-    })
+    try:
+        since = payload_codec.decode(data).get('since')
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+        return
     
-    # 发送文档状态给请求者
-    emit('document_state', {
+    emit_document_state(doc_type, doc_id, since)
+
+def emit_document_state(doc_type, doc_id, since=None):
+    """把文档状态发给当前连接：since 在保留的历史内时只发送之后的操作，否则发送快照和其后的操作"""
+    doc = get_collab_document(doc_type, doc_id)
+    if doc is None:
+        emit('error', {'message': '文档不存在'})
+        return
+    
+    if isinstance(since, int) and not isinstance(since, bool):
+        operations = doc.operations_since(since)
+        if operations is not None:
+            emit('document_operations', payload_codec.encode(request.sid, {
+                'doc_id': doc_id,
+                'doc_type': doc_type,
+                'since': since,
+                'version': since + len(operations),
+                'operations': operations
+            }))
+            return
+    
+    emit('document_state', payload_codec.encode(request.sid, {
         'doc_id': doc_id,
         'doc_type': doc_type,
-        **doc_state
-    })
+        **doc.state()
+    }))
 
 # -------------------------- 主函数 --------------------------
 if __name__ == '__main__':
@@ -2892,6 +3404,9 @@ if __name__ == '__main__':
     scheduler.add_job(clean_expired_share_links, 'interval', days=1)
     scheduler.start()
     
+    if socketio.async_mode == 'eventlet' and not eventlet_patched():
+        logger.warning("eventlet 服务器未打补丁：数据库查询和等待连接会阻塞事件循环，建议设置 DB_POOL_MODE=green")
+    
     # 启动应用
     # 使用socketio.run而不是app.run来支持WebSocket
     socketio.run(app, debug=app.config['DEBUG'], host='0.0.0.0', port=5000)
@@ -0,0 +1,111 @@
+"""房间广播的批量发送
+
+高频的房间事件（光标移动、输入状态、连续的文档操作、聊天消息）不再逐条 emit，而是先放入房间的发送队列，
+每隔 interval_ms 毫秒把一个房间内所有待发的事件合并成一个 room_batch 帧发出，客户端按顺序逐条分发。
+
+- 临时事件（ephemeral，例如光标位置）同一连接的同名事件只保留最新的一条；
+  房间内待发的临时事件超过 room_limit 时丢弃最旧的
+- 其他事件按发布顺序全部送达。指定了 sender 的事件（例如聊天消息）每个连接一帧内最多 client_limit 条，
+  超过时拒绝发布，由调用方提示客户端稍后再发；文档操作每个客户端同时只有一个等待确认，不需要限制
+- 每条事件可以指定 skip（该连接忽略，相当于 include_self=False）或 to（只发给该连接，例如文档操作的确认）。
+  to 事件不进入房间帧，单独以 room_batch 发给该连接；发送时按发布顺序把连续的同一目标的事件合并为一帧，
+  房间帧和单独发送的帧之间仍保持发布顺序
+
+限流只作用于发布端：房间的临时事件队列有上限、每个发送者一帧内的聊天消息数有上限。服务端不为每个接收连接
+维护独立的发送队列，接收慢的连接由 Socket.IO 的传输层缓冲，这里不会按接收者丢弃事件。
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class RoomBroadcaster:
+    """按房间合并事件并定时批量发送"""
+
+    def __init__(self, socketio, interval_ms=50, room_limit=100, client_limit=20):
+        self.socketio = socketio
+        self.interval = interval_ms / 1000
+        self.room_limit = room_limit
+        self.client_limit = client_limit
+        self._events = {}  # 房间ID -> [(序号, 接收连接, 事件)]
+        self._ephemeral = {}  # 房间ID -> OrderedDict((事件名, 发送者) -> (序号, 接收连接, 事件))
+        self._pending = {}  # 发送者 -> 本帧内待发的事件数
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._task = None
+
+    def publish(self, room_id, event, data, skip=None, to=None, sender=None, ephemeral=False):
+        """把事件放入房间的发送队列，连接超出发送上限时返回 False"""
+        entry = {'event': event, 'data': data}
+        if skip:
+            entry['skip'] = skip
+        with self._lock:
+            self._seq += 1
+            if ephemeral:
+                queue = self._ephemeral.setdefault(room_id, OrderedDict())
+                key = (event, sender)
+                queue.pop(key, None)
+                queue[key] = (self._seq, to, entry)
+                while len(queue) > self.room_limit:
+                    queue.popitem(last=False)
+            else:
+                if sender:
+                    if self._pending.get(sender, 0) >= self.client_limit:
+                        return False
+                    self._pending[sender] = self._pending.get(sender, 0) + 1
+                self._events.setdefault(room_id, []).append((self._seq, to, entry))
+        self.start()
+        return True
+
+    def discard(self, sid):
+        """连接断开时清除其待发的临时事件"""
+        with self._lock:
+            self._pending.pop(sid, None)
+            for queue in self._ephemeral.values():
+                for key in [key for key in queue if key[1] == sid]:
+                    del queue[key]
+
+    def flush(self):
+        """发送所有房间的待发事件，返回发送的帧数"""
+        with self._lock:
+            events, self._events = self._events, {}
+            ephemeral, self._ephemeral = self._ephemeral, {}
+            self._pending.clear()
+
+        frames = 0
+        for room_id in set(events) | set(ephemeral):
+            entries = events.get(room_id, []) + list(ephemeral.get(room_id, {}).values())
+            entries.sort(key=lambda item: item[0])
+            for target, batch in self._segments(room_id, entries):
+                self.socketio.emit('room_batch', {'events': batch}, to=target)
+                frames += 1
+        return frames
+
+    @staticmethod
+    def _segments(room_id, entries):
+        """按发布顺序把事件分为连续的 (发送目标, 事件列表)，目标为房间或 to 指定的连接"""
+        segments = []
+        for _, to, entry in entries:
+            target = to or room_id
+            if segments and segments[-1][0] == target:
+                segments[-1][1].append(entry)
+            else:
+                segments.append((target, [entry]))
+        return segments
+
+    def start(self):
+        """首次发布事件时启动后台发送任务"""
+        if self._task is None:
+            with self._lock:
+                if self._task is None:
+                    self._task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"批量发送房间事件失败: {str(e)}", exc_info=True)
@@ -0,0 +1,115 @@
+"""内容目录：笔记、表格、白板、脑图、流程图的统一目录
+
+五类内容分散在五张表中，管理后台的列表、计数和按ID查找原本要分别查询每张表。
+content_item 为每个内容保存一行（类型、ID、所有者、标题、大小、时间），
+ORM 刷新时自动同步新增、修改和删除，跨类型的查询只需要访问这一张带索引的表。
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Note, TableDocument, Whiteboard, Mindmap, Flowchart, ContentItem
+from versioning import dumps
+
+# 重建目录时每批读取的内容数
+REBUILD_BATCH_SIZE = 500
+
+
+def _json_size(data):
+    return len(dumps(data)) if data is not None else 0
+
+
+# 内容类型 -> (模型, 显示名称, 内容大小计算函数)
+CATALOG_MODELS = {
+    'note': (Note, '笔记', lambda note: len((note.content or '').encode('utf-8'))),
+    'table': (TableDocument, '表格', lambda table: _json_size(table.snapshot())),
+    'whiteboard': (Whiteboard, '白板', lambda whiteboard: _json_size(whiteboard.data)),
+    'mindmap': (Mindmap, '脑图', lambda mindmap: _json_size(mindmap.data)),
+    'flowchart': (Flowchart, '流程图', lambda flowchart: _json_size(flowchart.flow_data)),
+}
+
+_CONTENT_TYPES = {model: content_type for content_type, (model, _, _) in CATALOG_MODELS.items()}
+
+
+def catalog_values(content_type, obj):
+    """生成内容对应的目录行"""
+    size = CATALOG_MODELS[content_type][2]
+    return {
+        'content_type': content_type,
+        'content_id': obj.id,
+        'user_id': obj.user_id,
+        'title': obj.title or '',
+        'size': size(obj),
+        'created_at': obj.created_at,
+        'updated_at': obj.updated_at
+    }
+
+
+def _upsert(connection, values):
+    table = ContentItem.__table__
+    result = connection.execute(
+        table.update()
+        .where(table.c.content_type == values['content_type'], table.c.content_id == values['content_id'])
+        .values(**values)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(**values))
+
+
+@event.listens_for(Session, 'after_flush')
+def sync_content_catalog(session, flush_context):
+    """每次刷新后同步被新增、修改、删除的内容的目录行，与业务数据在同一事务中提交"""
+    changed = [
+        (_CONTENT_TYPES[type(obj)], obj) for obj in session.new if type(obj) in _CONTENT_TYPES
+    ] + [
+        (_CONTENT_TYPES[type(obj)], obj) for obj in session.dirty
+        if type(obj) in _CONTENT_TYPES and session.is_modified(obj, include_collections=False)
+    ]
+    removed = [(_CONTENT_TYPES[type(obj)], obj.id) for obj in session.deleted if type(obj) in _CONTENT_TYPES]
+    if not changed and not removed:
+        return
+
+    connection = session.connection()
+    table = ContentItem.__table__
+    for content_type, obj in changed:
+        _upsert(connection, catalog_values(content_type, obj))
+    for content_type, content_id in removed:
+        connection.execute(
+            table.delete().where(table.c.content_type == content_type, table.c.content_id == content_id)
+        )
+
+
+def find_content(content_id, content_type=None):
+    """按ID（和类型）在目录中查找内容，返回目录行列表；不指定类型时不同类型的内容可能ID相同"""
+    query = ContentItem.query.filter_by(content_id=content_id)
+    if content_type:
+        query = query.filter_by(content_type=content_type)
+    return query.all()
+
+
+def rebuild_catalog():
+    """重建内容目录，返回 {内容类型: 写入的行数}
+
+    用于升级后首次建立目录，或目录与数据不一致时修复。删除和重新写入在同一个事务中完成，
+    重建期间其他连接仍读到旧的目录，不会看到目录为空；内容按批读取，读完一批即从会话中移出
+    """
+    table = ContentItem.__table__
+    counts = {}
+    try:
+        for content_type, (model, _, _) in CATALOG_MODELS.items():
+            db.session.execute(table.delete().where(table.c.content_type == content_type))
+            counts[content_type] = 0
+            # 按主键分批读取，避免一次把所有内容加载进内存
+            last_id = 0
+            while True:
+                batch = model.query.filter(model.id > last_id).order_by(model.id).limit(REBUILD_BATCH_SIZE).all()
+                if not batch:
+                    break
+                db.session.execute(table.insert(), [catalog_values(content_type, obj) for obj in batch])
+                counts[content_type] += len(batch)
+                last_id = batch[-1].id
+                db.session.expunge_all()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return counts
@@ -0,0 +1,444 @@
+"""协作编辑：基于 Quill Delta 的操作变换（OT）
+
+客户端不再在每次编辑后发送整篇文档，而是只发送本次编辑的 Delta 操作
+（retain / insert / delete，格式与 Quill 的 text-change 事件一致）以及它所基于的版本号。
+版本号只由服务端分配，每合并一个操作加一：如果客户端基于的版本落后，先把操作依次变换到最新版本之上（rebase），
+再合并进文档，房间内只广播变换后的操作。客户端为每个操作附带唯一的 op_id，
+重连后重发的操作不会被重复合并；重连的客户端按版本号只补取错过的操作。
+
+文档保存为压缩后的快照加上快照之后的操作：合并操作时只做变换和长度检查，不必每次把操作合并进整篇文档；
+后台任务定期把积累的操作压缩进快照（操作数达到 HISTORY_LIMIT 时合并时立即压缩），
+新加入的客户端收到快照和其后的操作，在本地依次应用。
+
+compose / transform 的语义与 quill-delta 相同，长度按 JavaScript 字符串的 UTF-16 单元计算，
+保证服务端与浏览器端对同一操作的理解一致。
+"""
+import json
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# 每个文档保留的最近操作数；客户端基于的版本早于该窗口时需要重新获取文档
+HISTORY_LIMIT = 200
+
+# 支持协作编辑的文档类型
+COLLAB_DOC_TYPES = ('note',)
+
+
+class SyncError(ValueError):
+    """操作无法合并：格式不合法、长度与文档不符或基于的版本过旧，客户端需要重新获取文档"""
+
+
+# -------------------------- Delta --------------------------
+def _text_length(text):
+    # JavaScript 字符串长度：BMP 之外的字符占两个单元
+    return len(text.encode('utf-16-le', 'surrogatepass')) // 2
+
+
+def _text_slice(text, start, end):
+    # 切分位置可能落在代理对中间，两半各自保留为单独的代理项
+    data = text.encode('utf-16-le', 'surrogatepass')
+    return data[start * 2:end * 2].decode('utf-16-le', 'surrogatepass')
+
+
+def _text_concat(a, b):
+    # 重新编解码，使被切开的代理对拼接后恢复为一个字符
+    return (a + b).encode('utf-16-le', 'surrogatepass').decode('utf-16-le', 'surrogatepass')
+
+
+def op_length(op):
+    if 'delete' in op:
+        return op['delete']
+    if 'retain' in op:
+        return op['retain']
+    return _text_length(op['insert']) if isinstance(op['insert'], str) else 1
+
+
+def _compose_attributes(a, b, keep_null):
+    a, b = a or {}, b or {}
+    attributes = dict(b) if keep_null else {key: value for key, value in b.items() if value is not None}
+    for key, value in a.items():
+        if value is not None and key not in b:
+            attributes[key] = value
+    return attributes or None
+
+
+def _transform_attributes(a, b, priority):
+    if not a:
+        return b
+    if not b:
+        return None
+    if not priority:
+        return b
+    return {key: value for key, value in b.items() if key not in a} or None
+
+
+class _OpIterator:
+    def __init__(self, ops):
+        self.ops = ops
+        self.index = 0
+        self.offset = 0
+
+    def has_next(self):
+        return self.peek_length() < math.inf
+
+    def next(self, length=math.inf):
+        if self.index >= len(self.ops):
+            return {'retain': math.inf}
+        op = self.ops[self.index]
+        offset = self.offset
+        remaining = op_length(op) - offset
+        if length >= remaining:
+            length = remaining
+            self.index += 1
+            self.offset = 0
+        else:
+            self.offset += length
+        if 'delete' in op:
+            return {'delete': length}
+        result = {}
+        if 'retain' in op:
+            result['retain'] = length
+        elif isinstance(op['insert'], str):
+            result['insert'] = _text_slice(op['insert'], offset, offset + length)
+        else:
+            result['insert'] = op['insert']
+        if op.get('attributes'):
+            result['attributes'] = op['attributes']
+        return result
+
+    def peek_length(self):
+        if self.index < len(self.ops):
+            return op_length(self.ops[self.index]) - self.offset
+        return math.inf
+
+    def peek_type(self):
+        if self.index < len(self.ops):
+            op = self.ops[self.index]
+            return 'delete' if 'delete' in op else 'retain' if 'retain' in op else 'insert'
+        return 'retain'
+
+    def rest(self):
+        if not self.has_next():
+            return []
+        if self.offset == 0:
+            return self.ops[self.index:]
+        index, offset = self.index, self.offset
+        first = self.next()
+        rest = self.ops[self.index:]
+        self.index, self.offset = index, offset
+        return [first] + rest
+
+
+class Delta:
+    """Quill Delta 的服务端实现，只包含协作合并需要的操作"""
+
+    def __init__(self, ops=None):
+        self.ops = []
+        for op in ops or []:
+            self.push(op)
+
+    def push(self, op):
+        op = dict(op)
+        if not op.get('attributes'):
+            op.pop('attributes', None)
+        index = len(self.ops)
+        last = self.ops[-1] if self.ops else None
+        if last is not None:
+            if 'delete' in op and 'delete' in last:
+                last['delete'] += op['delete']
+                return self
+            # 删除和插入相邻时插入排在前面，保证结果唯一
+            if 'delete' in last and 'insert' in op:
+                index -= 1
+                last = self.ops[index - 1] if index > 0 else None
+                if last is None:
+                    self.ops.insert(0, op)
+                    return self
+            if last.get('attributes') == op.get('attributes'):
+                if isinstance(last.get('insert'), str) and isinstance(op.get('insert'), str):
+                    last['insert'] = _text_concat(last['insert'], op['insert'])
+                    return self
+                if 'retain' in last and 'retain' in op:
+                    last['retain'] += op['retain']
+                    return self
+        self.ops.insert(index, op)
+        return self
+
+    def retain(self, length, attributes=None):
+        if length > 0:
+            op = {'retain': length}
+            if attributes:
+                op['attributes'] = attributes
+            self.push(op)
+        return self
+
+    def chop(self):
+        if self.ops and 'retain' in self.ops[-1] and not self.ops[-1].get('attributes'):
+            self.ops.pop()
+        return self
+
+    def concat(self, other):
+        delta = Delta(self.ops)
+        if other.ops:
+            delta.push(other.ops[0])
+            delta.ops.extend(other.ops[1:])
+        return delta
+
+    def length(self):
+        return sum(op_length(op) for op in self.ops)
+
+    def base_length(self):
+        """操作所作用的文档至少应有的长度"""
+        return sum(op_length(op) for op in self.ops if 'insert' not in op)
+
+    def change_length(self):
+        """应用后文档长度的变化"""
+        return sum(op_length(op) if 'insert' in op else -op.get('delete', 0) for op in self.ops)
+
+    def compose(self, other):
+        """先应用 self 再应用 other 的效果合并为一个 Delta"""
+        this_iter, other_iter = _OpIterator(self.ops), _OpIterator(other.ops)
+        ops = []
+        first_other = other_iter.ops[0] if other_iter.ops else None
+        if first_other and 'retain' in first_other and not first_other.get('attributes'):
+            first_left = first_other['retain']
+            while this_iter.peek_type() == 'insert' and this_iter.peek_length() <= first_left:
+                first_left -= this_iter.peek_length()
+                ops.append(this_iter.next())
+            if first_other['retain'] - first_left > 0:
+                other_iter.next(first_other['retain'] - first_left)
+
+        delta = Delta(ops)
+        while this_iter.has_next() or other_iter.has_next():
+            if other_iter.peek_type() == 'insert':
+                delta.push(other_iter.next())
+            elif this_iter.peek_type() == 'delete':
+                delta.push(this_iter.next())
+            else:
+                length = min(this_iter.peek_length(), other_iter.peek_length())
+                this_op, other_op = this_iter.next(length), other_iter.next(length)
+                if 'retain' in other_op:
+                    new_op = {'retain': length} if 'retain' in this_op else {'insert': this_op['insert']}
+                    attributes = _compose_attributes(
+                        this_op.get('attributes'), other_op.get('attributes'), 'retain' in this_op
+                    )
+                    if attributes:
+                        new_op['attributes'] = attributes
+                    delta.push(new_op)
+                    # other 已经结束，剩余部分原样保留
+                    if not other_iter.has_next() and delta.ops[-1] == new_op:
+                        return delta.concat(Delta(this_iter.rest())).chop()
+                elif 'delete' in other_op and 'retain' in this_op:
+                    delta.push(other_op)
+        return delta.chop()
+
+    def transform(self, other, priority=False):
+        """把与 self 并发的 other 变换为可以在 self 之后应用的操作
+
+        priority 为 True 表示 self 先发生，同一位置的插入 self 排在前面
+        """
+        this_iter, other_iter = _OpIterator(self.ops), _OpIterator(other.ops)
+        delta = Delta()
+        while this_iter.has_next() or other_iter.has_next():
+            if this_iter.peek_type() == 'insert' and (priority or other_iter.peek_type() != 'insert'):
+                delta.retain(op_length(this_iter.next()))
+            elif other_iter.peek_type() == 'insert':
+                delta.push(other_iter.next())
+            else:
+                length = min(this_iter.peek_length(), other_iter.peek_length())
+                this_op, other_op = this_iter.next(length), other_iter.next(length)
+                if 'delete' in this_op:
+                    continue
+                if 'delete' in other_op:
+                    delta.push(other_op)
+                else:
+                    delta.retain(length, _transform_attributes(
+                        this_op.get('attributes'), other_op.get('attributes'), priority
+                    ))
+        return delta.chop()
+
+
+def validate_ops(ops):
+    """检查客户端发来的操作列表，返回 Delta"""
+    if not isinstance(ops, list):
+        raise SyncError('操作必须是列表')
+    for op in ops:
+        if not isinstance(op, dict) or len({'insert', 'retain', 'delete'} & op.keys()) != 1:
+            raise SyncError('操作格式不正确')
+        if 'insert' in op and not isinstance(op['insert'], (str, dict)):
+            raise SyncError('插入内容格式不正确')
+        for key in ('retain', 'delete'):
+            if key in op and (not isinstance(op[key], int) or isinstance(op[key], bool) or op[key] <= 0):
+                raise SyncError('操作长度必须是正整数')
+        if 'attributes' in op and op['attributes'] is not None and not isinstance(op['attributes'], dict):
+            raise SyncError('格式属性不正确')
+    # 插入内容上的空值属性没有意义，去掉后文档内容才是规范形式
+    return Delta([
+        {**op, 'attributes': {key: value for key, value in op['attributes'].items() if value is not None}}
+        if 'insert' in op and op.get('attributes') else op
+        for op in ops
+    ])
+
+
+def content_to_delta(content):
+    """把笔记的存储内容（Quill Delta JSON 或纯文本）转换为 Delta"""
+    if not content:
+        return Delta()
+    try:
+        parsed = json.loads(content)
+    except (TypeError, ValueError):
+        parsed = None
+    if isinstance(parsed, dict) and isinstance(parsed.get('ops'), list):
+        return validate_ops(parsed['ops'])
+    if isinstance(parsed, list):
+        return validate_ops(parsed)
+    return Delta([{'insert': content}])
+
+
+# -------------------------- 协作文档 --------------------------
+class CollabDocument:
+    """一个协作文档的快照、版本号和最近的操作历史
+
+    snapshot 是 snapshot_version 时的内容，history 中版本号更大的操作尚未压缩进快照。
+    flushed_version 是已经写回数据库的版本号，比当前版本号小说明有未写回的修改（见 collab_persist.py）；
+    last_editor 是最近一次修改的用户ID，写回时作为历史版本的修改人
+    """
+
+    def __init__(self, content=None, version=0):
+        self.snapshot = content or Delta()
+        self.snapshot_version = version
+        self.length = self.snapshot.length()
+        self.version = version
+        self.history = deque(maxlen=HISTORY_LIMIT)  # (版本号, 该版本的操作, 客户端操作ID)
+        self.last_updated = datetime.now()
+        self.flushed_version = version
+        self.dirty_since = None  # 第一个未写回的修改的时间戳
+        self.flush_requested = False  # 房间关闭等情况下要求尽快写回
+        self.last_editor = None  # 最近一次修改的用户ID，访客修改时为 None
+        self._lock = threading.Lock()
+
+    @property
+    def dirty(self):
+        return self.version > self.flushed_version
+
+    @property
+    def pending(self):
+        """快照之后尚未压缩的操作数"""
+        return self.version - self.snapshot_version
+
+    @property
+    def content(self):
+        """当前内容：快照依次应用未压缩的操作，不修改快照"""
+        if not self.pending:
+            return self.snapshot
+        tail = Delta()
+        for _, delta, _ in list(self.history)[len(self.history) - self.pending:]:
+            tail = tail.compose(delta)
+        return self.snapshot.compose(tail)
+
+    def compact(self):
+        """把未压缩的操作合并进快照，返回是否有变化；操作历史保留，仍可用于变换和补取"""
+        with self._lock:
+            return self._compact()
+
+    def _compact(self):
+        if not self.pending:
+            return False
+        self.snapshot = self.content
+        self.snapshot_version = self.version
+        return True
+
+    def _history_since(self, since):
+        """since 之后的操作历史，超出保留窗口时返回 None"""
+        if since > self.version or since < 0:
+            return None
+        behind = self.version - since
+        if behind > len(self.history):
+            return None
+        return list(self.history)[len(self.history) - behind:]
+
+    def find_operation(self, op_id):
+        """已合并的客户端操作的版本号，用于识别重发的操作"""
+        if op_id:
+            for version, _, applied_id in self.history:
+                if applied_id == op_id:
+                    return version
+        return None
+
+    def operations_since(self, since):
+        """since 之后合并的所有操作，供重连的客户端补取；超出保留窗口时返回 None"""
+        history = self._history_since(since)
+        if history is None:
+            return None
+        return [{'version': version, 'ops': delta.ops, 'op_id': op_id} for version, delta, op_id in history]
+
+    def apply(self, base_version, ops, op_id=None, editor=None):
+        """合并基于 base_version 的操作，返回 (新版本号, 变换后的操作)；editor 为提交操作的用户ID"""
+        delta = validate_ops(ops)
+        with self._lock:
+            history = self._history_since(base_version)
+            if history is None:
+                raise SyncError('版本号不正确' if base_version > self.version or base_version < 0
+                                else '版本过旧，请重新获取文档')
+            # 依次变换到最新版本之上，已被服务端接收的操作优先
+            for _, applied, _ in history:
+                delta = applied.transform(delta, True)
+            if delta.base_length() > self.length:
+                raise SyncError('操作超出文档长度')
+            # 历史已满时先压缩，未压缩的操作不会被挤出历史
+            if self.pending >= HISTORY_LIMIT:
+                self._compact()
+            self.length += delta.change_length()
+            self.version += 1
+            self.history.append((self.version, delta, op_id))
+            self.last_updated = datetime.now()
+            self.last_editor = editor
+            if self.dirty_since is None:
+                self.dirty_since = time.time()
+            return self.version, delta.ops
+
+    def state(self):
+        """完整状态：快照及其后的操作，客户端依次应用得到当前内容"""
+        with self._lock:
+            return {
+                'snapshot': {'ops': self.snapshot.ops},
+                'snapshot_version': self.snapshot_version,
+                'operations': self.operations_since(self.snapshot_version),
+                'version': self.version,
+                'last_updated': self.last_updated.isoformat()
+            }
+
+    def to_dict(self):
+        """序列化为可以存入共享存储的字典"""
+        return {
+            'snapshot': {'ops': self.snapshot.ops},
+            'snapshot_version': self.snapshot_version,
+            'length': self.length,
+            'version': self.version,
+            'last_updated': self.last_updated.isoformat(),
+            'history': [[version, delta.ops, op_id] for version, delta, op_id in self.history],
+            'flushed_version': self.flushed_version,
+            'dirty_since': self.dirty_since,
+            'flush_requested': self.flush_requested,
+            'last_editor': self.last_editor
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if 'snapshot' in data:
+            doc = cls(Delta(data['snapshot']['ops']), data['snapshot_version'])
+            doc.version = data['version']
+            doc.length = data['length']
+        else:
+            # 引入快照之前保存的文档，content 即当前内容
+            doc = cls(Delta(data['content']['ops']), data['version'])
+        doc.history.extend((entry[0], Delta(entry[1]), entry[2] if len(entry) > 2 else None) for entry in data['history'])
+        doc.last_updated = datetime.fromisoformat(data['last_updated'])
+        doc.flushed_version = data.get('flushed_version', doc.version)
+        doc.dirty_since = data.get('dirty_since')
+        doc.flush_requested = data.get('flush_requested', False)
+        doc.last_editor = data.get('last_editor')
+        return doc
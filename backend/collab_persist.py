@@ -0,0 +1,132 @@
+"""协作文档的延迟写回（write-behind）和淘汰
+
+协作编辑的操作只在协作状态存储中合并，sync_document 不访问数据库。
+定时任务每隔几秒检查有未写回修改的文档，满足以下任一条件时写回所属的模型：
+第一个未写回的修改已超过 COLLAB_FLUSH_SECONDS 秒、未写回的操作数达到 COLLAB_FLUSH_OPS、
+或者房间最后一个用户已离开（flush_requested）。每次写回只保存一个历史版本。
+写回后，长时间无人访问的文档以及超出 COLLAB_MAX_DOCUMENTS 的最久未访问文档从存储中淘汰。
+同一个定时任务也负责压缩：未压缩的操作达到 COLLAB_COMPACT_OPS 或文档要写回时，把操作合并进快照。
+"""
+import json
+import logging
+import time
+
+from models import db, Note, User
+
+logger = logging.getLogger(__name__)
+
+
+def delta_text(delta):
+    return ''.join(op['insert'] for op in delta.ops if isinstance(op.get('insert'), str))
+
+
+def persist_note(note_id, delta, editor_id=None):
+    """把协作文档写回笔记，返回是否写入；内容未变化时不产生新版本
+
+    editor_id 是最近一次修改的协作者，记为历史版本的修改人；访客或已删除的用户记为笔记所有者
+    """
+    note = Note.query.get(note_id)
+    if not note:
+        return False
+    if note.type == 'markdown':
+        content = delta_text(delta)
+    else:
+        content = json.dumps({'ops': delta.ops}, ensure_ascii=False)
+    if content == note.content:
+        return False
+    if editor_id is None or User.query.get(editor_id) is None:
+        editor_id = note.user_id
+    # 与编辑接口一致：保存修改前的内容作为历史版本，同一协作者在合并窗口内连续写回只保留一个版本
+    note.save_version(editor_id, coalesce=True)
+    note.content = content
+    return True
+
+
+# 文档类型 -> 写回函数
+PERSISTERS = {
+    'note': persist_note,
+}
+
+
+def _flush_due(doc, config, now):
+    if doc.flush_requested:
+        return True
+    if doc.version - doc.flushed_version >= config.get('COLLAB_FLUSH_OPS', 200):
+        return True
+    return doc.dirty_since is not None and now - doc.dirty_since >= config.get('COLLAB_FLUSH_SECONDS', 10)
+
+
+def flush_documents(store, config, force=False, now=None):
+    """压缩并写回到期的文档，force=True 时写回所有有未写回修改的文档，返回写回的文档数"""
+    now = now or time.time()
+    compact_ops = config.get('COLLAB_COMPACT_OPS', 50)
+    flushed = 0
+    for doc_key in store.dirty_documents():
+        doc_type, doc_id = doc_key.split(':', 1)
+        persist = PERSISTERS.get(doc_type)
+        if persist is None:
+            continue
+        # 在锁内压缩并取得快照和版本号，写库时不持有锁
+        with store.lock(doc_key):
+            doc = store.get_document(doc_key, touch=False)
+            if doc is None or not doc.dirty:
+                continue
+            due = force or _flush_due(doc, config, now)
+            if (due or doc.pending >= compact_ops) and doc.compact():
+                store.save_document(doc_key, doc)
+            if not due:
+                continue
+            content, version, editor = doc.snapshot, doc.version, doc.last_editor
+        try:
+            persist(int(doc_id), content, editor)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"写回协作文档 {doc_key} 失败: {str(e)}", exc_info=True)
+            continue
+        mark_flushed(store, doc_key, version)
+        flushed += 1
+    return flushed
+
+
+def mark_flushed(store, doc_key, version):
+    """记录已写回的版本；写回期间又有新修改时文档仍保持未写回状态"""
+    with store.lock(doc_key):
+        doc = store.get_document(doc_key, touch=False)
+        if doc is None:
+            return
+        doc.flushed_version = max(doc.flushed_version, version)
+        if not doc.dirty:
+            doc.dirty_since = None
+            doc.flush_requested = False
+        store.save_document(doc_key, doc)
+
+
+def request_flush(store, doc_key):
+    """要求在下一次检查时写回文档（例如房间最后一个用户离开时）"""
+    with store.lock(doc_key):
+        doc = store.get_document(doc_key, touch=False)
+        if doc is not None and doc.dirty and not doc.flush_requested:
+            doc.flush_requested = True
+            store.save_document(doc_key, doc)
+
+
+def evict_documents(store, config, now=None):
+    """淘汰空闲超时的文档，以及超出数量上限时最久未访问的文档；只淘汰已全部写回的文档，返回淘汰数"""
+    now = now or time.time()
+    idle_seconds = config.get('COLLAB_IDLE_MINUTES', 30) * 60
+    max_documents = config.get('COLLAB_MAX_DOCUMENTS', 1000)
+
+    documents = store.documents()
+    overflow = len(documents) - max_documents
+    evicted = 0
+    for doc_key, last_access in documents:
+        if now - last_access < idle_seconds and evicted >= overflow:
+            break
+        with store.lock(doc_key):
+            doc = store.get_document(doc_key, touch=False)
+            if doc is None or doc.dirty:
+                continue
+            store.delete_document(doc_key)
+        evicted += 1
+    return evicted
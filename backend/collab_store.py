@@ -0,0 +1,373 @@
+"""协作状态存储：房间在线状态和协作文档
+
+在线状态同时维护 房间 -> {sid: 用户} 和 sid -> 房间集合 两个索引，加入、离开、断开连接都不需要遍历房间；
+每个连接定期发送心跳，超过 PRESENCE_TIMEOUT 没有心跳的连接（进程崩溃、断线未触发 disconnect 等）
+由定时任务清理，避免幽灵用户在长期运行的进程中累积。
+
+单进程部署使用进程内存储。多个 worker 部署在负载均衡之后时，同一房间的用户可能连到不同进程，
+此时改用 Redis 存储，各进程读写同一份在线用户和文档状态，文档合并用 Redis 锁串行化；
+房间广播则通过 Socket.IO 的消息队列（SOCKETIO_MESSAGE_QUEUE）转发到所有进程。
+保存合并结果时按版本号比较并交换（save_document 的 expected_version）：锁超时自动释放后
+另一个进程已写入新版本时保存失败，由调用方重新读取文档再合并，不会覆盖别人的修改。
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from collab import CollabDocument
+
+logger = logging.getLogger(__name__)
+
+# 超过该时间（秒）没有心跳的连接视为已离线
+PRESENCE_TIMEOUT = 90
+
+# 保存文档时版本号冲突的最多重试次数
+SAVE_RETRIES = 3
+
+
+class LockTimeout(Exception):
+    """等待文档锁超时"""
+
+
+class MemoryStore:
+    """进程内存储，单进程部署和测试使用"""
+
+    def __init__(self, url=None):
+        self._rooms = {}  # 房间ID -> {sid: 用户信息}
+        self._sessions = {}  # sid -> 所在房间集合
+        self._last_seen = {}  # sid -> 最近一次心跳时间
+        self._documents = OrderedDict()  # 文档键 -> CollabDocument，按最近访问排序
+        self._access = {}  # 文档键 -> 最近访问时间
+        self._revisions = {}  # 已淘汰文档的最终版本号
+        self._locks = {}  # 文档键 -> [锁, 持有和等待该锁的数量]
+        self._lock = threading.Lock()
+
+    # -------------------------- 在线状态 --------------------------
+    def join(self, room_id, sid, user, now=None):
+        with self._lock:
+            self._rooms.setdefault(room_id, {})[sid] = user
+            self._sessions.setdefault(sid, set()).add(room_id)
+            self._last_seen[sid] = now or time.time()
+
+    def leave(self, room_id, sid):
+        """从房间中移除连接，返回该连接此前是否在房间中；房间为空时一并删除"""
+        with self._lock:
+            return self._leave(room_id, sid)
+
+    def _leave(self, room_id, sid):
+        members = self._rooms.get(room_id)
+        if not members or members.pop(sid, None) is None:
+            return False
+        if not members:
+            del self._rooms[room_id]
+        rooms = self._sessions.get(sid)
+        if rooms is not None:
+            rooms.discard(room_id)
+            if not rooms:
+                del self._sessions[sid]
+                self._last_seen.pop(sid, None)
+        return True
+
+    def leave_all(self, sid):
+        """连接断开时从所有房间移除，返回离开的房间ID列表"""
+        with self._lock:
+            rooms = list(self._sessions.get(sid, ()))
+            for room_id in rooms:
+                self._leave(room_id, sid)
+            return rooms
+
+    def heartbeat(self, sid, now=None):
+        """刷新连接的心跳时间，连接不在任何房间中（例如已过期被清理）时返回 False"""
+        with self._lock:
+            if sid not in self._sessions:
+                return False
+            self._last_seen[sid] = now or time.time()
+            return True
+
+    def expire(self, now=None):
+        """清理超时没有心跳的连接，返回 [(房间ID, sid)]"""
+        deadline = (now or time.time()) - PRESENCE_TIMEOUT
+        removed = []
+        with self._lock:
+            for sid in [sid for sid, seen in self._last_seen.items() if seen < deadline]:
+                for room_id in list(self._sessions.get(sid, ())):
+                    self._leave(room_id, sid)
+                    removed.append((room_id, sid))
+                self._last_seen.pop(sid, None)
+        return removed
+
+    def members(self, room_id):
+        with self._lock:
+            return list(self._rooms.get(room_id, {}).values())
+
+    def occupancy(self):
+        """所有有人在线的房间及其在线连接数"""
+        with self._lock:
+            return {room_id: len(members) for room_id, members in self._rooms.items()}
+
+    # -------------------------- 协作文档 --------------------------
+    def get_document(self, doc_key, touch=True):
+        """读取文档；touch=False 时不刷新最近访问时间（后台写回和淘汰使用）"""
+        with self._lock:
+            doc = self._documents.get(doc_key)
+            if doc is not None and touch:
+                self._touch(doc_key)
+            return doc
+
+    def _touch(self, doc_key):
+        self._documents.move_to_end(doc_key)
+        self._access[doc_key] = time.time()
+
+    def add_document(self, doc_key, doc):
+        """文档不存在时保存，已存在（其他请求先加载了）时保留原有的"""
+        with self._lock:
+            if doc_key not in self._documents:
+                self._documents[doc_key] = doc
+                self._touch(doc_key)
+
+    def save_document(self, doc_key, doc, expected_version=None):
+        """保存文档；指定 expected_version 时只有存储中的版本号仍为该值才保存，返回是否保存"""
+        with self._lock:
+            current = self._documents.get(doc_key)
+            # 进程内存储直接修改同一个对象，对象未被替换即说明没有其他写入
+            if expected_version is not None and current is not doc and (
+                    current is None or current.version != expected_version):
+                return False
+            self._documents[doc_key] = doc
+            return True
+
+    def delete_document(self, doc_key):
+        """淘汰文档，记住其版本号，重新加载时版本号接着增长"""
+        with self._lock:
+            doc = self._documents.pop(doc_key, None)
+            self._access.pop(doc_key, None)
+            if doc is not None:
+                self._revisions[doc_key] = doc.version
+            entry = self._locks.get(doc_key)
+            if entry is not None and entry[1] == 0:
+                del self._locks[doc_key]
+
+    def revision(self, doc_key):
+        return self._revisions.get(doc_key, 0)
+
+    def dirty_documents(self):
+        """有未写回修改的文档键"""
+        with self._lock:
+            return [doc_key for doc_key, doc in self._documents.items() if doc.dirty]
+
+    def documents(self):
+        """[(文档键, 最近访问时间)]，最久未访问的在前"""
+        with self._lock:
+            return [(doc_key, self._access.get(doc_key, 0)) for doc_key in self._documents]
+
+    @contextmanager
+    def lock(self, doc_key):
+        # 记录使用锁的数量，没有人使用且文档已淘汰时删除，锁的数量不会随访问过的文档数增长
+        with self._lock:
+            entry = self._locks.setdefault(doc_key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0 and doc_key not in self._documents and self._locks.get(doc_key) is entry:
+                    del self._locks[doc_key]
+
+
+class RedisStore:
+    """Redis 存储，多个进程共享同一份状态
+
+    client 可以传入兼容 redis-py 接口的客户端（例如测试中使用 fakeredis）
+    """
+    PREFIX = 'zhilianbiji:collab:'
+
+    # 文档锁的自动释放时间和等待时间（秒），防止持锁进程崩溃后文档永久被锁
+    LOCK_TIMEOUT = 10
+    LOCK_WAIT = 5
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.redis = client
+
+    def _room_key(self, room_id):
+        return f'{self.PREFIX}room:{room_id}'
+
+    def _doc_key(self, doc_key):
+        return f'{self.PREFIX}doc:{doc_key}'
+
+    def _version_key(self, doc_key):
+        return f'{self.PREFIX}version:{doc_key}'
+
+    # -------------------------- 在线状态 --------------------------
+    # room:<房间ID> 哈希 sid -> 用户；session:<sid> 集合保存所在房间；
+    # presence 有序集合以心跳时间为分数，rooms 有序集合以在线连接数为分数
+    def _session_key(self, sid):
+        return f'{self.PREFIX}session:{sid}'
+
+    def join(self, room_id, sid, user, now=None):
+        pipe = self.redis.pipeline()
+        pipe.hset(self._room_key(room_id), sid, json.dumps(user, ensure_ascii=False))
+        pipe.sadd(self._session_key(sid), room_id)
+        pipe.zadd(f'{self.PREFIX}presence', {sid: now or time.time()})
+        pipe.execute()
+        self._update_occupancy(room_id)
+
+    def leave(self, room_id, sid):
+        pipe = self.redis.pipeline()
+        pipe.hdel(self._room_key(room_id), sid)
+        pipe.srem(self._session_key(sid), room_id)
+        removed = pipe.execute()[0]
+        if not self.redis.exists(self._session_key(sid)):
+            self.redis.zrem(f'{self.PREFIX}presence', sid)
+        self._update_occupancy(room_id)
+        return bool(removed)
+
+    def _update_occupancy(self, room_id):
+        # 哈希的最后一个字段被删除时 Redis 会自动删除整个键，在线数为0时从房间列表中移除
+        count = self.redis.hlen(self._room_key(room_id))
+        if count:
+            self.redis.zadd(f'{self.PREFIX}rooms', {room_id: count})
+        else:
+            self.redis.zrem(f'{self.PREFIX}rooms', room_id)
+
+    def leave_all(self, sid):
+        rooms = [room_id.decode() if isinstance(room_id, bytes) else room_id
+                 for room_id in self.redis.smembers(self._session_key(sid))]
+        for room_id in rooms:
+            self.leave(room_id, sid)
+        self.redis.zrem(f'{self.PREFIX}presence', sid)
+        return rooms
+
+    def heartbeat(self, sid, now=None):
+        # 只更新已存在的连接，已被清理的连接不会被重新加入
+        if self.redis.zscore(f'{self.PREFIX}presence', sid) is None:
+            return False
+        self.redis.zadd(f'{self.PREFIX}presence', {sid: now or time.time()}, xx=True)
+        return True
+
+    def expire(self, now=None):
+        deadline = (now or time.time()) - PRESENCE_TIMEOUT
+        removed = []
+        for sid in self.redis.zrangebyscore(f'{self.PREFIX}presence', '-inf', deadline):
+            sid = sid.decode() if isinstance(sid, bytes) else sid
+            removed += [(room_id, sid) for room_id in self.leave_all(sid)]
+        return removed
+
+    def members(self, room_id):
+        return [json.loads(value) for value in self.redis.hvals(self._room_key(room_id))]
+
+    def occupancy(self):
+        return {
+            (room_id.decode() if isinstance(room_id, bytes) else room_id): int(count)
+            for room_id, count in self.redis.zrange(f'{self.PREFIX}rooms', 0, -1, withscores=True)
+        }
+
+    # -------------------------- 协作文档 --------------------------
+    # doc:<文档键> 保存序列化的文档，version:<文档键> 单独保存版本号用于比较并交换；
+    # docs 有序集合以最近访问时间为分数，dirty 集合保存有未写回修改的文档，revisions 哈希保存已淘汰文档的最终版本号
+    def get_document(self, doc_key, touch=True):
+        value = self.redis.get(self._doc_key(doc_key))
+        if not value:
+            return None
+        if touch:
+            self.redis.zadd(f'{self.PREFIX}docs', {doc_key: time.time()})
+        return CollabDocument.from_dict(json.loads(value))
+
+    def add_document(self, doc_key, doc):
+        pipe = self.redis.pipeline()
+        pipe.set(self._doc_key(doc_key), json.dumps(doc.to_dict()), nx=True)
+        pipe.set(self._version_key(doc_key), doc.version, nx=True)
+        if pipe.execute()[0]:
+            self.redis.zadd(f'{self.PREFIX}docs', {doc_key: time.time()})
+
+    def save_document(self, doc_key, doc, expected_version=None):
+        from redis.exceptions import WatchError
+
+        with self.redis.pipeline() as pipe:
+            try:
+                if expected_version is not None:
+                    pipe.watch(self._version_key(doc_key))
+                    current = pipe.get(self._version_key(doc_key))
+                    if current is None or int(current) != expected_version:
+                        return False
+                    pipe.multi()
+                pipe.set(self._doc_key(doc_key), json.dumps(doc.to_dict()))
+                pipe.set(self._version_key(doc_key), doc.version)
+                if doc.dirty:
+                    pipe.sadd(f'{self.PREFIX}dirty', doc_key)
+                else:
+                    pipe.srem(f'{self.PREFIX}dirty', doc_key)
+                pipe.execute()
+            except WatchError:
+                return False
+        return True
+
+    def delete_document(self, doc_key):
+        value = self.redis.get(self._doc_key(doc_key))
+        pipe = self.redis.pipeline()
+        if value:
+            pipe.hset(f'{self.PREFIX}revisions', doc_key, json.loads(value)['version'])
+        pipe.delete(self._doc_key(doc_key), self._version_key(doc_key))
+        pipe.zrem(f'{self.PREFIX}docs', doc_key)
+        pipe.srem(f'{self.PREFIX}dirty', doc_key)
+        pipe.execute()
+
+    def revision(self, doc_key):
+        return int(self.redis.hget(f'{self.PREFIX}revisions', doc_key) or 0)
+
+    def dirty_documents(self):
+        return [key.decode() if isinstance(key, bytes) else key for key in self.redis.smembers(f'{self.PREFIX}dirty')]
+
+    def documents(self):
+        return [
+            (key.decode() if isinstance(key, bytes) else key, score)
+            for key, score in self.redis.zrange(f'{self.PREFIX}docs', 0, -1, withscores=True)
+        ]
+
+    @contextmanager
+    def lock(self, doc_key):
+        """LOCK_WAIT 秒内拿不到锁时抛出 LockTimeout；持有超过 LOCK_TIMEOUT 秒后锁已自动释放，
+        此时保存依靠版本号比较，不会覆盖其他进程的写入，只记录警告"""
+        from redis.exceptions import LockError
+
+        lock = self.redis.lock(
+            f'{self.PREFIX}lock:{doc_key}', timeout=self.LOCK_TIMEOUT, blocking_timeout=self.LOCK_WAIT
+        )
+        if not lock.acquire():
+            raise LockTimeout(doc_key)
+        try:
+            yield
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                logger.warning(f"文档 {doc_key} 的锁在释放前已超时")
+
+
+# 存储地址的协议 -> 存储类
+STATE_STORES = {
+    'memory': MemoryStore,
+    'redis': RedisStore,
+    'rediss': RedisStore,
+}
+
+
+def create_store(url):
+    """根据地址创建协作状态存储，例如 memory:// 或 redis://localhost:6379/0"""
+    scheme = (url or 'memory://').split('://', 1)[0]
+    store_class = STATE_STORES.get(scheme)
+    if store_class is None:
+        logger.warning(f"未知的协作状态存储 {url}，使用进程内存储")
+        return MemoryStore()
+    try:
+        return store_class(url)
+    except ImportError:
+        logger.warning("未安装redis，协作状态使用进程内存储，多进程部署时各进程的状态不共享")
+        return MemoryStore()
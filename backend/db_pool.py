@@ -0,0 +1,201 @@
+"""数据库连接池配置和监控
+
+engine_options 根据 DB_* 配置生成 SQLALCHEMY_ENGINE_OPTIONS：连接池大小、溢出连接数、等待超时、
+连接回收时间和取出连接前的存活检查（pool_pre_ping，避免使用被 MySQL 按 wait_timeout 断开的连接，
+即 "MySQL server has gone away"），以及 MySQL 的连接超时和语句超时。
+
+DB_POOL_MODE 选择连接池：
+- queue：默认的 QueuePool
+- green：eventlet 服务器使用。启动时执行 eventlet.monkey_patch()（见 app.py 开头），连接池的锁和
+  PyMySQL 的 socket 都变为协程版本，等待连接或执行查询时让出给其他协程；未打补丁时用真实线程锁
+  等待连接会阻塞整个 eventlet 事件循环，持有连接的协程无法归还连接，表现为连接池耗尽
+- null：不复用连接（NullPool），每次取出时新建连接，适合前面有连接代理的部署
+
+连接池的使用情况（取出、溢出、等待时间、超时次数等）记录在 POOL_STATS 中，由管理接口返回。
+"""
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+
+POOL_MODES = ('queue', 'green', 'null')
+
+# 统计等待时间分布时保留的最近取出次数
+WAIT_SAMPLES = 1000
+
+
+class PoolStats:
+    """连接池的累计计数和最近的等待时间"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_max_ms = 0.0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+
+    def record_wait(self, wait_ms, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.waits.append(wait_ms)
+            self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            waits = sorted(self.waits)
+            return {
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_ms': {
+                    'avg': round(sum(waits) / len(waits), 3) if waits else 0,
+                    'p95': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0,
+                    'max': round(self.wait_max_ms, 3),
+                },
+            }
+
+
+POOL_STATS = PoolStats()
+
+
+class _TimedCheckout:
+    """记录从连接池取出连接的等待时间（含新建连接的时间）和等待超时"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            POOL_STATS.record_wait((time.perf_counter() - start) * 1000, timed_out=True)
+            raise
+        POOL_STATS.record_wait((time.perf_counter() - start) * 1000)
+        return connection
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedNullPool(_TimedCheckout, NullPool):
+    pass
+
+
+def _bool_setting(value):
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def eventlet_patched():
+    """thread 和 socket 是否已被 eventlet 替换为协程版本"""
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched('thread') and patcher.is_monkey_patched('socket')
+
+
+def engine_options(config):
+    """根据配置生成 SQLALCHEMY_ENGINE_OPTIONS；内存 SQLite 由 Flask-SQLAlchemy 使用 StaticPool，不做修改"""
+    mode = config.get('DB_POOL_MODE', 'queue')
+    if mode not in POOL_MODES:
+        raise ValueError(f"DB_POOL_MODE 必须是 {', '.join(POOL_MODES)} 之一，当前为 {mode}")
+    if mode == 'green' and not eventlet_patched():
+        raise RuntimeError('DB_POOL_MODE=green 需要在导入应用之前执行 eventlet.monkey_patch()')
+
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return options
+
+    options['pool_pre_ping'] = _bool_setting(config.get('DB_POOL_PRE_PING', True))
+    if mode == 'null':
+        options['poolclass'] = TimedNullPool
+    else:
+        options['poolclass'] = TimedQueuePool
+        options['pool_size'] = int(config.get('DB_POOL_SIZE', 10))
+        options['max_overflow'] = int(config.get('DB_MAX_OVERFLOW', 20))
+        options['pool_timeout'] = int(config.get('DB_POOL_TIMEOUT', 10))
+        options['pool_recycle'] = int(config.get('DB_POOL_RECYCLE', 1800))
+
+    if url.get_backend_name() == 'mysql':
+        connect_args = dict(options.get('connect_args') or {})
+        connect_args.setdefault('connect_timeout', int(config.get('DB_CONNECT_TIMEOUT', 10)))
+        options['connect_args'] = connect_args
+    return options
+
+
+def _set_statement_timeout(dbapi_connection, timeout_ms):
+    """MySQL 的 max_execution_time（毫秒，只限制 SELECT）；MariaDB 没有该变量，使用 max_statement_time（秒）"""
+    cursor = dbapi_connection.cursor()
+    try:
+        try:
+            cursor.execute(f'SET SESSION max_execution_time = {int(timeout_ms)}')
+        except Exception:
+            cursor.execute(f'SET SESSION max_statement_time = {timeout_ms / 1000:.3f}')
+    finally:
+        cursor.close()
+
+
+def init_pool_metrics(engine, config):
+    """给引擎注册连接池事件：统计连接的建立、取出、归还和失效，并为 MySQL 新连接设置语句超时"""
+    timeout_ms = int(config.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    is_mysql = engine.dialect.name == 'mysql'
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        POOL_STATS.count('connects')
+        if is_mysql and timeout_ms > 0:
+            _set_statement_timeout(dbapi_connection, timeout_ms)
+
+    @event.listens_for(engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        POOL_STATS.count('checkouts')
+
+    @event.listens_for(engine, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        POOL_STATS.count('checkins')
+
+    @event.listens_for(engine, 'invalidate')
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        POOL_STATS.count('invalidations')
+
+
+def pool_status(engine, config):
+    """连接池当前状态和累计统计"""
+    pool = engine.pool
+    stats = POOL_STATS.snapshot()
+    status = {
+        'mode': config.get('DB_POOL_MODE', 'queue'),
+        'pool_class': type(pool).__name__,
+        'eventlet_patched': eventlet_patched(),
+        'checked_out': stats['checkouts'] - stats['checkins'],
+    }
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow,
+            'timeout': pool.timeout(),
+        })
+    status.update(stats)
+    return status
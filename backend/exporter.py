@@ -0,0 +1,300 @@
+"""管理员数据导出：流式 NDJSON / CSV（可选 gzip）和异步导出任务
+
+导出不再把所有用户和内容拼成一个大字典再 jsonify，而是用服务端游标（yield_per）
+边读边写，内存占用与数据量无关。数据量很大时可以创建异步导出任务，
+由后台线程写入 EXPORT_FOLDER 下的文件，前端轮询进度后再下载。任务状态保存在 export_job 表中，
+多进程部署时查询进度和下载的请求可以落在任意进程上；导出目录不在 static 下，文件名随机生成，
+只能通过需要管理员权限的下载接口获取。
+"""
+import csv
+import io
+import json
+import logging
+import os
+import threading
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func, update
+
+from models import db, User, ContentItem, ExportJob
+from catalog import CATALOG_MODELS
+
+logger = logging.getLogger(__name__)
+
+# 导出格式 -> (MIME类型, 文件扩展名)
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+# 可导出的数据集，CSV 每个文件只能包含一种数据集
+EXPORT_DATASETS = ('all', 'users', 'content')
+
+USER_FIELDS = ['id', 'username', 'email', 'is_admin', 'created_at', 'last_login']
+CONTENT_FIELDS = ['id', 'content_type', 'type', 'title', 'creator', 'size', 'created_at', 'updated_at']
+
+# 服务端游标每次取回的行数
+YIELD_PER = 1000
+
+# 累积到该大小再向客户端或文件写出一块
+CHUNK_SIZE = 64 * 1024
+
+# 导出任务及其文件的保留时间
+JOB_TTL = timedelta(hours=24)
+
+
+
+def _format_time(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value else None
+
+
+# -------------------------- 数据读取 --------------------------
+def user_rows():
+    """逐行读取用户"""
+    query = (
+        db.select(User.id, User.username, User.email, User.is_admin, User.created_at, User.last_login)
+        .order_by(User.id)
+        .execution_options(yield_per=YIELD_PER)
+    )
+    for row in db.session.execute(query):
+        yield {
+            'id': row.id,
+            'username': row.username,
+            'email': row.email,
+            'is_admin': bool(row.is_admin),
+            'created_at': _format_time(row.created_at),
+            'last_login': _format_time(row.last_login)
+        }
+
+
+def content_rows():
+    """逐行读取内容目录，只关联一次用户表"""
+    query = (
+        db.select(
+            ContentItem.content_id, ContentItem.content_type, ContentItem.title, ContentItem.size,
+            ContentItem.created_at, ContentItem.updated_at, User.username
+        )
+        .outerjoin(User, User.id == ContentItem.user_id)
+        .order_by(ContentItem.id)
+        .execution_options(yield_per=YIELD_PER)
+    )
+    for row in db.session.execute(query):
+        yield {
+            'id': row.content_id,
+            'content_type': row.content_type,
+            'type': CATALOG_MODELS[row.content_type][1],
+            'title': row.title,
+            'creator': row.username or '未知',
+            'size': row.size,
+            'created_at': _format_time(row.created_at),
+            'updated_at': _format_time(row.updated_at)
+        }
+
+
+def count_rows(dataset):
+    """导出的总行数，用于计算进度"""
+    total = 0
+    if dataset in ('all', 'users'):
+        total += db.session.execute(db.select(func.count(User.id))).scalar()
+    if dataset in ('all', 'content'):
+        total += db.session.execute(db.select(func.count(ContentItem.id))).scalar()
+    return total
+
+
+def export_summary():
+    """用户和内容的汇总统计，各用一条聚合查询"""
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    total_users, today_users, recent_users = db.session.execute(db.select(
+        func.count(User.id),
+        func.sum(case((User.created_at >= today, 1), else_=0)),
+        func.sum(case((User.created_at >= today - timedelta(days=7), 1), else_=0))
+    )).one()
+    counts = dict(db.session.execute(
+        db.select(ContentItem.content_type, func.count(ContentItem.id)).group_by(ContentItem.content_type)
+    ).all())
+    return {
+        'users': {
+            'total_users': total_users,
+            'today_users': int(today_users or 0),
+            'recent_users': int(recent_users or 0)
+        },
+        'content': {
+            'total_content': sum(counts.values()),
+            'notes': counts.get('note', 0),
+            'tables': counts.get('table', 0),
+            'whiteboards': counts.get('whiteboard', 0),
+            'mindmaps': counts.get('mindmap', 0),
+            'flowcharts': counts.get('flowchart', 0)
+        }
+    }
+
+
+# -------------------------- 序列化 --------------------------
+def _ndjson_lines(dataset):
+    # 每行一个JSON对象，record 字段区分记录类型，最后一行是汇总
+    if dataset in ('all', 'users'):
+        for row in user_rows():
+            yield json.dumps({'record': 'user', **row}, ensure_ascii=False) + '\n'
+    if dataset in ('all', 'content'):
+        for row in content_rows():
+            yield json.dumps({'record': 'content', **row}, ensure_ascii=False) + '\n'
+    yield json.dumps({'record': 'summary', **export_summary()}, ensure_ascii=False) + '\n'
+
+
+def _csv_lines(dataset):
+    fields, rows = (USER_FIELDS, user_rows()) if dataset == 'users' else (CONTENT_FIELDS, content_rows())
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    # 带BOM，Excel 打开时才能正确识别中文
+    buffer.write('\ufeff')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 输出 gzip 格式
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(export_format, dataset, compress=False, progress=None):
+    """按块产生导出文件的字节内容
+
+    progress(rows) 在每写出一块后以累计写出的数据行数回调
+    """
+    lines = _ndjson_lines(dataset) if export_format == 'ndjson' else _csv_lines(dataset)
+
+    def chunks():
+        parts, size, rows = [], 0, 0
+        for line in lines:
+            data = line.encode('utf-8')
+            parts.append(data)
+            size += len(data)
+            rows += 1
+            if size >= CHUNK_SIZE:
+                yield b''.join(parts)
+                parts, size = [], 0
+                if progress:
+                    progress(rows)
+        yield b''.join(parts)
+        if progress:
+            progress(rows)
+
+    return _gzip(chunks()) if compress else chunks()
+
+
+def validate_export(export_format, dataset):
+    """检查导出参数，返回错误信息，参数合法时返回 None"""
+    if export_format not in EXPORT_FORMATS:
+        return '不支持的导出格式'
+    if dataset not in EXPORT_DATASETS:
+        return '不支持的数据集'
+    if export_format == 'csv' and dataset == 'all':
+        return '导出CSV时请指定 dataset=users 或 dataset=content'
+    return None
+
+
+def export_filename(export_format, dataset, compress=False):
+    """导出文件名"""
+    extension = EXPORT_FORMATS[export_format][1]
+    name = f"export_{dataset}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{extension}"
+    return name + '.gz' if compress else name
+
+
+# -------------------------- 异步导出任务 --------------------------
+def export_folder(app):
+    return app.config['EXPORT_FOLDER']
+
+
+def _update_job(job_id, **values):
+    # 导出过程中会话正在读取服务端游标，任务状态用单独的连接写入并立即提交
+    with db.engine.begin() as connection:
+        connection.execute(update(ExportJob).where(ExportJob.id == job_id).values(**values))
+
+
+def _run_job(app, job_id):
+    with app.app_context():
+        job = db.session.get(ExportJob, job_id)
+        path = os.path.join(export_folder(app), job.stored_name)
+        temp_path = path + '.part'
+        export_format, dataset, compress = job.format, job.dataset, job.gzip
+        state = {'progress': 0}
+        # SQLite 在导出的读取游标结束前无法提交其他连接的写入，只在完成时更新进度
+        report_progress = db.engine.dialect.name != 'sqlite'
+
+        try:
+            rows_total = count_rows(dataset)
+            _update_job(job_id, rows_total=rows_total, status='running')
+
+            def progress(rows):
+                percent = min(round(rows * 100 / rows_total), 99) if rows_total else 0
+                # 进度百分比变化时才写入，避免每写出一块都更新一次任务
+                if percent != state['progress']:
+                    state['progress'] = percent
+                    _update_job(job_id, rows_written=rows, progress=percent)
+
+            with open(temp_path, 'wb') as file:
+                for chunk in export_stream(export_format, dataset, compress, progress if report_progress else None):
+                    file.write(chunk)
+            os.replace(temp_path, path)
+            _update_job(job_id, status='finished', progress=100, rows_written=rows_total,
+                        size=os.path.getsize(path), finished_at=datetime.now())
+        except Exception as e:
+            logger.error(f"导出任务 {job_id} 失败: {str(e)}", exc_info=True)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            _update_job(job_id, status='failed', error=str(e), finished_at=datetime.now())
+        finally:
+            db.session.remove()
+
+
+def start_export_job(app, user_id, export_format, dataset, compress=False):
+    """创建异步导出任务并在后台线程中执行，返回任务状态"""
+    os.makedirs(export_folder(app), exist_ok=True)
+    job = ExportJob(
+        id=uuid.uuid4().hex,
+        format=export_format,
+        dataset=dataset,
+        gzip=compress,
+        stored_name=uuid.uuid4().hex,
+        filename=export_filename(export_format, dataset, compress),
+        created_by=user_id
+    )
+    db.session.add(job)
+    db.session.commit()
+    threading.Thread(target=_run_job, args=(app, job.id), daemon=True).start()
+    return job.to_dict()
+
+
+def get_export_job(job_id):
+    return db.session.get(ExportJob, job_id)
+
+
+def clean_export_jobs(app, now=None):
+    """删除超过保留时间的导出任务和导出文件（包括已没有任务记录的文件），返回删除的文件数"""
+    now = now or datetime.now()
+    cutoff = now - JOB_TTL
+    with app.app_context():
+        db.session.execute(db.delete(ExportJob).where(ExportJob.created_at < cutoff))
+        db.session.commit()
+
+    folder = export_folder(app)
+    if not os.path.isdir(folder):
+        return 0
+    removed = 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if os.path.isfile(path) and datetime.fromtimestamp(os.path.getmtime(path)) < cutoff:
+            os.remove(path)
+            removed += 1
+    return removed
@@ -0,0 +1,577 @@
+"""协作通道（Socket.IO）的压测工具
+
+在本机启动（或连接到已启动的）后端服务，模拟 N 个客户端分布在 M 个协作房间中，
+按设定的频率混合发送文档编辑、光标移动和聊天消息，最后报告：
+
+- 扇出延迟：从发送者 emit 到房间内其他客户端收到的时间（包含批量广播的等待时间），按事件类型给出 p50/p99
+- 消息吞吐：每秒发送的事件数、收到的事件数和 room_batch 帧数
+- 服务进程内存：压测期间按秒采样的 RSS
+
+用法：
+    python loadtest.py --spawn --clients 100 --rooms 10 --duration 60
+    python loadtest.py --url http://127.0.0.1:5000 --server-pid 12345 --clients 50 --rooms 5
+
+--spawn 在子进程中启动后端服务，未设置 DATABASE_URL 时使用临时目录中的 SQLite 数据库，不会写入开发数据库；
+连接到已有的服务时，压测用户和笔记会写入该服务的数据库。相同的 --seed 产生相同的操作序列。
+压测客户端需要 python-socketio 的客户端依赖：pip install "python-socketio[client]"
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import requests
+import socketio
+
+from payload_codec import PayloadCodec
+
+# 插入的文字，模拟正常的输入
+WORDS = ['协作', '笔记', '文档', '会议', '纪要', '计划', '总结', '需求', 'note', 'draft', 'todo', 'review']
+
+
+# -------------------------- 统计 --------------------------
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class LoadStats:
+    """所有客户端共享的计数和延迟样本"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sent = defaultdict(int)  # 事件类型 -> 发送数
+        self.received = defaultdict(int)  # 事件名 -> 收到数
+        self.frames = 0
+        self.errors = defaultdict(int)  # 错误信息 -> 次数
+        self.latencies = defaultdict(list)  # 事件类型 -> 扇出延迟（秒）
+        self.timeline = defaultdict(lambda: defaultdict(int))  # 秒 -> 计数项 -> 次数
+        self.user_id = None  # 压测用户的ID，登录的客户端以它作为聊天消息的发送者
+        self.stopping = False
+        self._marks = {}  # 标记 -> 发送时间
+        self._lock = threading.Lock()
+
+    def second(self):
+        return int(time.perf_counter() - self.started)
+
+    def mark(self, kind, marker):
+        """记录带标记事件的发送时间"""
+        with self._lock:
+            self._marks[marker] = time.perf_counter()
+            self.sent[kind] += 1
+            self.timeline[self.second()]['sent'] += 1
+
+    def count_sent(self, kind):
+        with self._lock:
+            self.sent[kind] += 1
+            self.timeline[self.second()]['sent'] += 1
+
+    def deliver(self, kind, marker=None, sent_at=None):
+        """记录收到的事件；能找到发送时间时记录扇出延迟"""
+        now = time.perf_counter()
+        with self._lock:
+            if sent_at is None:
+                sent_at = self._marks.get(marker)
+            if sent_at is not None:
+                self.latencies[kind].append(now - sent_at)
+            self.timeline[self.second()]['received'] += 1
+
+    def count_received(self, event):
+        with self._lock:
+            self.received[event] += 1
+
+    def count_frame(self):
+        with self._lock:
+            self.frames += 1
+            self.timeline[self.second()]['frames'] += 1
+
+    def error(self, message):
+        with self._lock:
+            self.errors[str(message)] += 1
+
+    def summary(self, elapsed):
+        latencies = {}
+        for kind, values in self.latencies.items():
+            latencies[kind] = {
+                'samples': len(values),
+                'p50_ms': round(percentile(values, 50) * 1000, 2),
+                'p99_ms': round(percentile(values, 99) * 1000, 2),
+                'max_ms': round(max(values) * 1000, 2)
+            }
+        return {
+            'elapsed': round(elapsed, 2),
+            'sent': dict(self.sent),
+            'received': dict(self.received),
+            'sent_per_second': round(sum(self.sent.values()) / elapsed, 2),
+            'received_per_second': round(sum(self.received.values()) / elapsed, 2),
+            'frames_per_second': round(self.frames / elapsed, 2),
+            'latency': latencies,
+            'errors': dict(self.errors),
+            'timeline': [{'second': second, **counts} for second, counts in sorted(self.timeline.items())]
+        }
+
+
+class MemorySampler:
+    """每隔 interval 秒采样进程的 RSS（读取 /proc，非 Linux 系统需安装 psutil）"""
+
+    def __init__(self, pid, interval=1.0):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []  # [(秒, RSS MB)]
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def rss(self):
+        try:
+            with open(f'/proc/{self.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        try:
+            import psutil
+            return psutil.Process(self.pid).memory_info().rss / 1024 / 1024
+        except Exception:
+            return None
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        started = time.perf_counter()
+        while not self._stop.is_set():
+            rss = self.rss()
+            if rss is not None:
+                self.samples.append((round(time.perf_counter() - started, 1), round(rss, 1)))
+            self._stop.wait(self.interval)
+
+    def summary(self):
+        if not self.samples:
+            return None
+        values = [rss for _, rss in self.samples]
+        return {'pid': self.pid, 'start_mb': values[0], 'end_mb': values[-1], 'peak_mb': max(values),
+                'samples': self.samples}
+
+
+# -------------------------- 准备房间 --------------------------
+def api(session, method, url, **kwargs):
+    response = session.request(method, url, timeout=30, **kwargs)
+    body = response.json()
+    if response.status_code >= 400 and body.get('message') != '用户名已存在':
+        raise RuntimeError(f'{method} {url} 失败: {body.get("message")}')
+    return body.get('data')
+
+
+def prepare_rooms(url, rooms, username, password, run_id):
+    """注册（或登录）压测用户，创建 rooms 篇开启协作编辑分享的笔记，返回 (用户, JWT, 房间列表)"""
+    session = requests.Session()
+    api(session, 'POST', f'{url}/api/register', json={'username': username, 'password': password})
+    login = api(session, 'POST', f'{url}/api/login', json={'username': username, 'password': password})
+    token = login['token']
+    session.headers['Authorization'] = f'Bearer {token}'
+
+    result = []
+    for i in range(rooms):
+        note = api(session, 'POST', f'{url}/api/notes', json={
+            'title': f'压测笔记 {run_id}-{i}',
+            'content': json.dumps({'ops': [{'insert': '压测文档\n'}]}, ensure_ascii=False),
+            'type': 'richtext'
+        })
+        share = api(session, 'POST', f'{url}/api/notes/{note["id"]}/share',
+                    json={'permission': 'edit', 'is_collaborative': True})
+        result.append({'doc_id': note['id'], 'room_id': share['room_id'], 'share_token': share['share_token']})
+    return login['user'], token, result
+
+
+# -------------------------- 模拟客户端 --------------------------
+def change_length(ops):
+    """操作对文档长度的改变"""
+    length = 0
+    for op in ops:
+        if 'insert' in op:
+            length += len(op['insert']) if isinstance(op['insert'], str) else 1
+        elif 'delete' in op:
+            length -= op['delete']
+    return length
+
+
+class SimulatedClient:
+    """一个协作客户端：加入房间，按泊松过程随机发送编辑、光标和聊天消息
+
+    与前端的 CollabSession 一样每次只有一个等待确认的编辑；文档内容只跟踪长度，用于生成合法的插入和删除位置
+    """
+
+    def __init__(self, index, url, room, token, stats, args):
+        self.index = index
+        self.url = url
+        self.room = room
+        self.token = token  # None 时作为访客凭 share_token 加入
+        self.stats = stats
+        self.args = args
+        self.rng = random.Random(args.seed * 100003 + index)
+        self.codec = PayloadCodec()
+        self.client = socketio.Client(reconnection=False)
+        self.sid = None
+        self.version = None
+        self.length = 0
+        self.inflight = None  # (op_id, 长度变化)
+        self.seq = 0
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+
+        on = self.client.on
+        on('connected', self.on_connected)
+        on('room_batch', self.on_room_batch)
+        on('document_state', self.on_document_state)
+        on('document_operations', self.on_document_operations)
+        on('error', self.on_error)
+        on('room_revoked', lambda data: self.stats.error('room_revoked'))
+        on('disconnect', self.on_disconnect)
+
+    # -------------------------- 连接 --------------------------
+    def connect(self):
+        auth = {'encodings': self.args.encodings}
+        if self.token:
+            auth['token'] = self.token
+        self.client.connect(self.url, auth=auth, transports=['websocket'], wait_timeout=10)
+        self.client.emit('join_room', {
+            'room_id': self.room['room_id'],
+            'share_token': None if self.token else self.room['share_token'],
+            'user_info': {'username': f'压测{self.index}'}
+        })
+
+    def close(self):
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+    def on_connected(self, data):
+        self.sid = data.get('sid')
+
+    def on_disconnect(self, *args):
+        if not self.stats.stopping:
+            self.stats.error('disconnected')
+
+    def on_error(self, data):
+        self.stats.error(data.get('message') if isinstance(data, dict) else data)
+
+    # -------------------------- 接收 --------------------------
+    def on_document_state(self, data):
+        data = self.codec.decode_frame(data)
+        self.stats.count_received('document_state')
+        with self._lock:
+            if data.get('rejected'):
+                self.stats.error('rejected')
+                self.inflight = None
+            self.version = data['version']
+            self.length = change_length(data['snapshot']['ops']) + sum(
+                change_length(op['ops']) for op in data['operations'])
+        self.ready.set()
+
+    def on_document_operations(self, data):
+        data = self.codec.decode_frame(data)
+        self.stats.count_received('document_operations')
+        with self._lock:
+            for op in data['operations']:
+                if op['version'] == self.version + 1:
+                    self.version = op['version']
+                    self.length += change_length(op['ops'])
+
+    def on_room_batch(self, data):
+        self.stats.count_frame()
+        for entry in data['events']:
+            if entry.get('skip') == self.sid:
+                continue
+            event, payload = entry['event'], entry['data']
+            self.stats.count_received(event)
+            if event == 'document_operation':
+                self.on_operation(payload)
+            elif event == 'document_ack':
+                self.on_ack(payload)
+            elif event == 'cursor_moved':
+                sent_at = (payload.get('range') or {}).get('sent_at')
+                self.stats.deliver('cursor', sent_at=sent_at)
+            elif event == 'new_message' and payload['sender_id'] != self.sender_id():
+                self.stats.deliver('chat', marker=payload['message'])
+
+    def on_operation(self, data):
+        marker = next((op['insert'].split(' ', 1)[0] for op in data['ops']
+                       if isinstance(op.get('insert'), str) and op['insert'].startswith('#')), None)
+        self.stats.deliver('edit', marker=marker)
+        with self._lock:
+            if self.version is not None and data['version'] == self.version + 1:
+                self.version = data['version']
+                self.length += change_length(data['ops'])
+            elif self.version is not None and data['version'] > self.version + 1:
+                # 漏收了操作，重新获取文档
+                self.stats.error('version gap')
+                self.client.emit('get_document_state', {'doc_id': self.room['doc_id'], 'doc_type': 'note'})
+
+    def on_ack(self, data):
+        with self._lock:
+            if self.inflight is None or data.get('op_id') != self.inflight[0]:
+                return
+            if data['version'] == self.version + 1:
+                self.version = data['version']
+                self.length += self.inflight[1]
+            self.inflight = None
+            if data.get('rebased'):
+                self.stats.count_received('rebased')
+
+    def sender_id(self):
+        # 登录用户的聊天消息以用户ID为发送者，所有登录的压测客户端是同一个用户
+        return self.stats.user_id if self.token else self.sid
+
+    # -------------------------- 发送 --------------------------
+    def edit(self):
+        with self._lock:
+            if self.inflight is not None or self.version is None:
+                return
+            self.seq += 1
+            marker = f'#{self.index}.{self.seq}'
+            text = f'{marker} {self.rng.choice(WORDS)} '
+            # 文档末尾的换行不删除，插入位置不超过换行之前
+            position = self.rng.randint(0, max(0, self.length - 1))
+            ops = [{'retain': position}] if position else []
+            change = len(text)
+            deletable = self.length - 1 - position
+            if deletable > 0 and self.length > self.args.doc_size and self.rng.random() < 0.5:
+                count = min(deletable, self.rng.randint(1, 2 * len(text)))
+                ops.append({'delete': count})
+                change -= count
+            ops.append({'insert': text})
+            op_id = f'{self.sid}:{self.seq}'
+            self.inflight = (op_id, change)
+            version = self.version
+        self.stats.mark('edit', marker)
+        self.client.emit('sync_document', {
+            'room_id': self.room['room_id'],
+            'doc_id': self.room['doc_id'],
+            'doc_type': 'note',
+            'ops': ops,
+            'version': version,
+            'op_id': op_id
+        })
+
+    def cursor(self):
+        self.stats.count_sent('cursor')
+        self.client.emit('cursor', {
+            'room_id': self.room['room_id'],
+            'doc_id': self.room['doc_id'],
+            'range': {'index': self.rng.randint(0, max(0, self.length - 1)), 'length': 0,
+                      'sent_at': time.perf_counter()}
+        })
+
+    def chat(self):
+        self.seq += 1
+        marker = f'msg-{self.index}.{self.seq}'
+        self.stats.mark('chat', marker)
+        self.client.emit('send_message', {'room_id': self.room['room_id'], 'message': marker})
+
+    def run(self, deadline):
+        """在 deadline 之前按各类事件的频率随机发送"""
+        actions = [(self.edit, self.args.edit_rate), (self.cursor, self.args.cursor_rate),
+                   (self.chat, self.args.chat_rate)]
+        actions = [(action, rate) for action, rate in actions if rate > 0]
+        total = sum(rate for _, rate in actions)
+        if not total:
+            return
+        while True:
+            wait = self.rng.expovariate(total)
+            if time.perf_counter() + wait >= deadline:
+                return
+            time.sleep(wait)
+            action = self.rng.choices([action for action, _ in actions], [rate for _, rate in actions])[0]
+            try:
+                action()
+            except socketio.exceptions.BadNamespaceError:
+                return
+
+
+# -------------------------- 本地服务 --------------------------
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def spawn_server(port):
+    """在子进程中启动后端服务，等待端口可连接后返回子进程；服务的输出写入临时目录中的 server.log"""
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    env = dict(os.environ)
+    if not env.get('DATABASE_URL'):
+        env['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'loadtest.db')
+    log_path = os.path.join(workdir, 'server.log')
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(log_path, 'wb') as log:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port)],
+                                   cwd=backend_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    print(f'服务进程 {process.pid} 已启动，日志: {log_path}')
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'服务进程启动失败，请查看 {log_path}')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError('等待服务启动超时')
+
+
+def serve(port):
+    """--spawn 启动的服务进程：建表后以生产方式（无调试、无自动重载）运行"""
+    from app import app, socketio as server
+    from models import db
+
+    with app.app_context():
+        db.create_all()
+    server.run(app, host='127.0.0.1', port=port, debug=False, use_reloader=False, log_output=False)
+
+
+# -------------------------- 主函数 --------------------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='协作通道（Socket.IO）压测')
+    parser.add_argument('--url', help='后端服务地址，未指定时需要 --spawn')
+    parser.add_argument('--spawn', action='store_true', help='在子进程中启动后端服务')
+    parser.add_argument('--port', type=int, default=0, help='--spawn 启动的服务端口，默认随机')
+    parser.add_argument('--server-pid', type=int, help='采样内存的服务进程ID，--spawn 时为子进程')
+    parser.add_argument('--clients', type=int, default=20, help='客户端数')
+    parser.add_argument('--rooms', type=int, default=4, help='房间数，客户端轮流分配到各房间')
+    parser.add_argument('--duration', type=float, default=30, help='发送事件的时长（秒）')
+    parser.add_argument('--ramp', type=float, default=5, help='所有客户端连接完成的时长（秒）')
+    parser.add_argument('--edit-rate', type=float, default=1.0, help='每个客户端每秒的编辑数')
+    parser.add_argument('--cursor-rate', type=float, default=4.0, help='每个客户端每秒的光标移动数')
+    parser.add_argument('--chat-rate', type=float, default=0.1, help='每个客户端每秒的聊天消息数')
+    parser.add_argument('--guest-ratio', type=float, default=0.5, help='凭分享链接加入的访客比例')
+    parser.add_argument('--doc-size', type=int, default=2000, help='文档超过该长度后编辑开始混入删除')
+    parser.add_argument('--encodings', default='deflate', help='客户端声明的消息编码，逗号分隔，可为空')
+    parser.add_argument('--username', default='loadtest')
+    parser.add_argument('--password', default='loadtest123')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='把完整结果（含每秒计数和内存采样）写入该文件')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.encodings = [name for name in args.encodings.split(',') if name]
+    if not args.serve and not args.url and not args.spawn:
+        parser.error('需要指定 --url 或 --spawn')
+    return args
+
+
+def print_report(result):
+    stats, memory = result['stats'], result['memory']
+    print(f"客户端 {result['clients']} 个，房间 {result['rooms']} 个，连接失败 {result['connect_failures']} 个，"
+          f"压测 {stats['elapsed']} 秒")
+    print(f"发送 {stats['sent_per_second']} 条/秒，收到 {stats['received_per_second']} 条/秒，"
+          f"room_batch {stats['frames_per_second']} 帧/秒")
+    print('扇出延迟：')
+    for kind, latency in sorted(stats['latency'].items()):
+        print(f"  {kind:<8} p50 {latency['p50_ms']:>8} ms  p99 {latency['p99_ms']:>8} ms  "
+              f"max {latency['max_ms']:>8} ms  ({latency['samples']} 条)")
+    if memory:
+        print(f"服务进程内存：开始 {memory['start_mb']} MB，结束 {memory['end_mb']} MB，峰值 {memory['peak_mb']} MB")
+    if stats['errors']:
+        print('错误：')
+        for message, count in sorted(stats['errors'].items(), key=lambda item: -item[1]):
+            print(f'  {count:>6}  {message}')
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.serve:
+        serve(args.port)
+        return
+
+    process = None
+    url = args.url
+    if args.spawn:
+        port = args.port or free_port()
+        process = spawn_server(port)
+        url = f'http://127.0.0.1:{port}'
+    url = url.rstrip('/')
+    server_pid = args.server_pid or (process.pid if process else None)
+
+    stats = LoadStats()
+    sampler = MemorySampler(server_pid) if server_pid else None
+    clients = []
+    try:
+        rng = random.Random(args.seed)
+        user, token, rooms = prepare_rooms(url, args.rooms, args.username, args.password,
+                                           f'{args.seed}-{uuid.uuid4().hex[:8]}')
+        stats.user_id = user['id']
+        if sampler:
+            sampler.start()
+
+        # 在 ramp 秒内逐个连接，避免连接风暴影响测量
+        connect_failures = 0
+        for index in range(args.clients):
+            room = rooms[index % len(rooms)]
+            client = SimulatedClient(index, url, room, None if rng.random() < args.guest_ratio else token,
+                                     stats, args)
+            try:
+                client.connect()
+                clients.append(client)
+            except Exception as e:
+                connect_failures += 1
+                stats.error(f'连接失败: {str(e)}')
+            time.sleep(args.ramp / max(1, args.clients))
+        for client in clients:
+            if not client.ready.wait(10):
+                stats.error('未收到文档状态')
+
+        stats.started = time.perf_counter()
+        stats.timeline.clear()
+        deadline = stats.started + args.duration
+        threads = [threading.Thread(target=client.run, args=(deadline,), daemon=True) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 等待最后一批广播送达
+        time.sleep(1)
+        elapsed = time.perf_counter() - stats.started
+    finally:
+        stats.stopping = True
+        for client in clients:
+            client.close()
+        if sampler:
+            sampler.stop()
+        if process:
+            process.terminate()
+            process.wait()
+
+    result = {
+        'url': url,
+        'clients': args.clients,
+        'rooms': args.rooms,
+        'connect_failures': connect_failures,
+        'args': {key: value for key, value in vars(args).items() if key not in ('password', 'serve')},
+        'stats': stats.summary(elapsed),
+        'memory': sampler.summary() if sampler else None
+    }
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    main()
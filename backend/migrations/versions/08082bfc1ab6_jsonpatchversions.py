@@ -0,0 +1,103 @@
+"""JsonPatchVersions
+
+Revision ID: 08082bfc1ab6
+Revises: 9482cf10cde7
+Create Date: 2026-10-18 10:41:03.582914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+from versioning import encode_version, decode_version, diff_json, patch_json, DEFAULT_KEYFRAME_INTERVAL
+
+
+# revision identifiers, used by Alembic.
+revision = '08082bfc1ab6'
+down_revision = '9482cf10cde7'
+branch_labels = None
+depends_on = None
+
+
+# 版本表 -> (所属文档外键, {快照键: 旧版列名})
+VERSION_TABLES = {
+    'flowchart_version': ('flowchart_id', {None: 'flow_data'}),
+    'mindmap_version': ('mindmap_id', {None: 'data'}),
+    'whiteboard_version': ('whiteboard_id', {None: 'data'}),
+    'table_document_version': ('table_document_id', {
+        'columns': 'columns_data',
+        'rows': 'rows_data',
+        'cellStyles': 'cell_styles'
+    }),
+}
+
+
+def _table(name):
+    parent_key, columns = VERSION_TABLES[name]
+    return sa.table(
+        name,
+        sa.column('id', sa.Integer),
+        sa.column(parent_key, sa.Integer),
+        sa.column('storage', sa.String),
+        sa.column('payload', sa.LargeBinary),
+        *[sa.column(column, sa.JSON(none_as_null=True)) for column in columns.values()]
+    )
+
+
+def _snapshot(row, columns):
+    if None in columns:
+        return row._mapping[columns[None]]
+    return {key: row._mapping[column] for key, column in columns.items()}
+
+
+def _legacy_values(snapshot, columns):
+    if None in columns:
+        return {columns[None]: snapshot}
+    return {column: (snapshot or {}).get(key) for key, column in columns.items()}
+
+
+def upgrade():
+    for name in VERSION_TABLES:
+        with op.batch_alter_table(name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('storage', sa.String(length=10), nullable=False, server_default='full'))
+            batch_op.add_column(sa.Column('payload', sa.LargeBinary().with_variant(mysql.LONGBLOB(), 'mysql'), nullable=True))
+
+    # 把旧的完整JSON快照转换为关键帧+JSON Patch，转换后清空旧列
+    bind = op.get_bind()
+    for name, (parent_key, columns) in VERSION_TABLES.items():
+        table = _table(name)
+        parent = table.c[parent_key]
+        cleared = {column: None for column in columns.values()}
+        for parent_id in [row[0] for row in bind.execute(sa.select(parent).distinct())]:
+            rows = bind.execute(sa.select(table).where(parent == parent_id).order_by(table.c.id)).fetchall()
+            previous = None
+            chain_length = 0
+            for row in rows:
+                snapshot = _snapshot(row, columns)
+                storage, payload = encode_version(snapshot, previous, chain_length, diff_json, DEFAULT_KEYFRAME_INTERVAL)
+                chain_length = 1 if storage == 'full' else chain_length + 1
+                previous = snapshot
+                bind.execute(
+                    table.update()
+                    .where(table.c.id == row.id)
+                    .values(storage=storage, payload=payload, **cleared)
+                )
+
+
+def downgrade():
+    bind = op.get_bind()
+    for name, (parent_key, columns) in VERSION_TABLES.items():
+        table = _table(name)
+        rows = bind.execute(sa.select(table).order_by(table.c[parent_key], table.c.id)).fetchall()
+        previous = None
+        for row in rows:
+            if row.payload is None:
+                snapshot = _snapshot(row, columns)
+            else:
+                snapshot = decode_version(row.storage, row.payload, previous, patch_json)
+            previous = snapshot
+            bind.execute(table.update().where(table.c.id == row.id).values(**_legacy_values(snapshot, columns)))
+
+        with op.batch_alter_table(name, schema=None) as batch_op:
+            batch_op.drop_column('payload')
+            batch_op.drop_column('storage')
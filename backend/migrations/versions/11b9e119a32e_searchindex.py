@@ -0,0 +1,67 @@
+"""SearchIndex
+
+Revision ID: 11b9e119a32e
+Revises: 60e791781c0a
+Create Date: 2026-10-18 13:02:41.518302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = '11b9e119a32e'
+down_revision = '60e791781c0a'
+branch_labels = None
+depends_on = None
+
+
+# 与建立本迁移时 search.py 中的定义一致
+SQLITE_FULLTEXT_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+    "title, body, content='search_document', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS search_document_ai AFTER INSERT ON search_document BEGIN "
+    "INSERT INTO search_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_document_ad AFTER DELETE ON search_document BEGIN "
+    "INSERT INTO search_fts(search_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_document_au AFTER UPDATE ON search_document BEGIN "
+    "INSERT INTO search_fts(search_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); "
+    "INSERT INTO search_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+)
+
+MYSQL_FULLTEXT_DDL = (
+    "ALTER TABLE search_document ADD FULLTEXT INDEX ft_search_document (title, body) WITH PARSER ngram",
+)
+
+
+def upgrade():
+    op.create_table('search_document',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('doc_type', sa.String(length=20), nullable=False),
+    sa.Column('doc_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=255), nullable=False),
+    sa.Column('body', sa.Text().with_variant(mysql.LONGTEXT(), 'mysql'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('doc_type', 'doc_id', name='uq_search_document_doc')
+    )
+    with op.batch_alter_table('search_document', schema=None) as batch_op:
+        batch_op.create_index('ix_search_document_user_type', ['user_id', 'doc_type'], unique=False)
+
+    # 已有文档的索引由之后的 SearchBackfill 迁移建立
+    bind = op.get_bind()
+    statements = {'sqlite': SQLITE_FULLTEXT_DDL, 'mysql': MYSQL_FULLTEXT_DDL}.get(bind.dialect.name, ())
+    for statement in statements:
+        op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS search_fts')
+    with op.batch_alter_table('search_document', schema=None) as batch_op:
+        batch_op.drop_index('ix_search_document_user_type')
+
+    op.drop_table('search_document')
@@ -0,0 +1,31 @@
+"""DailyStats
+
+Revision ID: 17d3e3128533
+Revises: bc55674cfa76
+Create Date: 2026-10-18 15:02:41.318527
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '17d3e3128533'
+down_revision = 'bc55674cfa76'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 统计表由定时任务或首次访问仪表盘时填充，不需要回填
+    op.create_table('daily_stat',
+    sa.Column('stat_date', sa.Date(), nullable=False),
+    sa.Column('metric', sa.String(length=30), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('stat_date', 'metric')
+    )
+
+
+def downgrade():
+    op.drop_table('daily_stat')
@@ -0,0 +1,69 @@
+"""VersionSummaryColumns
+
+Revision ID: 38f3df0b984f
+Revises: 08082bfc1ab6
+Create Date: 2026-10-18 11:26:48.903371
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from versioning import decode_version, patch_text, patch_json, dumps, text_preview, json_preview, table_preview
+
+
+# revision identifiers, used by Alembic.
+revision = '38f3df0b984f'
+down_revision = '08082bfc1ab6'
+branch_labels = None
+depends_on = None
+
+
+# 版本表 -> (所属文档外键, 差量还原函数, 大小计算函数, 预览函数)
+VERSION_TABLES = {
+    'note_version': ('note_id', patch_text, lambda data: len((data or '').encode('utf-8')), text_preview),
+    'flowchart_version': ('flowchart_id', patch_json, lambda data: len(dumps(data)), json_preview),
+    'mindmap_version': ('mindmap_id', patch_json, lambda data: len(dumps(data)), json_preview),
+    'whiteboard_version': ('whiteboard_id', patch_json, lambda data: len(dumps(data)), json_preview),
+    'table_document_version': ('table_document_id', patch_json, lambda data: len(dumps(data)), table_preview),
+}
+
+
+def upgrade():
+    for name in VERSION_TABLES:
+        with op.batch_alter_table(name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('content_size', sa.Integer(), nullable=True))
+            batch_op.add_column(sa.Column('preview', sa.String(length=200), nullable=True))
+
+    # 依次还原每个版本，回填大小和预览
+    bind = op.get_bind()
+    for name, (parent_key, patch, size, preview) in VERSION_TABLES.items():
+        table = sa.table(
+            name,
+            sa.column('id', sa.Integer),
+            sa.column(parent_key, sa.Integer),
+            sa.column('storage', sa.String),
+            sa.column('payload', sa.LargeBinary),
+            sa.column('content_size', sa.Integer),
+            sa.column('preview', sa.String),
+        )
+        rows = bind.execute(
+            sa.select(table.c.id, table.c.storage, table.c.payload)
+            .where(table.c.payload.isnot(None))
+            .order_by(table.c[parent_key], table.c.id)
+        ).fetchall()
+        previous = None
+        for row in rows:
+            data = decode_version(row.storage, row.payload, previous, patch)
+            previous = data
+            bind.execute(
+                table.update()
+                .where(table.c.id == row.id)
+                .values(content_size=size(data), preview=preview(data))
+            )
+
+
+def downgrade():
+    for name in VERSION_TABLES:
+        with op.batch_alter_table(name, schema=None) as batch_op:
+            batch_op.drop_column('preview')
+            batch_op.drop_column('content_size')
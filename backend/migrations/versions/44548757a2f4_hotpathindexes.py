@@ -0,0 +1,56 @@
+"""HotPathIndexes
+
+Revision ID: 44548757a2f4
+Revises: 17d3e3128533
+Create Date: 2026-10-18 16:12:05.428193
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '44548757a2f4'
+down_revision = '17d3e3128533'
+branch_labels = None
+depends_on = None
+
+
+CONTENT_TABLES = ('note', 'flowchart', 'table_document', 'whiteboard', 'mindmap')
+
+SHARE_LINK_COLUMNS = ('note_id', 'flowchart_id', 'mindmap_id', 'table_document_id', 'whiteboard_id', 'expire_at')
+
+
+def upgrade():
+    for table in CONTENT_TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(f'ix_{table}_user_updated', ['user_id', 'updated_at'], unique=False)
+            batch_op.create_index(f'ix_{table}_user_title', ['user_id', 'title'], unique=False)
+        with op.batch_alter_table(f'{table}_version', schema=None) as batch_op:
+            batch_op.create_index(f'ix_{table}_version_{table}_id', [f'{table}_id', 'id'], unique=False)
+
+    with op.batch_alter_table('share_link', schema=None) as batch_op:
+        for column in SHARE_LINK_COLUMNS:
+            batch_op.create_index(f'ix_share_link_{column}', [column], unique=False)
+
+
+def downgrade():
+    # MySQL 建立以外键列开头的索引后会删除外键自动创建的索引，删除这些索引前先为外键列补回单列索引
+    mysql = op.get_bind().dialect.name == 'mysql'
+
+    with op.batch_alter_table('share_link', schema=None) as batch_op:
+        for column in reversed(SHARE_LINK_COLUMNS):
+            if mysql and column != 'expire_at':
+                batch_op.create_index(column, [column], unique=False)
+            batch_op.drop_index(f'ix_share_link_{column}')
+
+    for table in reversed(CONTENT_TABLES):
+        with op.batch_alter_table(f'{table}_version', schema=None) as batch_op:
+            if mysql:
+                batch_op.create_index(f'{table}_id', [f'{table}_id'], unique=False)
+            batch_op.drop_index(f'ix_{table}_version_{table}_id')
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            if mysql:
+                batch_op.create_index('user_id', ['user_id'], unique=False)
+            batch_op.drop_index(f'ix_{table}_user_title')
+            batch_op.drop_index(f'ix_{table}_user_updated')
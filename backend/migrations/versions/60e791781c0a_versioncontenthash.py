@@ -0,0 +1,62 @@
+"""VersionContentHash
+
+Revision ID: 60e791781c0a
+Revises: 38f3df0b984f
+Create Date: 2026-10-18 12:08:15.264530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from versioning import decode_version, patch_text, patch_json, content_digest
+
+
+# revision identifiers, used by Alembic.
+revision = '60e791781c0a'
+down_revision = '38f3df0b984f'
+branch_labels = None
+depends_on = None
+
+
+# 版本表 -> (所属文档外键, 差量还原函数)
+VERSION_TABLES = {
+    'note_version': ('note_id', patch_text),
+    'flowchart_version': ('flowchart_id', patch_json),
+    'mindmap_version': ('mindmap_id', patch_json),
+    'whiteboard_version': ('whiteboard_id', patch_json),
+    'table_document_version': ('table_document_id', patch_json),
+}
+
+
+def upgrade():
+    for name in VERSION_TABLES:
+        with op.batch_alter_table(name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+    # 回填内容摘要，使升级后的第一次保存也能跳过未变化的内容
+    bind = op.get_bind()
+    for name, (parent_key, patch) in VERSION_TABLES.items():
+        table = sa.table(
+            name,
+            sa.column('id', sa.Integer),
+            sa.column(parent_key, sa.Integer),
+            sa.column('storage', sa.String),
+            sa.column('payload', sa.LargeBinary),
+            sa.column('content_hash', sa.String),
+        )
+        rows = bind.execute(
+            sa.select(table.c.id, table.c.storage, table.c.payload)
+            .where(table.c.payload.isnot(None))
+            .order_by(table.c[parent_key], table.c.id)
+        ).fetchall()
+        previous = None
+        for row in rows:
+            data = decode_version(row.storage, row.payload, previous, patch)
+            previous = data
+            bind.execute(table.update().where(table.c.id == row.id).values(content_hash=content_digest(data)))
+
+
+def downgrade():
+    for name in VERSION_TABLES:
+        with op.batch_alter_table(name, schema=None) as batch_op:
+            batch_op.drop_column('content_hash')
@@ -0,0 +1,87 @@
+"""SearchTokens
+
+Revision ID: 611a3bbd8725
+Revises: 11b9e119a32e
+Create Date: 2026-10-18 13:47:12.906114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = '611a3bbd8725'
+down_revision = '11b9e119a32e'
+branch_labels = None
+depends_on = None
+
+
+SQLITE_TRIGGERS = ('search_document_ai', 'search_document_ad', 'search_document_au')
+
+
+def _sqlite_fulltext(columns, tokenize):
+    """生成 FTS5 外部内容表及同步触发器的建表语句"""
+    names = ', '.join(columns)
+    new_values = ', '.join(f'new.{column}' for column in columns)
+    old_values = ', '.join(f'old.{column}' for column in columns)
+    return (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+        f"{names}, content='search_document', content_rowid='id', tokenize='{tokenize}')",
+        f"CREATE TRIGGER IF NOT EXISTS search_document_ai AFTER INSERT ON search_document BEGIN "
+        f"INSERT INTO search_fts(rowid, {names}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS search_document_ad AFTER DELETE ON search_document BEGIN "
+        f"INSERT INTO search_fts(search_fts, rowid, {names}) VALUES ('delete', old.id, {old_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS search_document_au AFTER UPDATE ON search_document BEGIN "
+        f"INSERT INTO search_fts(search_fts, rowid, {names}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO search_fts(rowid, {names}) VALUES (new.id, {new_values}); END",
+    )
+
+
+def _drop_sqlite_fulltext():
+    for trigger in SQLITE_TRIGGERS:
+        op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    op.execute('DROP TABLE IF EXISTS search_fts')
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        _drop_sqlite_fulltext()
+    elif dialect == 'mysql':
+        op.execute('ALTER TABLE search_document DROP INDEX ft_search_document')
+
+    with op.batch_alter_table('search_document', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('title_tokens', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('body_tokens', sa.Text().with_variant(mysql.LONGTEXT(), 'mysql'), nullable=True))
+        batch_op.add_column(sa.Column('token_count', sa.Integer(), nullable=False, server_default='0'))
+
+    # 全文索引改为建立在分词结果上，已有索引行的分词结果由之后的 SearchBackfill 迁移生成
+    if dialect == 'sqlite':
+        for statement in _sqlite_fulltext(('title_tokens', 'body_tokens'), 'unicode61'):
+            op.execute(statement)
+        # 外部内容表需要与已有行保持一致，否则之后的更新触发器会损坏索引
+        op.execute("INSERT INTO search_fts(search_fts) VALUES ('rebuild')")
+    elif dialect == 'mysql':
+        op.execute('ALTER TABLE search_document ADD FULLTEXT INDEX ft_search_document_tokens '
+                   '(title_tokens, body_tokens) WITH PARSER ngram')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        _drop_sqlite_fulltext()
+    elif dialect == 'mysql':
+        op.execute('ALTER TABLE search_document DROP INDEX ft_search_document_tokens')
+
+    with op.batch_alter_table('search_document', schema=None) as batch_op:
+        batch_op.drop_column('token_count')
+        batch_op.drop_column('body_tokens')
+        batch_op.drop_column('title_tokens')
+
+    if dialect == 'sqlite':
+        for statement in _sqlite_fulltext(('title', 'body'), 'trigram'):
+            op.execute(statement)
+        op.execute("INSERT INTO search_fts(search_fts) VALUES ('rebuild')")
+    elif dialect == 'mysql':
+        op.execute('ALTER TABLE search_document ADD FULLTEXT INDEX ft_search_document (title, body) WITH PARSER ngram')
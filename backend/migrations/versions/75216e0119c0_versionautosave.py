@@ -0,0 +1,33 @@
+"""VersionAutosave
+
+Revision ID: 75216e0119c0
+Revises: c64184dfde31
+Create Date: 2026-10-18 20:15:42.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '75216e0119c0'
+down_revision = 'c64184dfde31'
+branch_labels = None
+depends_on = None
+
+
+VERSION_TABLES = ('note_version', 'flowchart_version', 'mindmap_version', 'whiteboard_version',
+                  'table_document_version')
+
+
+def upgrade():
+    # 已有版本都按手动保存处理，升级后的第一次自动保存不会合并到旧版本中
+    for name in VERSION_TABLES:
+        with op.batch_alter_table(name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('autosave', sa.Boolean(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    for name in VERSION_TABLES:
+        with op.batch_alter_table(name, schema=None) as batch_op:
+            batch_op.drop_column('autosave')
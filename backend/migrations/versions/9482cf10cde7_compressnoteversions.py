@@ -0,0 +1,80 @@
+"""CompressNoteVersions
+
+Revision ID: 9482cf10cde7
+Revises: 3f7abbd34603
+Create Date: 2026-10-18 09:12:37.415206
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+from versioning import encode_version, decode_version, diff_text, patch_text, DEFAULT_KEYFRAME_INTERVAL
+
+
+# revision identifiers, used by Alembic.
+revision = '9482cf10cde7'
+down_revision = '3f7abbd34603'
+branch_labels = None
+depends_on = None
+
+
+note_version = sa.table(
+    'note_version',
+    sa.column('id', sa.Integer),
+    sa.column('note_id', sa.Integer),
+    sa.column('content', sa.Text),
+    sa.column('storage', sa.String),
+    sa.column('payload', sa.LargeBinary),
+)
+
+
+def upgrade():
+    with op.batch_alter_table('note_version', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('storage', sa.String(length=10), nullable=False, server_default='full'))
+        batch_op.add_column(sa.Column('payload', sa.LargeBinary().with_variant(mysql.LONGBLOB(), 'mysql'), nullable=True))
+        batch_op.alter_column('content', existing_type=sa.Text(), nullable=True)
+
+    # 按笔记逐条把旧的全文版本转换为关键帧+差量，转换后清空content列
+    bind = op.get_bind()
+    note_ids = [row.note_id for row in bind.execute(sa.select(note_version.c.note_id).distinct())]
+    for note_id in note_ids:
+        rows = bind.execute(
+            sa.select(note_version.c.id, note_version.c.content)
+            .where(note_version.c.note_id == note_id)
+            .order_by(note_version.c.id)
+        ).fetchall()
+        previous = None
+        chain_length = 0
+        for row in rows:
+            content = row.content or ''
+            storage, payload = encode_version(content, previous, chain_length, diff_text, DEFAULT_KEYFRAME_INTERVAL)
+            chain_length = 1 if storage == 'full' else chain_length + 1
+            previous = content
+            bind.execute(
+                note_version.update()
+                .where(note_version.c.id == row.id)
+                .values(storage=storage, payload=payload, content=None)
+            )
+
+
+def downgrade():
+    # 还原每个版本的全文写回content列
+    bind = op.get_bind()
+    rows = bind.execute(
+        sa.select(note_version.c.id, note_version.c.storage, note_version.c.payload, note_version.c.content)
+        .order_by(note_version.c.note_id, note_version.c.id)
+    ).fetchall()
+    previous = None
+    for row in rows:
+        if row.payload is None:
+            content = row.content or ''
+        else:
+            content = decode_version(row.storage, row.payload, previous, patch_text)
+        previous = content
+        bind.execute(note_version.update().where(note_version.c.id == row.id).values(content=content))
+
+    with op.batch_alter_table('note_version', schema=None) as batch_op:
+        batch_op.alter_column('content', existing_type=sa.Text(), nullable=False)
+        batch_op.drop_column('payload')
+        batch_op.drop_column('storage')
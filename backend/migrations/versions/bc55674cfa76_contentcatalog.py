@@ -0,0 +1,116 @@
+"""ContentCatalog
+
+Revision ID: bc55674cfa76
+Revises: 611a3bbd8725
+Create Date: 2026-10-18 14:25:36.770419
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from versioning import dumps
+
+
+# revision identifiers, used by Alembic.
+revision = 'bc55674cfa76'
+down_revision = '611a3bbd8725'
+branch_labels = None
+depends_on = None
+
+
+BATCH_SIZE = 500
+
+
+def _json_size(data):
+    return len(dumps(data)) if data is not None else 0
+
+
+# 内容表 -> (目录中的类型, 内容列, 大小计算函数)
+CONTENT_TABLES = {
+    'note': ('note', ('content',), lambda row: len((row.content or '').encode('utf-8'))),
+    'table_document': ('table', ('columns_data', 'rows_data', 'cell_styles'), lambda row: _json_size({
+        'columns': row.columns_data,
+        'rows': row.rows_data,
+        'cellStyles': row.cell_styles
+    })),
+    'whiteboard': ('whiteboard', ('data',), lambda row: _json_size(row.data)),
+    'mindmap': ('mindmap', ('data',), lambda row: _json_size(row.data)),
+    'flowchart': ('flowchart', ('flow_data',), lambda row: _json_size(row.flow_data)),
+}
+
+
+def upgrade():
+    op.create_table('content_item',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('content_type', sa.String(length=20), nullable=False),
+    sa.Column('content_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=255), nullable=False),
+    sa.Column('size', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('content_type', 'content_id', name='uq_content_item_content')
+    )
+    with op.batch_alter_table('content_item', schema=None) as batch_op:
+        batch_op.create_index('ix_content_item_created', ['created_at', 'id'], unique=False)
+        batch_op.create_index('ix_content_item_updated', ['updated_at', 'id'], unique=False)
+        batch_op.create_index('ix_content_item_title', ['title', 'id'], unique=False)
+        batch_op.create_index('ix_content_item_type_created', ['content_type', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_content_item_type_updated', ['content_type', 'updated_at', 'id'], unique=False)
+        batch_op.create_index('ix_content_item_type_title', ['content_type', 'title', 'id'], unique=False)
+        batch_op.create_index('ix_content_item_user_type', ['user_id', 'content_type', 'updated_at'], unique=False)
+
+    # 回填已有内容，按主键分批读取
+    bind = op.get_bind()
+    catalog = sa.table(
+        'content_item',
+        sa.column('content_type', sa.String),
+        sa.column('content_id', sa.Integer),
+        sa.column('user_id', sa.Integer),
+        sa.column('title', sa.String),
+        sa.column('size', sa.Integer),
+        sa.column('created_at', sa.DateTime),
+        sa.column('updated_at', sa.DateTime),
+    )
+    for name, (content_type, columns, size) in CONTENT_TABLES.items():
+        table = sa.table(
+            name,
+            sa.column('id', sa.Integer),
+            sa.column('user_id', sa.Integer),
+            sa.column('title', sa.String),
+            sa.column('created_at', sa.DateTime),
+            sa.column('updated_at', sa.DateTime),
+            *[sa.column(column, sa.Text if column == 'content' else sa.JSON) for column in columns]
+        )
+        last_id = 0
+        while True:
+            rows = bind.execute(
+                sa.select(table).where(table.c.id > last_id).order_by(table.c.id).limit(BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            bind.execute(catalog.insert(), [{
+                'content_type': content_type,
+                'content_id': row.id,
+                'user_id': row.user_id,
+                'title': row.title or '',
+                'size': size(row),
+                'created_at': row.created_at,
+                'updated_at': row.updated_at
+            } for row in rows])
+            last_id = rows[-1].id
+
+
+def downgrade():
+    with op.batch_alter_table('content_item', schema=None) as batch_op:
+        batch_op.drop_index('ix_content_item_user_type')
+        batch_op.drop_index('ix_content_item_type_updated')
+        batch_op.drop_index('ix_content_item_type_title')
+        batch_op.drop_index('ix_content_item_type_created')
+        batch_op.drop_index('ix_content_item_updated')
+        batch_op.drop_index('ix_content_item_title')
+        batch_op.drop_index('ix_content_item_created')
+
+    op.drop_table('content_item')
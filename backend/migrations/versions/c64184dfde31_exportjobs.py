@@ -0,0 +1,48 @@
+"""ExportJobs
+
+Revision ID: c64184dfde31
+Revises: 44548757a2f4
+Create Date: 2026-10-18 18:40:12.503117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c64184dfde31'
+down_revision = '44548757a2f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 原先保存在进程内的导出任务在重启后即丢失，不需要迁移
+    op.create_table('export_job',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('format', sa.String(length=10), nullable=False),
+    sa.Column('dataset', sa.String(length=20), nullable=False),
+    sa.Column('gzip', sa.Boolean(), nullable=False),
+    sa.Column('stored_name', sa.String(length=64), nullable=False),
+    sa.Column('filename', sa.String(length=100), nullable=False),
+    sa.Column('rows_total', sa.Integer(), nullable=True),
+    sa.Column('rows_written', sa.Integer(), nullable=False),
+    sa.Column('progress', sa.Integer(), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_by', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['created_by'], ['user.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('export_job', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_export_job_created_at'), ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('export_job', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_export_job_created_at'))
+
+    op.drop_table('export_job')
@@ -1,10 +1,17 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import UserMixin
+from sqlalchemy.dialects import mysql
 from sqlalchemy.orm import relationship
 import re
 
+from versioning import (
+    encode_version, decode_version, diff_text, patch_text, diff_json, patch_json, dumps, content_digest,
+    text_preview, json_preview, table_preview, DEFAULT_KEYFRAME_INTERVAL
+)
+
 # 初始化数据库和加密工具（避免重复导入）
 db = SQLAlchemy()
 bcrypt = Bcrypt()
@@ -36,6 +43,187 @@ def generate_unique_name(base_name, existing_names):
             return new_name
 
 
+# 压缩后的版本数据，MySQL默认BLOB只有64KB，大文档需要LONGBLOB
+CompressedBlob = db.LargeBinary().with_variant(mysql.LONGBLOB(), 'mysql')
+
+
+class DeltaVersionMixin:
+    """历史版本差量存储：定期保存完整关键帧，其余版本只保存与上一版本的压缩差量
+
+    默认按JSON快照计算结构化差量，笔记等纯文本版本覆盖 _diff/_patch 使用文本差量
+    """
+    # 所属文档的外键字段名，由具体版本模型指定
+    parent_key = None
+
+    storage = db.Column(db.String(10), nullable=False, default='full', server_default='full')  # full=关键帧，delta=差量
+    payload = db.Column(CompressedBlob, nullable=True)
+    # 保存时预先计算的元数据，版本列表只读取这些列，不解压payload
+    content_size = db.Column(db.Integer, nullable=True)
+    preview = db.Column(db.String(200), nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True)  # 内容摘要，用于跳过未变化的保存
+    # 由自动保存产生的版本；只有自动保存的版本会吸收之后的连续自动保存，手动保存的内容总会保留一个版本
+    autosave = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+
+    def _legacy_data(self):
+        """迁移前未压缩的旧版数据，由有旧版数据列的版本模型覆盖；没有旧版数据时为 None"""
+        return None
+
+    def _diff(self, old, new):
+        return diff_json(old, new)
+
+    def _patch(self, old, delta):
+        return patch_json(old, delta)
+
+    def _size(self, data):
+        return len(dumps(data))
+
+    def _preview(self, data):
+        return json_preview(data)
+
+    def _chain_query(self):
+        cls = type(self)
+        return cls.query.filter(getattr(cls, self.parent_key) == getattr(self, self.parent_key))
+
+    def store(self, data):
+        """写入版本数据，自动选择保存关键帧还是差量"""
+        cls = type(self)
+        with db.session.no_autoflush:
+            chain = self._chain_query()
+            if self.id is not None:
+                chain = chain.filter(cls.id < self.id)
+            previous = chain.order_by(cls.id.desc()).first()
+            chain_length = 0
+            if previous is not None:
+                keyframe_id = chain.filter(cls.storage == 'full').with_entities(db.func.max(cls.id)).scalar()
+                chain_length = chain.filter(cls.id >= keyframe_id).count() if keyframe_id else 0
+            interval = current_app.config.get('VERSION_KEYFRAME_INTERVAL', DEFAULT_KEYFRAME_INTERVAL)
+            self.storage, self.payload = encode_version(
+                data,
+                previous.get_data() if previous is not None else None,
+                chain_length,
+                self._diff,
+                interval
+            )
+        self.content_size = self._size(data)
+        self.preview = self._preview(data)
+        self.content_hash = content_digest(data)
+        self._data_cache = data
+        return self
+
+    @classmethod
+    def record(cls, parent_id, updater_id, data, coalesce=False):
+        """记录一个新版本
+
+        与最新版本内容相同时不重复保存；coalesce=True 表示自动保存，同一用户在合并窗口内的连续自动保存
+        只保留窗口开始时的那一个版本。最新版本由手动保存产生时不合并，手动保存的内容在下一次保存时
+        一定会记录为版本。返回新建的版本，跳过时返回最新版本
+        """
+        parent_column = getattr(cls, cls.parent_key)
+        latest = cls.query.filter(parent_column == parent_id).order_by(cls.id.desc()).first()
+        if latest is not None:
+            if latest.content_hash == content_digest(data):
+                return latest
+            window = current_app.config.get('VERSION_COALESCE_MINUTES', 0)
+            if coalesce and window and latest.autosave and latest.updater_id == updater_id and latest.updated_at \
+                    and latest.updated_at >= datetime.now() - timedelta(minutes=window):
+                return latest
+
+        version = cls(updater_id=updater_id, autosave=coalesce, **{cls.parent_key: parent_id})
+        version.store(data)
+        db.session.add(version)
+        return version
+
+    @classmethod
+    def prune(cls, parent_id, now=None):
+        """按保留策略清理某个文档的历史版本，返回删除的版本数
+
+        保留最近 VERSION_KEEP_RECENT 个版本；更早的版本在 VERSION_KEEP_HOURLY_DAYS 天内每小时保留最新一个，
+        再早的每天保留最新一个。被删除版本之后的差量版本会基于新的上一版本重新编码
+        """
+        config = current_app.config
+        keep_recent = config.get('VERSION_KEEP_RECENT', 50)
+        hourly_days = config.get('VERSION_KEEP_HOURLY_DAYS', 7)
+        now = now or datetime.now()
+
+        versions = cls.query.filter(getattr(cls, cls.parent_key) == parent_id).order_by(cls.id.desc()).all()
+        if len(versions) <= keep_recent:
+            return 0
+
+        seen_buckets = set()
+        removed = set()
+        for version in versions[keep_recent:]:
+            stamp = version.updated_at or now
+            if now - stamp < timedelta(days=hourly_days):
+                bucket = stamp.strftime('%Y-%m-%d %H')
+            else:
+                bucket = stamp.strftime('%Y-%m-%d')
+            if bucket in seen_buckets:
+                removed.add(version.id)
+            else:
+                seen_buckets.add(bucket)
+        if not removed:
+            return 0
+
+        # 删除前先还原需要重新编码的差量版本
+        ascending = list(reversed(versions))
+        rebase = []
+        previous_removed = False
+        for version in ascending:
+            if version.id in removed:
+                previous_removed = True
+                continue
+            if previous_removed and version.storage == 'delta':
+                version.get_data()
+                rebase.append(version)
+            previous_removed = False
+
+        for version in ascending:
+            if version.id in removed:
+                db.session.delete(version)
+        db.session.flush()
+
+        for version in rebase:
+            version.store(version.get_data())
+        return len(removed)
+
+    def get_data(self):
+        """还原版本数据：从最近的关键帧开始依次应用差量，途经的版本一并缓存"""
+        if '_data_cache' in self.__dict__:
+            return self._data_cache
+        if self.payload is None:
+            return self._legacy_data()
+        if self.storage == 'full':
+            self._data_cache = decode_version('full', self.payload, None, self._patch)
+            return self._data_cache
+
+        cls = type(self)
+        chain = self._chain_query().filter(cls.id <= self.id)
+        keyframe_id = chain.filter(cls.storage == 'full').with_entities(db.func.max(cls.id)).scalar()
+        data = None
+        for version in chain.filter(cls.id >= (keyframe_id or 0)).order_by(cls.id.asc()).all():
+            if '_data_cache' in version.__dict__:
+                data = version._data_cache
+                continue
+            if version.payload is None:
+                data = version._legacy_data()
+            else:
+                data = decode_version(version.storage, version.payload, data, self._patch)
+            version._data_cache = data
+        return data
+
+    def to_summary_dict(self):
+        """版本列表使用的元数据，不包含版本内容"""
+        return {
+            'id': self.id,
+            'updater': {
+                'username': self.updater.username if self.updater else '未知用户'
+            },
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'size': self.content_size,
+            'content_preview': self.preview
+        }
+
+
 # -------------------------- 核心模型：用户（含管理员权限） --------------------------
 class User(db.Model, UserMixin):
     __tablename__ = 'user'
@@ -130,8 +318,18 @@ flowchart_tag = db.Table('flowchart_tag',
 
 
 # -------------------------- 笔记相关模型 --------------------------
+# 批量读取标签ID时每条查询包含的笔记数，避免 IN 列表超出数据库的参数个数限制
+TAG_BATCH_SIZE = 500
+
+
 class Note(db.Model):
     __tablename__ = 'note'
+    # 列表按用户取最近修改的文档，创建和重命名时按用户检查重名
+    __table_args__ = (
+        db.Index('ix_note_user_updated', 'user_id', 'updated_at'),
+        db.Index('ix_note_user_title', 'user_id', 'title'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=True)
@@ -158,7 +356,7 @@ class Note(db.Model):
             'is_public': self.is_public,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'tag_ids': [tag.id for tag in self.tags]
+            'tag_ids': self._tag_ids if '_tag_ids' in self.__dict__ else [tag.id for tag in self.tags]
         }
         if include_content:
             result['content'] = self.content
@@ -175,41 +373,87 @@ class Note(db.Model):
             print(f"Error converting tags to dict: {e}")
         return result
 
-    def save_version(self, updater_id):
+    @classmethod
+    def preload_tag_ids(cls, notes):
+        """批量读取笔记的标签ID供 to_dict 使用：直接查询 note_tag 关联表，不加载 Tag 对象，每批一条查询"""
+        tag_ids = {note.id: [] for note in notes}
+        note_ids = list(tag_ids)
+        for start in range(0, len(note_ids), TAG_BATCH_SIZE):
+            rows = db.session.execute(
+                db.select(note_tag.c.note_id, note_tag.c.tag_id)
+                .where(note_tag.c.note_id.in_(note_ids[start:start + TAG_BATCH_SIZE]))
+            )
+            for note_id, tag_id in rows:
+                tag_ids[note_id].append(tag_id)
+        for note in notes:
+            note._tag_ids = tag_ids[note.id]
+        return notes
+
+    def save_version(self, updater_id, coalesce=False):
         """保存笔记历史版本"""
-        version = NoteVersion(
-            note_id=self.id,
-            content=self.content or '',
-            updater_id=updater_id
-        )
-        db.session.add(version)
-        return version
+        return NoteVersion.record(self.id, updater_id, self.content or '', coalesce)
 
 
-class NoteVersion(db.Model):
+class NoteVersion(DeltaVersionMixin, db.Model):
     __tablename__ = 'note_version'
+    # 版本列表、差量链的读取都按所属文档过滤、按ID排序
+    __table_args__ = (
+        db.Index('ix_note_version_note_id', 'note_id', 'id'),
+    )
+    parent_key = 'note_id'
+
     id = db.Column(db.Integer, primary_key=True)
     note_id = db.Column(db.Integer, db.ForeignKey('note.id', ondelete='CASCADE'), nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    content = db.Column(db.Text, nullable=True)  # 旧版全文，新版本统一写入payload
     updater_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.now)
 
     updater = relationship('User', backref='version_updates')
 
+    def _legacy_data(self):
+        return self.content or ''
+
+    def _diff(self, old, new):
+        return diff_text(old, new)
+
+    def _patch(self, old, delta):
+        return patch_text(old, delta)
+
+    def _size(self, data):
+        return len((data or '').encode('utf-8'))
+
+    def _preview(self, data):
+        return text_preview(data)
+
+    def get_content(self):
+        """还原该版本的笔记全文"""
+        return self.get_data() or ''
+
     def to_dict(self):
+        content = self.get_content()
         return {
             'id': self.id,
-            'content': self.content,
+            'content': content,
             'updater': {
                 'username': self.updater.username if self.updater else '未知用户'
             },
             'updated_at': self.updated_at.isoformat(),
-            'content_preview': self.content[:150] + '...' if len(self.content) > 150 else self.content
+            'content_preview': text_preview(content)
         }
 
 
 class ShareLink(db.Model):
     __tablename__ = 'share_link'
+    # 按分享的内容查找共享链接，定时任务按过期时间清理
+    __table_args__ = (
+        db.Index('ix_share_link_note_id', 'note_id'),
+        db.Index('ix_share_link_flowchart_id', 'flowchart_id'),
+        db.Index('ix_share_link_mindmap_id', 'mindmap_id'),
+        db.Index('ix_share_link_table_document_id', 'table_document_id'),
+        db.Index('ix_share_link_whiteboard_id', 'whiteboard_id'),
+        db.Index('ix_share_link_expire_at', 'expire_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     note_id = db.Column(db.Integer, db.ForeignKey('note.id', ondelete='CASCADE'), nullable=True)
     flowchart_id = db.Column(db.Integer, db.ForeignKey('flowchart.id', ondelete='CASCADE'), nullable=True)
@@ -227,6 +471,11 @@ class ShareLink(db.Model):
 # -------------------------- 流程图相关模型 --------------------------
 class Flowchart(db.Model):
     __tablename__ = 'flowchart'
+    __table_args__ = (
+        db.Index('ix_flowchart_user_updated', 'user_id', 'updated_at'),
+        db.Index('ix_flowchart_user_title', 'user_id', 'title'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=True)
@@ -255,31 +504,33 @@ class Flowchart(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
-    def save_version(self, updater_id):
+    def save_version(self, updater_id, coalesce=False):
         """保存流程图历史版本"""
-        version = FlowchartVersion(
-            flowchart_id=self.id,
-            flow_data=self.flow_data,
-            updater_id=updater_id
-        )
-        db.session.add(version)
-        return version
+        return FlowchartVersion.record(self.id, updater_id, self.flow_data, coalesce)
 
 
-class FlowchartVersion(db.Model):
+class FlowchartVersion(DeltaVersionMixin, db.Model):
     __tablename__ = 'flowchart_version'
+    __table_args__ = (
+        db.Index('ix_flowchart_version_flowchart_id', 'flowchart_id', 'id'),
+    )
+    parent_key = 'flowchart_id'
+
     id = db.Column(db.Integer, primary_key=True)
     flowchart_id = db.Column(db.Integer, db.ForeignKey('flowchart.id', ondelete='CASCADE'), nullable=False)
-    flow_data = db.Column(db.JSON, nullable=True)
+    flow_data = db.Column(db.JSON, nullable=True)  # 旧版完整快照，新版本统一写入payload
     updater_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.now)
 
     updater = relationship('User', backref='flowchart_version_updates')
 
+    def _legacy_data(self):
+        return self.flow_data
+
     def to_dict(self):
         return {
             'id': self.id,
-            'flow_data': self.flow_data,
+            'flow_data': self.get_data(),
             'updater': {
                 'username': self.updater.username if self.updater else '未知用户'
             },
@@ -290,6 +541,11 @@ class FlowchartVersion(db.Model):
 # -------------------------- 表格相关模型（关键：类名是TableDocument） --------------------------
 class TableDocument(db.Model):
     __tablename__ = 'table_document'
+    __table_args__ = (
+        db.Index('ix_table_document_user_updated', 'user_id', 'updated_at'),
+        db.Index('ix_table_document_user_title', 'user_id', 'title'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
     columns_data = db.Column(db.JSON, nullable=True)
@@ -312,23 +568,29 @@ class TableDocument(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
-    def save_version(self, updater_id):
+    def snapshot(self):
+        """表格内容快照（列、行、单元格样式）"""
+        return {
+            'columns': self.columns_data,
+            'rows': self.rows_data,
+            'cellStyles': self.cell_styles
+        }
+
+    def save_version(self, updater_id, coalesce=False):
         """保存表格历史版本"""
-        version = TableDocumentVersion(
-            table_document_id=self.id,
-            columns_data=self.columns_data,
-            rows_data=self.rows_data,
-            cell_styles=self.cell_styles,
-            updater_id=updater_id
-        )
-        db.session.add(version)
-        return version
+        return TableDocumentVersion.record(self.id, updater_id, self.snapshot(), coalesce)
 
 
-class TableDocumentVersion(db.Model):
+class TableDocumentVersion(DeltaVersionMixin, db.Model):
     __tablename__ = 'table_document_version'
+    __table_args__ = (
+        db.Index('ix_table_document_version_table_document_id', 'table_document_id', 'id'),
+    )
+    parent_key = 'table_document_id'
+
     id = db.Column(db.Integer, primary_key=True)
     table_document_id = db.Column(db.Integer, db.ForeignKey('table_document.id', ondelete='CASCADE'), nullable=False)
+    # 旧版完整快照，新版本统一写入payload
     columns_data = db.Column(db.JSON, nullable=True)
     rows_data = db.Column(db.JSON, nullable=True)
     cell_styles = db.Column(db.JSON, nullable=True)
@@ -337,12 +599,23 @@ class TableDocumentVersion(db.Model):
 
     updater = relationship('User', backref='table_document_version_updates')
 
-    def to_dict(self):
+    def _legacy_data(self):
         return {
-            'id': self.id,
             'columns': self.columns_data,
             'rows': self.rows_data,
-            'cellStyles': self.cell_styles,
+            'cellStyles': self.cell_styles
+        }
+
+    def _preview(self, data):
+        return table_preview(data)
+
+    def to_dict(self):
+        snapshot = self.get_data()
+        return {
+            'id': self.id,
+            'columns': snapshot.get('columns'),
+            'rows': snapshot.get('rows'),
+            'cellStyles': snapshot.get('cellStyles'),
             'updater': {
                 'username': self.updater.username if self.updater else '未知用户'
             },
@@ -353,6 +626,11 @@ class TableDocumentVersion(db.Model):
 # -------------------------- 白板相关模型 --------------------------
 class Whiteboard(db.Model):
     __tablename__ = 'whiteboard'
+    __table_args__ = (
+        db.Index('ix_whiteboard_user_updated', 'user_id', 'updated_at'),
+        db.Index('ix_whiteboard_user_title', 'user_id', 'title'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
     room_key = db.Column(db.String(100), nullable=True)
@@ -373,31 +651,33 @@ class Whiteboard(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
-    def save_version(self, updater_id):
+    def save_version(self, updater_id, coalesce=False):
         """保存白板历史版本"""
-        version = WhiteboardVersion(
-            whiteboard_id=self.id,
-            data=self.data,
-            updater_id=updater_id
-        )
-        db.session.add(version)
-        return version
+        return WhiteboardVersion.record(self.id, updater_id, self.data, coalesce)
 
 
-class WhiteboardVersion(db.Model):
+class WhiteboardVersion(DeltaVersionMixin, db.Model):
     __tablename__ = 'whiteboard_version'
+    __table_args__ = (
+        db.Index('ix_whiteboard_version_whiteboard_id', 'whiteboard_id', 'id'),
+    )
+    parent_key = 'whiteboard_id'
+
     id = db.Column(db.Integer, primary_key=True)
     whiteboard_id = db.Column(db.Integer, db.ForeignKey('whiteboard.id', ondelete='CASCADE'), nullable=False)
-    data = db.Column(db.JSON, nullable=True)
+    data = db.Column(db.JSON, nullable=True)  # 旧版完整快照，新版本统一写入payload
     updater_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.now)
 
     updater = relationship('User', backref='whiteboard_version_updates')
 
+    def _legacy_data(self):
+        return self.data
+
     def to_dict(self):
         return {
             'id': self.id,
-            'data': self.data,
+            'data': self.get_data(),
             'updater': {
                 'username': self.updater.username if self.updater else '未知用户'
             } if self.updater else {'username': '未知用户'},
@@ -408,6 +688,11 @@ class WhiteboardVersion(db.Model):
 # -------------------------- 脑图相关模型 --------------------------
 class Mindmap(db.Model):
     __tablename__ = 'mindmap'
+    __table_args__ = (
+        db.Index('ix_mindmap_user_updated', 'user_id', 'updated_at'),
+        db.Index('ix_mindmap_user_title', 'user_id', 'title'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
     data = db.Column(db.JSON, nullable=True)
@@ -431,33 +716,149 @@ class Mindmap(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
-    def save_version(self, updater_id):
+    def save_version(self, updater_id, coalesce=False):
         """保存脑图历史版本"""
-        version = MindmapVersion(
-            mindmap_id=self.id,
-            data=self.data,
-            updater_id=updater_id
-        )
-        db.session.add(version)
-        return version
+        return MindmapVersion.record(self.id, updater_id, self.data, coalesce)
 
 
-class MindmapVersion(db.Model):
+class MindmapVersion(DeltaVersionMixin, db.Model):
     __tablename__ = 'mindmap_version'
+    __table_args__ = (
+        db.Index('ix_mindmap_version_mindmap_id', 'mindmap_id', 'id'),
+    )
+    parent_key = 'mindmap_id'
+
     id = db.Column(db.Integer, primary_key=True)
     mindmap_id = db.Column(db.Integer, db.ForeignKey('mindmap.id', ondelete='CASCADE'), nullable=False)
-    data = db.Column(db.JSON, nullable=True)
+    data = db.Column(db.JSON, nullable=True)  # 旧版完整快照，新版本统一写入payload
     updater_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.now)
 
     updater = relationship('User', backref='mindmap_version_updates')
 
+    def _legacy_data(self):
+        return self.data
+
     def to_dict(self):
         return {
             'id': self.id,
-            'data': self.data,
+            'data': self.get_data(),
             'updater': {
                 'username': self.updater.username if self.updater else '未知用户'
             },
             'updated_at': self.updated_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+
+# -------------------------- 全文检索模型 --------------------------
+# 检索正文可能很长，MySQL的TEXT只有64KB
+SearchText = db.Text().with_variant(mysql.LONGTEXT(), 'mysql')
+
+
+class SearchDocument(db.Model):
+    """全文检索索引：每个笔记、流程图、脑图、表格对应一行可检索文本
+
+    SQLite 上由 FTS5 虚拟表 search_fts 建立倒排索引，MySQL 上使用 ngram 分词的 FULLTEXT 索引，
+    分词、索引的建立和维护见 search.py 和 tokenizers.py
+    """
+    __tablename__ = 'search_document'
+    __table_args__ = (
+        db.UniqueConstraint('doc_type', 'doc_id', name='uq_search_document_doc'),
+        db.Index('ix_search_document_user_type', 'user_id', 'doc_type'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    doc_type = db.Column(db.String(20), nullable=False)  # note / flowchart / mindmap / table
+    doc_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    title = db.Column(db.String(255), nullable=False, default='')
+    body = db.Column(SearchText, nullable=True)
+    # 分词结果（空格分隔），全文索引建立在这两列上
+    title_tokens = db.Column(db.Text, nullable=True)
+    body_tokens = db.Column(SearchText, nullable=True)
+    token_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 文档长度，用于BM25
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+
+# -------------------------- 内容目录模型 --------------------------
+class ContentItem(db.Model):
+    """内容目录：笔记、表格、白板、脑图、流程图各对应一行
+
+    保存跨类型列表、计数和查找需要的字段，由 catalog.py 在每次写入时自动维护
+    """
+    __tablename__ = 'content_item'
+    __table_args__ = (
+        db.UniqueConstraint('content_type', 'content_id', name='uq_content_item_content'),
+        db.Index('ix_content_item_created', 'created_at', 'id'),
+        db.Index('ix_content_item_updated', 'updated_at', 'id'),
+        db.Index('ix_content_item_title', 'title', 'id'),
+        db.Index('ix_content_item_type_created', 'content_type', 'created_at', 'id'),
+        db.Index('ix_content_item_type_updated', 'content_type', 'updated_at', 'id'),
+        db.Index('ix_content_item_type_title', 'content_type', 'title', 'id'),
+        db.Index('ix_content_item_user_type', 'user_id', 'content_type', 'updated_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    content_type = db.Column(db.String(20), nullable=False)  # note / table / whiteboard / mindmap / flowchart
+    content_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    title = db.Column(db.String(255), nullable=False, default='')
+    size = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 内容序列化后的字节数
+    created_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+
+# -------------------------- 统计模型 --------------------------
+class DailyStat(db.Model):
+    """管理后台统计表：按天保存的统计值，由定时任务刷新（见 stats.py）
+
+    new_users 为当天新增用户数；total_users、total_note 等为刷新当天的总数
+    """
+    __tablename__ = 'daily_stat'
+    stat_date = db.Column(db.Date, primary_key=True)
+    metric = db.Column(db.String(30), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime, default=datetime.now)
+
+
+# -------------------------- 导出任务模型 --------------------------
+class ExportJob(db.Model):
+    """管理员异步导出任务（见 exporter.py）
+
+    任务状态保存在数据库中，多进程部署时任意进程都能查询进度和下载；
+    导出文件以随机文件名保存在 EXPORT_FOLDER，filename 为下载时使用的文件名
+    """
+    __tablename__ = 'export_job'
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending / running / finished / failed
+    format = db.Column(db.String(10), nullable=False)
+    dataset = db.Column(db.String(20), nullable=False)
+    gzip = db.Column(db.Boolean, nullable=False, default=False)
+    stored_name = db.Column(db.String(64), nullable=False)
+    filename = db.Column(db.String(100), nullable=False)
+    rows_total = db.Column(db.Integer, nullable=True)
+    rows_written = db.Column(db.Integer, nullable=False, default=0)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    size = db.Column(db.BigInteger, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'format': self.format,
+            'dataset': self.dataset,
+            'gzip': self.gzip,
+            'filename': self.filename,
+            'rows_total': self.rows_total,
+            'rows_written': self.rows_written,
+            'progress': self.progress,
+            'size': self.size,
+            'error': self.error,
+            'created_by': self.created_by,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -0,0 +1,139 @@
+"""列表接口的游标分页（keyset pagination）和筛选
+
+列表接口统一支持以下参数：
+- limit：每页条数（1~MAX_LIMIT），不传时返回全部
+- cursor：上一页响应中的 next_cursor，从该位置之后继续读取
+- count=true：同时返回符合条件的总数 total（需要额外执行一次 COUNT，只在需要时请求）
+- category_id、tag_id、type、is_public：筛选条件，只对有对应字段的内容生效，在SQL中求值
+
+按 (排序列, ID) 翻页，下一页的条件 (排序列, ID) < (游标中的值) 可以直接使用 (user_id, updated_at) 索引定位，
+不会像 OFFSET 那样越往后越慢；翻页期间有新增或修改的内容也不会重复或遗漏游标之前的行。
+"""
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import and_, func, or_, select
+
+from models import db, Note, Flowchart, note_tag, flowchart_tag
+
+MAX_LIMIT = 200
+
+PageArgs = namedtuple('PageArgs', 'limit cursor with_total')
+
+# 模型 -> (关联表, 关联表中的内容外键)
+TAG_TABLES = {
+    Note: (note_tag, note_tag.c.note_id),
+    Flowchart: (flowchart_tag, flowchart_tag.c.flowchart_id),
+}
+
+
+class PageError(ValueError):
+    """分页或筛选参数不正确"""
+
+
+def _int_arg(args, name):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise PageError(f'参数 {name} 必须是整数')
+
+
+def parse_page_args(args):
+    """解析 limit、cursor、count 参数"""
+    limit = _int_arg(args, 'limit')
+    if limit is not None and not 1 <= limit <= MAX_LIMIT:
+        raise PageError(f'参数 limit 必须在 1~{MAX_LIMIT} 之间')
+    cursor = args.get('cursor') or None
+    if cursor is not None:
+        cursor = decode_cursor(cursor)
+    with_total = args.get('count', '').lower() in ('1', 'true')
+    return PageArgs(limit, cursor, with_total)
+
+
+def list_filters(model, args):
+    """根据请求参数生成模型支持的筛选条件"""
+    filters = []
+    category_id = _int_arg(args, 'category_id')
+    if category_id is not None and hasattr(model, 'category_id'):
+        filters.append(model.category_id == category_id)
+    tag_id = _int_arg(args, 'tag_id')
+    if tag_id is not None and model in TAG_TABLES:
+        table, content_column = TAG_TABLES[model]
+        filters.append(model.id.in_(select(content_column).where(table.c.tag_id == tag_id)))
+    content_type = args.get('type')
+    if content_type and hasattr(model, 'type'):
+        filters.append(model.type == content_type)
+    is_public = args.get('is_public', '').lower()
+    if is_public and hasattr(model, 'is_public'):
+        if is_public not in ('1', 'true', '0', 'false'):
+            raise PageError('参数 is_public 必须是 true 或 false')
+        filters.append(model.is_public.is_(is_public in ('1', 'true')))
+    return filters
+
+
+# -------------------------- 游标 --------------------------
+def encode_cursor(sort_value, row_id):
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, row_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标，返回 (排序列的值, ID)；格式不正确时抛出 PageError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw.decode('utf-8'))
+        if not isinstance(row_id, int):
+            raise ValueError
+        if sort_value is not None:
+            sort_value = datetime.fromisoformat(sort_value)
+    except (ValueError, TypeError):
+        raise PageError('参数 cursor 不正确')
+    return sort_value, row_id
+
+
+def _after_cursor(sort_column, id_column, cursor, descending):
+    """游标之后的行；SQLite 和 MySQL 中 NULL 最小，倒序时排在最后、正序时排在最前"""
+    sort_value, row_id = cursor
+    if descending:
+        if sort_value is None:
+            return and_(sort_column.is_(None), id_column < row_id)
+        return or_(sort_column < sort_value, and_(sort_column == sort_value, id_column < row_id),
+                   sort_column.is_(None))
+    if sort_value is None:
+        return or_(and_(sort_column.is_(None), id_column > row_id), sort_column.isnot(None))
+    return or_(sort_column > sort_value, and_(sort_column == sort_value, id_column > row_id))
+
+
+def paginate(statement, sort_column, id_column, page, descending=True):
+    """按 (sort_column, id_column) 对 select 语句分页，返回 (本页的行, next_cursor, total)
+
+    返回的每一行在原有的列之后附加了排序列和ID（_sort、_id），调用方生成结果时忽略这两列；
+    未指定 limit 时返回全部行，next_cursor 为 None；未请求总数时 total 为 None
+    """
+    total = None
+    if page.with_total:
+        total = db.session.execute(select(func.count()).select_from(statement.order_by(None).subquery())).scalar()
+
+    if page.cursor is not None:
+        statement = statement.where(_after_cursor(sort_column, id_column, page.cursor, descending))
+    if descending:
+        statement = statement.order_by(None).order_by(sort_column.desc(), id_column.desc())
+    else:
+        statement = statement.order_by(None).order_by(sort_column.asc(), id_column.asc())
+    statement = statement.add_columns(sort_column.label('_sort'), id_column.label('_id'))
+    if page.limit is not None:
+        statement = statement.limit(page.limit + 1)
+
+    rows = db.session.execute(statement).all()
+    next_cursor = None
+    if page.limit is not None and len(rows) > page.limit:
+        rows = rows[:page.limit]
+        next_cursor = encode_cursor(rows[-1]._sort, rows[-1]._id)
+    return rows, next_cursor, total
@@ -0,0 +1,137 @@
+"""Socket.IO 协作消息的二进制编码
+
+大文档的完整状态和补取的操作以 JSON 文本发送时，编码、解码和转义占用了 Socket.IO 进程的大部分CPU。
+客户端在连接时通过 auth 中的 encodings 声明支持的编码，服务端取双方都支持的：
+
+- msgpack：消息体用 MessagePack 编码（服务端需安装msgpack）
+- deflate：消息体超过 threshold 字节时用 zlib 压缩
+
+编码后的消息是一段二进制数据（作为 Socket.IO 的二进制附件发送），第一个字节是标志位，其后是消息体；
+未协商编码的客户端、以及不值得编码的小消息仍然发送普通的 JSON 对象。
+document_state、document_operations 按接收者编码；sync_document、get_document_state 接受两种格式，
+客户端编码的消息放在 payload 字段中，room_id、doc_id、doc_type 留在外层，服务端先检查权限再解码。
+解码后的消息体不能超过 max_decoded_bytes，防止很小的压缩数据解压出占满内存的内容。
+"""
+import json
+import logging
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# 标志位
+MSGPACK = 0x01
+DEFLATE = 0x02
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+
+class PayloadCodec:
+    """记录每个连接协商的编码，按连接编码和解码消息"""
+
+    def __init__(self, threshold=4096, level=6, max_decoded_bytes=16 * 1024 * 1024):
+        self.threshold = threshold
+        self.level = level
+        self.max_decoded_bytes = max_decoded_bytes
+        self._msgpack = _msgpack()
+        self._clients = {}  # sid -> 标志位
+        self._lock = threading.Lock()
+
+    def supported(self):
+        encodings = ['deflate']
+        if self._msgpack is not None:
+            encodings.insert(0, 'msgpack')
+        return encodings
+
+    def negotiate(self, sid, offered):
+        """根据客户端声明的编码确定该连接使用的编码，返回协商结果"""
+        offered = offered if isinstance(offered, (list, tuple)) else []
+        flags = 0
+        if 'msgpack' in offered and self._msgpack is not None:
+            flags |= MSGPACK
+        if 'deflate' in offered:
+            flags |= DEFLATE
+        if flags:
+            with self._lock:
+                self._clients[sid] = flags
+        return {'msgpack': bool(flags & MSGPACK), 'deflate': bool(flags & DEFLATE), 'threshold': self.threshold}
+
+    def forget(self, sid):
+        with self._lock:
+            self._clients.pop(sid, None)
+
+    def encode(self, sid, payload):
+        """按连接协商的编码编码消息；未协商或不需要编码时原样返回"""
+        flags = self._clients.get(sid, 0)
+        if not flags:
+            return payload
+        try:
+            if flags & MSGPACK:
+                body = self._msgpack.packb(payload, use_bin_type=True)
+            else:
+                body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        except (TypeError, ValueError) as e:
+            # 无法编码的内容（例如不成对的代理字符）按普通 JSON 发送
+            logger.debug(f"消息编码失败，按JSON发送: {str(e)}")
+            return payload
+
+        header = flags & MSGPACK
+        if flags & DEFLATE and len(body) >= self.threshold:
+            body = zlib.compress(body, self.level)
+            header |= DEFLATE
+        elif not header:
+            # JSON 消息不压缩时编码没有收益
+            return payload
+        return bytes([header]) + body
+
+    def decode(self, data):
+        """解码客户端发来的消息：payload 字段中的编码消息体解码后与外层字段合并（外层字段优先），
+        没有 payload 的普通 JSON 对象原样返回；格式不正确或解码后过大时抛出 ValueError"""
+        if not isinstance(data, dict):
+            raise ValueError('消息格式不正确')
+        body = data.get('payload')
+        if body is None:
+            return data
+        if not isinstance(body, (bytes, bytearray)):
+            raise ValueError('消息格式不正确')
+        fields = {key: value for key, value in data.items() if key != 'payload'}
+        return {**self.decode_frame(body), **fields}
+
+    def decode_frame(self, data):
+        """解码一段编码后的二进制消息（encode 的输出），不是二进制时原样返回"""
+        if not isinstance(data, (bytes, bytearray)):
+            return data
+        data = bytes(data)
+        if not data:
+            raise ValueError('消息为空')
+        header, body = data[0], data[1:]
+        if len(body) > self.max_decoded_bytes:
+            raise ValueError('消息过大')
+        try:
+            if header & DEFLATE:
+                decompressor = zlib.decompressobj()
+                body = decompressor.decompress(body, self.max_decoded_bytes)
+                # 达到上限时剩余的压缩数据留在 unconsumed_tail 中，不再继续解压
+                if decompressor.unconsumed_tail:
+                    raise ValueError('消息过大')
+                if not decompressor.eof:
+                    raise ValueError('消息格式不正确: 压缩数据不完整')
+            if header & MSGPACK:
+                if self._msgpack is None:
+                    raise ValueError('服务端不支持msgpack编码')
+                payload = self._msgpack.unpackb(body, raw=False)
+            else:
+                payload = json.loads(body.decode('utf-8'))
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f'消息格式不正确: {str(e)}')
+        if not isinstance(payload, dict):
+            raise ValueError('消息格式不正确')
+        return payload
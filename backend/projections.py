@@ -0,0 +1,115 @@
+"""列表接口的轻量投影
+
+流程图、表格、白板、脑图的列表只按列查询摘要字段（ID、标题、时间、大小等），
+不读取 flow_data、thumbnail、rows_data、data 等大列，完整内容通过详情接口获取。
+列表接口支持 ?fields=id,title,... 只返回指定的字段，可选的字段见 LIST_FIELDS，未指定时返回 DEFAULT_FIELDS；
+size 为内容序列化后的字节数，取自内容目录（content_item）。分页和筛选参数见 pagination.py。
+"""
+from datetime import datetime
+
+from sqlalchemy import and_, case, func, select
+
+from models import db, Flowchart, TableDocument, Whiteboard, Mindmap, ContentItem
+from pagination import PageArgs, paginate
+
+
+class FieldError(ValueError):
+    """请求了不支持的字段"""
+
+
+def json_array_length(column):
+    """JSON 数组的元素个数，为空或不是数组时为 0"""
+    if db.engine.dialect.name == 'mysql':
+        return case((func.json_type(column) == 'ARRAY', func.json_length(column)), else_=0)
+    return func.coalesce(func.json_array_length(column), 0)
+
+
+# 内容类型 -> (模型, 内容目录中的类型)
+LIST_MODELS = {
+    'flowchart': (Flowchart, 'flowchart'),
+    'table': (TableDocument, 'table'),
+    'whiteboard': (Whiteboard, 'whiteboard'),
+    'mindmap': (Mindmap, 'mindmap'),
+}
+
+# 内容类型 -> {字段名: 生成列表达式的函数}；字段名与 to_dict 的键一致
+LIST_FIELDS = {
+    'flowchart': {
+        'id': lambda: Flowchart.id,
+        'title': lambda: Flowchart.title,
+        'description': lambda: Flowchart.description,
+        'thumbnail': lambda: Flowchart.thumbnail,
+        'share_token': lambda: Flowchart.share_token,
+        'is_public': lambda: Flowchart.is_public,
+        'user_id': lambda: Flowchart.user_id,
+        'created_at': lambda: Flowchart.created_at,
+        'updated_at': lambda: Flowchart.updated_at,
+    },
+    'table': {
+        'id': lambda: TableDocument.id,
+        'title': lambda: TableDocument.title,
+        'row_count': lambda: json_array_length(TableDocument.rows_data),
+        'column_count': lambda: json_array_length(TableDocument.columns_data),
+        'user_id': lambda: TableDocument.user_id,
+        'created_at': lambda: TableDocument.created_at,
+        'updated_at': lambda: TableDocument.updated_at,
+    },
+    'whiteboard': {
+        'id': lambda: Whiteboard.id,
+        'title': lambda: Whiteboard.title,
+        'room_key': lambda: Whiteboard.room_key,
+        'user_id': lambda: Whiteboard.user_id,
+        'created_at': lambda: Whiteboard.created_at,
+        'updated_at': lambda: Whiteboard.updated_at,
+    },
+    'mindmap': {
+        'id': lambda: Mindmap.id,
+        'title': lambda: Mindmap.title,
+        'share_token': lambda: Mindmap.share_token,
+        'is_public': lambda: Mindmap.is_public,
+        'user_id': lambda: Mindmap.user_id,
+        'created_at': lambda: Mindmap.created_at,
+        'updated_at': lambda: Mindmap.updated_at,
+    },
+}
+
+# 未指定 fields 时返回的字段：流程图缩略图（base64图片）只在明确请求时返回
+DEFAULT_FIELDS = {
+    content_type: [name for name in fields if name != 'thumbnail'] + ['size']
+    for content_type, fields in LIST_FIELDS.items()
+}
+
+
+def parse_fields(content_type, value):
+    """解析 ?fields= 参数，未指定时返回默认字段；包含不支持的字段时抛出 FieldError"""
+    if not value:
+        return DEFAULT_FIELDS[content_type]
+    fields = list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in fields if name != 'size' and name not in LIST_FIELDS[content_type]]
+    if unknown:
+        raise FieldError(f"不支持的字段: {', '.join(unknown)}")
+    return fields or DEFAULT_FIELDS[content_type]
+
+
+def list_summaries(content_type, user_id, fields, filters=(), page=None):
+    """按列查询用户的内容列表（最近修改的在前），每行只包含 fields 中的字段
+
+    按 page 分页（见 pagination.py），返回 (本页的内容, next_cursor, total)
+    """
+    model, catalog_type = LIST_MODELS[content_type]
+    columns = [
+        func.coalesce(ContentItem.size, 0).label(name) if name == 'size' else LIST_FIELDS[content_type][name]().label(name)
+        for name in fields
+    ]
+    query = select(*columns).select_from(model)
+    if 'size' in fields:
+        query = query.outerjoin(ContentItem, and_(ContentItem.content_type == catalog_type,
+                                                  ContentItem.content_id == model.id))
+    query = query.where(model.user_id == user_id, *filters)
+    rows, next_cursor, total = paginate(query, model.updated_at, model.id, page or PageArgs(None, None, False))
+    items = [
+        {name: value.isoformat() if isinstance(value, datetime) else value
+         for name, value in zip(fields, row)}
+        for row in rows
+    ]
+    return items, next_cursor, total
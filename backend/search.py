@@ -0,0 +1,508 @@
+"""全文检索：笔记、流程图、脑图、表格的增量倒排索引
+
+每个文档在 search_document 表中对应一行（标题 + 提取出的可检索正文 + 分词结果），
+ORM 刷新时自动同步新增、修改和删除，接口和协作保存都不需要手工维护索引。
+分词由 tokenizers.py 中可替换的分词器完成，倒排索引由数据库负责：
+SQLite 使用 FTS5 外部内容表并按 bm25() 排序，MySQL 使用 ngram 分词的 FULLTEXT 索引取候选再按 BM25 重新排序，
+其他数据库或全文索引不可用时退化为 LIKE 查询。检索结果只包含当前用户自己的文档。
+"""
+import html
+import json
+import logging
+import math
+import re
+from collections import Counter
+from datetime import datetime
+
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy import event, inspect, or_
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.orm import Session
+
+from models import db, Note, Flowchart, Mindmap, TableDocument, SearchDocument
+from tokenizers import get_tokenizer
+
+logger = logging.getLogger(__name__)
+
+# 检索结果摘要长度
+SNIPPET_LENGTH = 120
+
+# 单次检索最多使用的关键词个数
+MAX_TERMS = 8
+
+# 重建索引时每批读取的文档数
+REBUILD_BATCH_SIZE = 500
+
+# 标题命中的权重（相当于正文中出现的次数）
+TITLE_WEIGHT = 5.0
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# MySQL 上按 FULLTEXT 相关度取出、再用 BM25 重新排序的候选文档数；
+# 排在候选之后的结果按 FULLTEXT 相关度在数据库中分页
+CANDIDATE_LIMIT = 200
+
+# 摘要中最多标出的命中位置数
+MAX_HIGHLIGHTS = 50
+
+# 索引能命中的最短检索词：MySQL ngram 默认按2个字符切分
+MIN_TOKEN_LENGTH = {'sqlite': 1, 'mysql': 2}
+
+# 索引列保存分词结果（空格分隔），由 tokenizers.py 中配置的分词器生成，
+# 原始标题和正文只用于展示摘要和 LIKE 匹配
+
+# 全文索引的对象由下面的 DDL 建立，不在 db.metadata 中，自动生成迁移时需要跳过（见 migrations/env.py）
+FULLTEXT_TABLE_PREFIX = 'search_fts'
+MYSQL_FULLTEXT_INDEX = 'ft_search_document_tokens'
+
+# SQLite：外部内容 FTS5 表，分词结果只在 search_document 中保存一份，触发器负责同步倒排索引
+SQLITE_FULLTEXT_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+    "title_tokens, body_tokens, content='search_document', content_rowid='id', tokenize='unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS search_document_ai AFTER INSERT ON search_document BEGIN "
+    "INSERT INTO search_fts(rowid, title_tokens, body_tokens) VALUES (new.id, new.title_tokens, new.body_tokens); END",
+    "CREATE TRIGGER IF NOT EXISTS search_document_ad AFTER DELETE ON search_document BEGIN "
+    "INSERT INTO search_fts(search_fts, rowid, title_tokens, body_tokens) "
+    "VALUES ('delete', old.id, old.title_tokens, old.body_tokens); END",
+    "CREATE TRIGGER IF NOT EXISTS search_document_au AFTER UPDATE ON search_document BEGIN "
+    "INSERT INTO search_fts(search_fts, rowid, title_tokens, body_tokens) "
+    "VALUES ('delete', old.id, old.title_tokens, old.body_tokens); "
+    "INSERT INTO search_fts(rowid, title_tokens, body_tokens) VALUES (new.id, new.title_tokens, new.body_tokens); END",
+)
+
+# MySQL：InnoDB FULLTEXT 索引，ngram 分词不受 innodb_ft_min_token_size 限制，两个字的词也能命中
+MYSQL_FULLTEXT_DDL = (
+    f"ALTER TABLE search_document ADD FULLTEXT INDEX {MYSQL_FULLTEXT_INDEX} (title_tokens, body_tokens) WITH PARSER ngram",
+)
+
+
+def is_fulltext_object(name, type_):
+    """是否为全文索引的数据库对象：FTS5 虚拟表及其影子表（search_fts_data 等）、MySQL 的 FULLTEXT 索引"""
+    if type_ == 'table':
+        return bool(name) and name.startswith(FULLTEXT_TABLE_PREFIX)
+    if type_ == 'index':
+        return name == MYSQL_FULLTEXT_INDEX
+    return False
+
+
+_BLOCK_TAG_PATTERN = re.compile(r'<(?:br|/?(?:p|div|li|h[1-6]|tr|td|th|blockquote|pre))\b[^>]*>', re.IGNORECASE)
+_TAG_PATTERN = re.compile(r'<[^>]+>')
+_SPACE_PATTERN = re.compile(r'\s+')
+
+# 流程图、脑图节点中保存显示文字的字段
+_LABEL_KEYS = ('text', 'label', 'topic', 'title', 'name')
+
+
+# -------------------------- 正文提取 --------------------------
+def _clean(text):
+    return _SPACE_PATTERN.sub(' ', text).strip()
+
+
+def note_text(content):
+    """笔记正文：兼容 Quill Delta JSON、富文本HTML和纯文本/Markdown"""
+    if not content:
+        return ''
+    if content.lstrip().startswith('{'):
+        try:
+            delta = json.loads(content)
+        except ValueError:
+            delta = None
+        if isinstance(delta, dict) and isinstance(delta.get('ops'), list):
+            return _clean(''.join(
+                op['insert'] for op in delta['ops']
+                if isinstance(op, dict) and isinstance(op.get('insert'), str)
+            ))
+    # 块级标签换成空格，行内标签直接去掉，避免把一个词拆开
+    content = _TAG_PATTERN.sub('', _BLOCK_TAG_PATTERN.sub(' ', content))
+    return _clean(html.unescape(content))
+
+
+def _collect_labels(data, parts):
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key in _LABEL_KEYS and isinstance(value, str):
+                parts.append(value)
+            elif key in _LABEL_KEYS and isinstance(value, dict) and isinstance(value.get('value'), str):
+                # LogicFlow 的节点文字形如 {"x": 100, "y": 100, "value": "开始"}
+                parts.append(value['value'])
+            elif isinstance(value, (dict, list)):
+                _collect_labels(value, parts)
+    elif isinstance(data, list):
+        for item in data:
+            _collect_labels(item, parts)
+
+
+def node_text(data):
+    """流程图/脑图正文：所有节点（和连线）上显示的文字"""
+    parts = []
+    _collect_labels(data, parts)
+    return _clean(' '.join(parts))
+
+
+def _collect_cells(data, parts):
+    if isinstance(data, dict):
+        for value in data.values():
+            _collect_cells(value, parts)
+    elif isinstance(data, list):
+        for value in data:
+            _collect_cells(value, parts)
+    elif isinstance(data, (str, int, float)) and not isinstance(data, bool):
+        value = str(data).strip()
+        if value:
+            parts.append(value)
+
+
+def table_text(columns, rows):
+    """表格正文：列标题和所有单元格的值"""
+    parts = []
+    _collect_labels(columns, parts)
+    for column in columns or []:
+        if isinstance(column, str):
+            parts.append(column)
+    _collect_cells(rows, parts)
+    return _clean(' '.join(parts))
+
+
+# 文档类型 -> (模型, 影响检索内容的字段, 正文提取函数)
+INDEXED_MODELS = {
+    'note': (Note, ('title', 'content'), lambda note: note_text(note.content)),
+    'flowchart': (
+        Flowchart, ('title', 'description', 'flow_data'),
+        lambda flowchart: _clean(f'{flowchart.description or ""} {node_text(flowchart.flow_data)}')
+    ),
+    'mindmap': (Mindmap, ('title', 'data'), lambda mindmap: node_text(mindmap.data)),
+    'table': (
+        TableDocument, ('title', 'columns_data', 'rows_data'),
+        lambda table: table_text(table.columns_data, table.rows_data)
+    ),
+}
+
+_DOC_TYPES = {model: doc_type for doc_type, (model, _, _) in INDEXED_MODELS.items()}
+
+
+def current_tokenizer():
+    """配置项 SEARCH_TOKENIZER 指定的分词器"""
+    return get_tokenizer(current_app.config.get('SEARCH_TOKENIZER', 'bigram'))
+
+
+def document_values(doc_type, obj, tokenizer=None):
+    """生成文档对应的索引行"""
+    tokenizer = tokenizer or current_tokenizer()
+    extract = INDEXED_MODELS[doc_type][2]
+    title = obj.title or ''
+    body = extract(obj)
+    title_tokens = tokenizer.tokenize(title)
+    body_tokens = tokenizer.tokenize(body)
+    return {
+        'doc_type': doc_type,
+        'doc_id': obj.id,
+        'user_id': obj.user_id,
+        'title': title,
+        'body': body,
+        'title_tokens': ' '.join(title_tokens),
+        'body_tokens': ' '.join(body_tokens),
+        'token_count': len(title_tokens) + len(body_tokens),
+        'updated_at': obj.updated_at or datetime.now()
+    }
+
+
+# -------------------------- 增量维护 --------------------------
+def _upsert(connection, values):
+    table = SearchDocument.__table__
+    result = connection.execute(
+        table.update()
+        .where(table.c.doc_type == values['doc_type'], table.c.doc_id == values['doc_id'])
+        .values(**values)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(**values))
+
+
+def _content_changed(obj, fields):
+    state = inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+@event.listens_for(Session, 'after_flush')
+def sync_search_index(session, flush_context):
+    """每次刷新后同步被新增、修改、删除的文档的索引行，与业务数据在同一事务中提交"""
+    changed = []
+    for obj in session.new:
+        doc_type = _DOC_TYPES.get(type(obj))
+        if doc_type:
+            changed.append((doc_type, obj))
+    for obj in session.dirty:
+        doc_type = _DOC_TYPES.get(type(obj))
+        if doc_type and _content_changed(obj, INDEXED_MODELS[doc_type][1]):
+            changed.append((doc_type, obj))
+    removed = [(_DOC_TYPES[type(obj)], obj.id) for obj in session.deleted if type(obj) in _DOC_TYPES]
+    if not changed and not removed:
+        return
+
+    connection = session.connection()
+    table = SearchDocument.__table__
+    for doc_type, obj in changed:
+        _upsert(connection, document_values(doc_type, obj))
+    for doc_type, doc_id in removed:
+        connection.execute(table.delete().where(table.c.doc_type == doc_type, table.c.doc_id == doc_id))
+
+
+def install_fulltext(connection):
+    """为 search_document 建立数据库原生的全文索引"""
+    statements = {'sqlite': SQLITE_FULLTEXT_DDL, 'mysql': MYSQL_FULLTEXT_DDL}.get(connection.dialect.name, ())
+    for statement in statements:
+        connection.exec_driver_sql(statement)
+
+
+@event.listens_for(SearchDocument.__table__, 'after_create')
+def _create_fulltext(target, connection, **kw):
+    install_fulltext(connection)
+
+
+@event.listens_for(SearchDocument.__table__, 'before_drop')
+def _drop_fulltext(target, connection, **kw):
+    # 触发器和 MySQL 的 FULLTEXT 索引随表一起删除，FTS5 虚拟表需要单独删除
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql('DROP TABLE IF EXISTS search_fts')
+
+
+def rebuild_index(doc_types=None):
+    """重建检索索引，返回 {文档类型: 写入的文档数}
+
+    用于升级后首次建立索引、更换分词器，或索引与数据不一致时修复；
+    每批单独提交，大库重建时不会长时间占用一个事务
+    """
+    table = SearchDocument.__table__
+    tokenizer = current_tokenizer()
+    counts = {}
+    for doc_type in doc_types or INDEXED_MODELS:
+        model = INDEXED_MODELS[doc_type][0]
+        db.session.execute(table.delete().where(table.c.doc_type == doc_type))
+        db.session.commit()
+        counts[doc_type] = 0
+        # 按主键分批读取，避免一次把所有文档加载进内存
+        last_id = 0
+        while True:
+            batch = model.query.filter(model.id > last_id).order_by(model.id).limit(REBUILD_BATCH_SIZE).all()
+            if not batch:
+                break
+            db.session.execute(table.insert(), [document_values(doc_type, obj, tokenizer) for obj in batch])
+            db.session.commit()
+            counts[doc_type] += len(batch)
+            last_id = batch[-1].id
+    return counts
+
+
+# -------------------------- 检索 --------------------------
+def split_terms(keyword):
+    """按空白切分关键词，多个关键词之间是“且”的关系"""
+    return [term for term in _SPACE_PATTERN.split((keyword or '').strip()) if term][:MAX_TERMS]
+
+
+def escape_like(term):
+    """转义 LIKE 通配符，配合 escape='\\' 使用"""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _like(table, term):
+    pattern = f'%{escape_like(term)}%'
+    return or_(table.c.title.like(pattern, escape='\\'), table.c.body.like(pattern, escape='\\'))
+
+
+def _quote(token):
+    return '"{}"'.format(token.replace('"', '""'))
+
+
+def _fts5_match(indexed, phrase):
+    # 每个检索词一个短语（或一组“且”的词），以英文单词结尾时按前缀匹配，输入 "data" 也能找到 "database"
+    parts = []
+    for _, tokens in indexed:
+        if phrase:
+            prefix = '*' if tokens[-1].isascii() and tokens[-1].isalnum() else ''
+            parts.append(_quote(' '.join(tokens)) + prefix)
+        else:
+            parts.extend(_quote(token) for token in tokens)
+    return ' '.join(parts)
+
+
+def _mysql_match(indexed, phrase):
+    parts = []
+    for _, tokens in indexed:
+        if phrase:
+            parts.append('+' + _quote(' '.join(tokens)))
+        else:
+            parts.extend('+' + _quote(token) for token in tokens)
+    return ' '.join(parts)
+
+
+_MYSQL_SCORE = 'MATCH (search_document.title_tokens, search_document.body_tokens) AGAINST (:match IN BOOLEAN MODE)'
+
+
+def _bm25_rerank(rows, user_id, query_tokens):
+    """按 BM25 重新排序 MySQL 取出的候选文档，文档总数、平均长度和文档频率都按当前用户统计"""
+    if not rows:
+        return rows
+    table = SearchDocument.__table__
+    total, average_length = db.session.execute(
+        sa.select(sa.func.count(table.c.id), sa.func.avg(table.c.token_count)).where(table.c.user_id == user_id)
+    ).one()
+    average_length = float(average_length or 1) or 1.0
+    idf = {}
+    for token in set(query_tokens):
+        frequency = db.session.execute(
+            sa.select(sa.func.count(table.c.id))
+            .where(table.c.user_id == user_id, sa.text(_MYSQL_SCORE).bindparams(match=_quote(token)))
+        ).scalar()
+        idf[token] = math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+
+    def score(row):
+        title_counts = Counter((row.title_tokens or '').split())
+        body_counts = Counter((row.body_tokens or '').split())
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * (row.token_count or 0) / average_length)
+        result = 0.0
+        for token, weight in idf.items():
+            frequency = TITLE_WEIGHT * title_counts[token] + body_counts[token]
+            if frequency:
+                result += weight * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return result
+
+    return sorted(rows, key=score, reverse=True)
+
+
+def _fetch(dialect, user_id, indexed, fallback, phrase, doc_type, limit, offset):
+    table = SearchDocument.__table__
+    query = sa.select(
+        table.c.id, table.c.doc_type, table.c.doc_id, table.c.title, table.c.body, table.c.updated_at
+    ).where(table.c.user_id == user_id)
+    if doc_type:
+        query = query.where(table.c.doc_type == doc_type)
+
+    if dialect not in MIN_TOKEN_LENGTH:
+        indexed, fallback = [], fallback + [term for term, _ in indexed]
+    for term in fallback:
+        query = query.where(_like(table, term))
+    if not indexed:
+        return db.session.execute(query.order_by(table.c.updated_at.desc()).limit(limit + 1).offset(offset)).fetchall()
+
+    if dialect == 'sqlite':
+        fts = sa.table('search_fts', sa.column('rowid'))
+        query = (
+            query.select_from(table.join(fts, fts.c.rowid == table.c.id))
+            .where(sa.text('search_fts MATCH :match').bindparams(match=_fts5_match(indexed, phrase)))
+            .order_by(sa.text(f'bm25(search_fts, {TITLE_WEIGHT}, 1.0)'))
+        )
+        return db.session.execute(query.limit(limit + 1).offset(offset)).fetchall()
+
+    # MySQL：按 FULLTEXT 相关度排序，前 CANDIDATE_LIMIT 个候选再按 BM25 重新排序；
+    # 候选之后的结果顺序不变，分页的偏移量直接交给数据库，结果集不受候选数限制
+    score = sa.text(_MYSQL_SCORE).bindparams(match=_mysql_match(indexed, phrase))
+    query = query.add_columns(table.c.title_tokens, table.c.body_tokens, table.c.token_count).where(score)
+    query = query.order_by(sa.text(f'{_MYSQL_SCORE} DESC').bindparams(match=_mysql_match(indexed, phrase)),
+                           table.c.id)
+    rows = []
+    if offset < CANDIDATE_LIMIT:
+        candidates = db.session.execute(query.limit(CANDIDATE_LIMIT)).fetchall()
+        ranked = _bm25_rerank(candidates, user_id, [token for _, tokens in indexed for token in tokens])
+        rows = ranked[offset:offset + limit + 1]
+        if len(candidates) < CANDIDATE_LIMIT:
+            return rows
+    start = max(offset, CANDIDATE_LIMIT)
+    remaining = limit + 1 - len(rows)
+    if remaining > 0:
+        rows += db.session.execute(query.offset(start).limit(remaining)).fetchall()
+    return rows
+
+
+def highlight(text, needles, length=None):
+    """标出命中的检索词，返回 (纯文本, HTML)
+
+    HTML 中命中部分用 <mark> 包裹，其余内容已转义；指定 length 时截取命中最密集的一段作为摘要
+    """
+    text = text or ''
+    lowered = text.lower()
+    spans = []
+    for needle in {needle.lower() for needle in needles if needle}:
+        start = lowered.find(needle)
+        while start >= 0 and len(spans) < MAX_HIGHLIGHTS:
+            spans.append((start, start + len(needle)))
+            start = lowered.find(needle, start + len(needle))
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    begin, finish = 0, len(text)
+    if length is not None and len(text) > length:
+        # 以每个命中位置前留出 1/4 长度作为候选起点，选包含命中最多的窗口
+        best = -1
+        for span_start, _ in merged or [(0, 0)]:
+            candidate = max(min(span_start - length // 4, len(text) - length), 0)
+            hits = sum(1 for start, end in merged if start >= candidate and end <= candidate + length)
+            if hits > best:
+                best, begin = hits, candidate
+        finish = begin + length
+
+    marked = []
+    position = begin
+    for start, end in merged:
+        start, end = max(start, begin), min(end, finish)
+        if start >= end:
+            continue
+        marked.append(html.escape(text[position:start]))
+        marked.append(f'<mark>{html.escape(text[start:end])}</mark>')
+        position = end
+    marked.append(html.escape(text[position:finish]))
+
+    prefix = '...' if begin > 0 else ''
+    suffix = '...' if finish < len(text) else ''
+    return prefix + text[begin:finish] + suffix, prefix + ''.join(marked) + suffix
+
+
+def search_documents(user_id, keyword, doc_type=None, limit=20, offset=0):
+    """检索当前用户的文档，返回 (结果列表, 是否还有更多)"""
+    terms = split_terms(keyword)
+    if not terms:
+        return [], False
+
+    tokenizer = current_tokenizer()
+    dialect = db.session.get_bind().dialect.name
+    min_length = max(tokenizer.min_token_length, MIN_TOKEN_LENGTH.get(dialect, 1))
+
+    # 能被索引命中的检索词走全文索引，其余（例如单个汉字）改用子串匹配
+    indexed, fallback, needles = [], [], []
+    for term in terms:
+        tokens = tokenizer.query_tokens(term)
+        if tokens and all(len(token) >= min_length for token in tokens):
+            indexed.append((term, tokens))
+            if not tokenizer.phrase:
+                needles.extend(tokens)
+        else:
+            fallback.append(term)
+        needles.append(term)
+
+    try:
+        rows = _fetch(dialect, user_id, indexed, fallback, tokenizer.phrase, doc_type, limit, offset)
+    except (OperationalError, ProgrammingError):
+        # 数据库尚未建立全文索引（例如 SQLite 缺少 FTS5 扩展）时退化为 LIKE 查询
+        logger.warning('全文索引不可用，改用LIKE检索', exc_info=True)
+        db.session.rollback()
+        rows = _fetch(None, user_id, indexed, fallback, tokenizer.phrase, doc_type, limit, offset)
+
+    results = []
+    for row in rows[:limit]:
+        snippet, snippet_html = highlight(row.body, needles, SNIPPET_LENGTH)
+        results.append({
+            'type': row.doc_type,
+            'id': row.doc_id,
+            'title': row.title,
+            'title_highlight': highlight(row.title, needles)[1],
+            'snippet': snippet,
+            'highlight': snippet_html,
+            'updated_at': row.updated_at.isoformat() if row.updated_at else None
+        })
+    return results, len(rows) > limit
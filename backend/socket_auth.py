@@ -0,0 +1,130 @@
+"""Socket.IO 连接认证和协作房间授权
+
+连接时校验 auth 中的 JWT（token），通过后该连接绑定到对应用户；携带了无效或过期 JWT 的连接被拒绝。
+未携带 JWT 的连接作为访客，只能凭分享链接的 token 加入对应的协作房间。
+用户信息以服务端的认证结果为准，客户端传来的 user_info 只用作访客的显示名称。
+
+房间授权（房间ID -> 分享的内容、所有者、权限、过期时间）来自 ShareLink，缓存 ttl 秒，
+加入房间、心跳重新加入时不再每次查询数据库。分享链接被删除、关闭协作或修改权限时调用 invalidate，
+当前进程立即失效，其他进程的缓存最迟 ttl 秒后失效。
+"""
+import hmac
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from flask_jwt_extended import decode_token
+from flask_socketio import ConnectionRefusedError
+
+from models import User
+from stats import TTLCache
+
+# 协作房间的授权信息
+RoomGrant = namedtuple('RoomGrant', 'room_id content_type content_id owner_id permission token expire_at')
+
+# 缓存中表示房间不存在
+_MISSING = object()
+
+
+class SocketIdentity:
+    """连接的认证结果，以及该连接在各房间中的权限"""
+
+    def __init__(self, user_id=None, username=None):
+        self.user_id = user_id
+        self.username = username
+        self.rooms = {}  # 房间ID -> edit / view
+
+    @property
+    def is_guest(self):
+        return self.user_id is None
+
+
+class RoomAuthorizer:
+    """loader(room_id) 从数据库读取房间授权，房间不存在时返回 None"""
+
+    def __init__(self, loader, ttl=60):
+        self.loader = loader
+        self._cache = TTLCache(ttl)
+        self._identities = {}  # sid -> SocketIdentity
+        self._lock = threading.Lock()
+
+    # -------------------------- 连接 --------------------------
+    def authenticate(self, sid, auth):
+        """校验连接携带的 JWT，JWT 无效时抛出 ConnectionRefusedError"""
+        token = auth.get('token') if isinstance(auth, dict) else None
+        identity = SocketIdentity()
+        if token:
+            try:
+                user = User.query.get(decode_token(token)['sub'])
+            except Exception:
+                user = None
+            if user is None:
+                raise ConnectionRefusedError('登录已失效，请重新登录')
+            identity = SocketIdentity(user.id, user.username)
+        with self._lock:
+            self._identities[sid] = identity
+        return identity
+
+    def identity(self, sid):
+        return self._identities.get(sid)
+
+    def forget(self, sid):
+        with self._lock:
+            self._identities.pop(sid, None)
+
+    # -------------------------- 房间 --------------------------
+    def grant(self, room_id):
+        """房间的授权信息，已过期或不存在时返回 None"""
+        grant = self._cache.get(room_id)
+        if grant is None:
+            grant = self.loader(room_id) or _MISSING
+            self._cache.set(room_id, grant)
+        if grant is _MISSING or (grant.expire_at and grant.expire_at < datetime.now()):
+            return None
+        return grant
+
+    def invalidate(self, room_id):
+        self._cache.delete(room_id)
+
+    def authorize(self, sid, room_id, share_token=None):
+        """检查连接能否加入房间，返回 (授权信息, 权限)；不能加入时抛出 PermissionError"""
+        identity = self._identities.get(sid)
+        if identity is None:
+            raise PermissionError('连接未认证')
+        grant = self.grant(room_id)
+        if grant is None:
+            raise PermissionError('房间不存在或已失效')
+        if identity.user_id is not None and identity.user_id == grant.owner_id:
+            permission = 'edit'
+        elif share_token and hmac.compare_digest(str(share_token), grant.token):
+            permission = grant.permission
+        else:
+            raise PermissionError('无权限加入该房间')
+        identity.rooms[room_id] = permission
+        return grant, permission
+
+    def leave(self, sid, room_id):
+        identity = self._identities.get(sid)
+        if identity is not None:
+            identity.rooms.pop(room_id, None)
+
+    def permission(self, sid, room_id, doc_type=None, doc_id=None):
+        """连接在房间中的权限；指定文档时还要求房间分享的正是该文档，否则返回 None"""
+        identity = self._identities.get(sid)
+        permission = identity.rooms.get(room_id) if identity else None
+        if permission is None:
+            return None
+        grant = self.grant(room_id)
+        if grant is None:
+            identity.rooms.pop(room_id, None)
+            return None
+        if doc_type is not None and (grant.content_type != doc_type or str(grant.content_id) != str(doc_id)):
+            return None
+        return permission
+
+    def can_read(self, sid, doc_type, doc_id):
+        """连接是否通过已加入的某个房间获得了该文档的访问权限"""
+        identity = self._identities.get(sid)
+        if identity is None:
+            return False
+        return any(self.permission(sid, room_id, doc_type, doc_id) for room_id in list(identity.rooms))
@@ -0,0 +1,175 @@
+"""管理后台统计：聚合查询、定时刷新的统计表和进程内TTL缓存
+
+仪表盘原本每次打开都要执行十几条 COUNT（最近7天的增长还要按天循环查询）。
+现在由定时任务用几条 GROUP BY 聚合查询把结果写入 daily_stat 表，
+接口只读一次统计表，并在前面加一层进程内缓存。统计表过期（例如定时任务未运行）时
+接口会当场刷新一次。
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, User, ContentItem, DailyStat
+from catalog import CATALOG_MODELS
+
+# 最近增长统计的天数
+GROWTH_DAYS = 7
+
+# 内容类型 -> 接口返回的字段名
+CONTENT_STAT_KEYS = {
+    'note': 'totalNotes',
+    'table': 'totalTables',
+    'whiteboard': 'totalWhiteboards',
+    'mindmap': 'totalMindmaps',
+    'flowchart': 'totalFlowcharts',
+}
+
+
+class TTLCache:
+    """进程内的简单TTL缓存，线程安全；ttl 为空时每次 set 都要指定过期时间"""
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._items[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+# 过期时间在写入时按当前应用的 ADMIN_STATS_CACHE_SECONDS 指定，不在导入模块时读取配置
+_cache = TTLCache()
+
+
+def _growth_dates(today):
+    return [today - timedelta(days=i) for i in range(GROWTH_DAYS - 1, -1, -1)]
+
+
+def refresh_daily_stats(now=None):
+    """用聚合查询重新计算最近几天的新增用户数和当前各类内容总数，写入统计表
+
+    共三条查询：按天分组的新增用户、用户总数、按类型分组的内容数（来自 content_item）
+    """
+    now = now or datetime.now()
+    today = now.date()
+    dates = _growth_dates(today)
+    start = datetime.combine(dates[0], datetime.min.time())
+
+    day = func.date(User.created_at)
+    # SQLite 的 date() 返回字符串，MySQL 返回日期，统一成 YYYY-MM-DD
+    new_users = {
+        str(stat_date)[:10]: count for stat_date, count in db.session.execute(
+            db.select(day, func.count(User.id)).where(User.created_at >= start).group_by(day)
+        )
+    }
+    total_users = db.session.execute(db.select(func.count(User.id))).scalar()
+    content_counts = dict(db.session.execute(
+        db.select(ContentItem.content_type, func.count(ContentItem.id)).group_by(ContentItem.content_type)
+    ).all())
+
+    rows = [
+        {'stat_date': stat_date, 'metric': 'new_users', 'value': new_users.get(stat_date.isoformat(), 0)}
+        for stat_date in dates
+    ]
+    rows.append({'stat_date': today, 'metric': 'total_users', 'value': total_users})
+    rows += [
+        {'stat_date': today, 'metric': f'total_{content_type}', 'value': content_counts.get(content_type, 0)}
+        for content_type in CATALOG_MODELS
+    ]
+    for row in rows:
+        row['refreshed_at'] = now
+
+    db.session.execute(_upsert_statement(), rows)
+    db.session.commit()
+    _cache.clear()
+
+
+def _upsert_statement():
+    """按主键 (stat_date, metric) 插入或覆盖统计值
+
+    每个进程的定时任务都会刷新统计表，同时刷新时各自覆盖同一行，
+    不会像先删除再插入那样因主键冲突而回滚
+    """
+    table = DailyStat.__table__
+    dialect = db.engine.dialect.name
+    if dialect == 'mysql':
+        statement = mysql_insert(table)
+        return statement.on_duplicate_key_update(
+            value=statement.inserted.value, refreshed_at=statement.inserted.refreshed_at
+        )
+    statement = sqlite_insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.stat_date, table.c.metric],
+        set_={'value': statement.excluded.value, 'refreshed_at': statement.excluded.refreshed_at}
+    )
+
+
+def _read_stats(today):
+    dates = _growth_dates(today)
+    rows = DailyStat.query.filter(DailyStat.stat_date >= dates[0]).all()
+    values = {(row.stat_date, row.metric): row for row in rows}
+    totals = values.get((today, 'total_users'))
+    if totals is None:
+        return None, None
+
+    stats = {
+        'userCount': totals.value,
+        'todayUsers': values[(today, 'new_users')].value if (today, 'new_users') in values else 0,
+    }
+    for content_type, key in CONTENT_STAT_KEYS.items():
+        row = values.get((today, f'total_{content_type}'))
+        stats[key] = row.value if row else 0
+    stats['normalNotes'] = stats['totalNotes']
+    stats['recentUserGrowth'] = [
+        values[(stat_date, 'new_users')].value if (stat_date, 'new_users') in values else 0
+        for stat_date in dates
+    ]
+    return stats, totals.refreshed_at
+
+
+def dashboard_stats(refresh_minutes=5, cache_seconds=None):
+    """管理后台仪表盘统计，依次读取进程内缓存、统计表，统计表过期时当场刷新
+
+    cache_seconds 为空时使用配置项 ADMIN_STATS_CACHE_SECONDS
+    """
+    stats = _cache.get('dashboard')
+    if stats is not None:
+        return stats
+
+    now = datetime.now()
+    stats, refreshed_at = _read_stats(now.date())
+    # 超过两个刷新周期没有更新，说明定时任务没有运行
+    if stats is None or refreshed_at < now - timedelta(minutes=refresh_minutes * 2):
+        refresh_daily_stats(now)
+        stats, refreshed_at = _read_stats(now.date())
+
+    stats['refreshedAt'] = refreshed_at.isoformat()
+    if cache_seconds is None:
+        cache_seconds = current_app.config.get('ADMIN_STATS_CACHE_SECONDS', 30)
+    _cache.set('dashboard', stats, cache_seconds)
+    return stats
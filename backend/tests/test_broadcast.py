@@ -0,0 +1,47 @@
+"""房间事件批量发送：只发给一个连接的事件不进入房间帧，帧之间保持发布顺序"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broadcast import RoomBroadcaster
+
+
+class RecordingSocketIO:
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, event, data, to=None):
+        self.emitted.append((to, [entry['event'] for entry in data['events']]))
+
+    def start_background_task(self, target):
+        return object()
+
+
+def test_direct_events_are_sent_only_to_recipient():
+    socketio = RecordingSocketIO()
+    broadcaster = RoomBroadcaster(socketio)
+    broadcaster.publish('room', 'document_operation', {'version': 1}, skip='a')
+    broadcaster.publish('room', 'document_ack', {'version': 1}, to='a')
+    broadcaster.publish('room', 'document_ack', {'version': 1}, to='a')
+    broadcaster.publish('room', 'document_operation', {'version': 2}, skip='b')
+    broadcaster.publish('room', 'document_ack', {'version': 2}, to='b')
+
+    assert broadcaster.flush() == 4
+    assert socketio.emitted == [
+        ('room', ['document_operation']),
+        ('a', ['document_ack', 'document_ack']),
+        ('room', ['document_operation']),
+        ('b', ['document_ack']),
+    ]
+
+
+def test_room_events_share_one_frame():
+    socketio = RecordingSocketIO()
+    broadcaster = RoomBroadcaster(socketio)
+    broadcaster.publish('room', 'cursor_moved', {'x': 1}, sender='a', ephemeral=True)
+    broadcaster.publish('room', 'new_message', {'text': 'hi'}, sender='a')
+    broadcaster.publish('room', 'cursor_moved', {'x': 2}, sender='a', ephemeral=True)
+
+    assert broadcaster.flush() == 1
+    assert socketio.emitted == [('room', ['new_message', 'cursor_moved'])]
@@ -0,0 +1,44 @@
+"""重建内容目录在一个事务中完成，重建期间不会提交空目录"""
+import os
+import sys
+
+os.environ['FLASK_ENV'] = 'testing'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import catalog
+from app import app, db
+from models import User, Note, Mindmap, ContentItem
+
+
+@pytest.fixture
+def owner():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='owner')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        yield user.id
+
+
+def test_rebuild_commits_once(owner, monkeypatch):
+    monkeypatch.setattr(catalog, 'REBUILD_BATCH_SIZE', 2)
+    db.session.add_all([Note(title=f'笔记{i}', content='内容', user_id=owner) for i in range(5)])
+    db.session.add(Mindmap(title='脑图', data={}, user_id=owner))
+    db.session.commit()
+    db.session.execute(ContentItem.__table__.update().values(title='过期标题'))
+    db.session.commit()
+
+    commits = []
+    original_commit = db.session.commit
+    monkeypatch.setattr(db.session, 'commit', lambda: commits.append(True) or original_commit())
+
+    counts = catalog.rebuild_catalog()
+
+    assert counts['note'] == 5 and counts['mindmap'] == 1
+    assert len(commits) == 1
+    assert ContentItem.query.count() == 6
+    assert ContentItem.query.filter_by(title='过期标题').count() == 0
@@ -0,0 +1,123 @@
+"""编辑接口与协作文档缓存的一致性
+
+房间清空后协作文档仍缓存在 collab_store 中，编辑、回滚接口修改笔记后重新加入的用户必须拿到新内容，
+其后的协作编辑写回时也不能覆盖接口保存的内容。
+"""
+import os
+import sys
+
+os.environ['FLASK_ENV'] = 'testing'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+import app as appmod
+from app import app, db, socketio, broadcaster
+from models import User, Note, NoteVersion
+from collab_persist import flush_documents
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        appmod.collab_store.__init__()
+        user = User(username='owner')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        headers = {'Authorization': 'Bearer ' + create_access_token(identity=user.id)}
+        yield app.test_client(), headers
+
+
+def _share(client, headers, content):
+    note = client.post('/api/notes', json={'title': '协作笔记', 'content': content, 'type': 'markdown'},
+                       headers=headers).get_json()['data']
+    link = client.post(f"/api/notes/{note['id']}/share", json={'permission': 'edit', 'is_collaborative': True},
+                       headers=headers).get_json()['data']
+    return note['id'], link
+
+
+def _join(link, auth=None):
+    sio = socketio.test_client(app, auth=auth)
+    sio.emit('join_room', {'room_id': link['room_id'], 'share_token': link['share_token']})
+    states = [message['args'][0] for message in sio.get_received() if message['name'] == 'document_state']
+    return sio, states[-1]
+
+
+def _state_text(state):
+    text = ''.join(op.get('insert', '') for op in state['snapshot']['ops'])
+    assert not state['operations']
+    return text
+
+
+def _edit_and_flush(sio, link, note_id, state, text):
+    sio.emit('sync_document', {'room_id': link['room_id'], 'doc_id': note_id, 'doc_type': 'note',
+                               'ops': [{'insert': text}], 'version': state['version'], 'op_id': text})
+    broadcaster.flush()
+    acks = [m for m in sio.get_received() if m['name'] == 'room_batch']
+    assert any(entry['event'] == 'document_ack' for m in acks for entry in m['args'][0]['events'])
+    assert flush_documents(appmod.collab_store, app.config, force=True) == 1
+
+
+def test_rest_update_survives_stale_collab_document(client):
+    client, headers = client
+    note_id, link = _share(client, headers, 'original')
+
+    sio, state = _join(link)
+    assert _state_text(state) == 'original'
+    sio.emit('leave_room', {'room_id': link['room_id']})
+    sio.disconnect()
+
+    response = client.put(f'/api/notes/{note_id}', json={'content': 'from rest'}, headers=headers)
+    assert response.status_code == 200
+
+    sio, state = _join(link)
+    assert _state_text(state) == 'from rest'
+    _edit_and_flush(sio, link, note_id, state, 'X')
+    sio.disconnect()
+
+    db.session.expire_all()
+    assert db.session.get(Note, note_id).content == 'Xfrom rest'
+
+
+def test_rollback_replaces_cached_document(client):
+    client, headers = client
+    note_id, link = _share(client, headers, 'first')
+    client.put(f'/api/notes/{note_id}', json={'content': 'second'}, headers=headers)
+    version_id = client.get(f'/api/notes/{note_id}/versions', headers=headers).get_json()['data'][0]['id']
+
+    sio, state = _join(link)
+    assert _state_text(state) == 'second'
+    sio.disconnect()
+
+    response = client.post(f'/api/notes/{note_id}/versions/{version_id}/rollback', headers=headers)
+    assert response.status_code == 200
+
+    sio, state = _join(link)
+    assert _state_text(state) == 'first'
+    _edit_and_flush(sio, link, note_id, state, 'Y')
+    sio.disconnect()
+
+    db.session.expire_all()
+    assert db.session.get(Note, note_id).content == 'Yfirst'
+
+
+def test_flushed_version_credits_collaborator(client):
+    client, headers = client
+    note_id, link = _share(client, headers, 'original')
+    collaborator = User(username='collaborator')
+    collaborator.set_password('password')
+    db.session.add(collaborator)
+    db.session.commit()
+
+    sio, state = _join(link, {'token': create_access_token(identity=collaborator.id)})
+    _edit_and_flush(sio, link, note_id, state, 'Z')
+    sio.disconnect()
+
+    db.session.expire_all()
+    version = NoteVersion.query.filter_by(note_id=note_id).order_by(NoteVersion.id.desc()).first()
+    assert version.updater_id == collaborator.id
+    assert version.get_content() == 'original'
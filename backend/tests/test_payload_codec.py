@@ -0,0 +1,114 @@
+"""协作消息解码的大小限制和解码前的权限检查
+
+压缩后很小的消息可能解压出极大的内容，解码时必须限制解压后的大小；
+未加入房间或没有权限的连接发来的编码消息不应被解码。
+"""
+import json
+import os
+import sys
+import zlib
+
+os.environ['FLASK_ENV'] = 'testing'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+import app as appmod
+from app import app, db, socketio, broadcaster, payload_codec
+from models import User
+from payload_codec import PayloadCodec, DEFLATE
+
+LIMIT = 64 * 1024
+
+
+def deflate_frame(payload):
+    return bytes([DEFLATE]) + zlib.compress(json.dumps(payload).encode('utf-8'))
+
+
+def bomb_frame(megabytes=256):
+    """几百KB的压缩数据，解压出数百MB的 JSON 字符串"""
+    compressor = zlib.compressobj(9)
+    chunk = b' ' * (1024 * 1024)
+    body = compressor.compress(b'{"ops": "')
+    for _ in range(megabytes):
+        body += compressor.compress(chunk)
+    body += compressor.compress(b'"}') + compressor.flush()
+    return bytes([DEFLATE]) + body
+
+
+BOMB = bomb_frame()
+
+
+def test_decode_rejects_oversized_deflate_frame():
+    codec = PayloadCodec(max_decoded_bytes=LIMIT)
+    assert len(BOMB) < 1024 * 1024
+    with pytest.raises(ValueError, match='消息过大'):
+        codec.decode({'room_id': 'r', 'doc_id': 1, 'payload': BOMB})
+
+
+def test_decode_merges_routing_fields():
+    codec = PayloadCodec(max_decoded_bytes=LIMIT)
+    frame = deflate_frame({'ops': [{'insert': 'x'}], 'version': 3, 'doc_id': 2})
+    data = codec.decode({'room_id': 'r', 'doc_id': 1, 'doc_type': 'note', 'payload': frame})
+    assert data == {'room_id': 'r', 'doc_id': 1, 'doc_type': 'note', 'ops': [{'insert': 'x'}], 'version': 3}
+    with pytest.raises(ValueError):
+        codec.decode(frame)
+    with pytest.raises(ValueError):
+        codec.decode({'payload': deflate_frame({'ops': []})[:-4]})
+
+
+@pytest.fixture
+def room(monkeypatch):
+    monkeypatch.setattr(payload_codec, 'max_decoded_bytes', LIMIT)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        appmod.collab_store.__init__()
+        user = User(username='owner')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        headers = {'Authorization': 'Bearer ' + create_access_token(identity=user.id)}
+        client = app.test_client()
+        note = client.post('/api/notes', json={'title': '协作笔记', 'content': 'original', 'type': 'markdown'},
+                           headers=headers).get_json()['data']
+        link = client.post(f"/api/notes/{note['id']}/share", json={'permission': 'edit', 'is_collaborative': True},
+                           headers=headers).get_json()['data']
+        yield note['id'], link
+
+
+def _errors(sio):
+    return [m['args'][0]['message'] for m in sio.get_received() if m['name'] == 'error']
+
+
+def test_sync_rejects_oversized_frame(room):
+    note_id, link = room
+    sio = socketio.test_client(app, auth={'encodings': ['deflate']})
+    sio.emit('join_room', {'room_id': link['room_id'], 'share_token': link['share_token']})
+    sio.get_received()
+
+    sio.emit('sync_document', {'room_id': link['room_id'], 'doc_id': note_id, 'doc_type': 'note',
+                               'payload': BOMB})
+    assert _errors(sio) == ['消息过大']
+
+    sio.emit('sync_document', {'room_id': link['room_id'], 'doc_id': note_id, 'doc_type': 'note',
+                               'payload': deflate_frame({'ops': [{'insert': 'X'}], 'version': 0, 'op_id': 'a'})})
+    broadcaster.flush()
+    batches = [m for m in sio.get_received() if m['name'] == 'room_batch']
+    assert any(entry['event'] == 'document_ack' for m in batches for entry in m['args'][0]['events'])
+    sio.disconnect()
+
+
+def test_unauthorized_frame_is_not_decoded(room, monkeypatch):
+    note_id, link = room
+    decoded = []
+    monkeypatch.setattr(payload_codec, 'decode', lambda data: decoded.append(data) or data)
+    sio = socketio.test_client(app, auth={'encodings': ['deflate']})
+
+    sio.emit('sync_document', {'room_id': link['room_id'], 'doc_id': note_id, 'doc_type': 'note',
+                               'payload': BOMB})
+    sio.emit('get_document_state', {'doc_id': note_id, 'doc_type': 'note', 'payload': BOMB})
+    assert _errors(sio) == ['无权限编辑该文档', '无权限查看该文档']
+    assert decoded == []
+    sio.disconnect()
@@ -0,0 +1,102 @@
+"""列表接口的SQL查询数不随行数增长
+
+每个列表接口分别在 N 行和 10N 行数据下请求一次，执行的SQL条数必须相同；
+出现 N+1 查询（例如逐行加载标签、分类）时查询数会随行数增长，测试失败。
+"""
+import os
+import sys
+from contextlib import contextmanager
+
+os.environ['FLASK_ENV'] = 'testing'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from app import app, db
+from models import User, Category, Tag, Note, Flowchart, TableDocument, Whiteboard, Mindmap
+
+ROWS = 5
+
+LIST_ENDPOINTS = [
+    '/api/notes',
+    '/api/notes?limit=50&count=true',
+    '/api/flowcharts',
+    '/api/tables',
+    '/api/whiteboards',
+    '/api/mindmaps',
+    '/api/categories',
+    '/api/tags',
+    '/api/admin/users',
+    '/api/admin/content',
+]
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def seed(user, count):
+    """为用户添加 count 组数据：每种内容各一条，笔记和流程图带分类、标签"""
+    start = Note.query.count()
+    for i in range(start, start + count):
+        category = Category(name=f'分类{i}', user_id=user.id)
+        tag = Tag(name=f'标签{i}', user_id=user.id)
+        db.session.add_all([category, tag])
+        db.session.flush()
+        note = Note(title=f'笔记{i}', content='内容', user_id=user.id, category_id=category.id)
+        note.tags.append(tag)
+        flowchart = Flowchart(title=f'流程图{i}', flow_data={'nodes': []}, user_id=user.id)
+        flowchart.tags.append(tag)
+        db.session.add_all([
+            note,
+            flowchart,
+            TableDocument(title=f'表格{i}', columns_data=[], rows_data=[], user_id=user.id),
+            Whiteboard(title=f'白板{i}', data={}, user_id=user.id),
+            Mindmap(title=f'脑图{i}', data={}, user_id=user.id),
+            User(username=f'user{i}', password_hash='x'),
+        ])
+    db.session.commit()
+
+
+@pytest.fixture(scope='module')
+def admin():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='admin', is_admin=True)
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        yield user, {'Authorization': 'Bearer ' + create_access_token(identity=user.id)}
+
+
+def query_counts(headers):
+    client = app.test_client()
+    counts = {}
+    for url in LIST_ENDPOINTS:
+        with count_queries() as statements:
+            response = client.get(url, headers=headers)
+        assert response.status_code == 200, (url, response.get_json())
+        counts[url] = len(statements)
+    return counts
+
+
+def test_list_query_counts_do_not_grow_with_rows(admin):
+    user, headers = admin
+    seed(user, ROWS)
+    small = query_counts(headers)
+    seed(user, ROWS * 9)
+    large = query_counts(headers)
+    assert large == small
@@ -0,0 +1,29 @@
+"""管理后台统计的进程内缓存按当前应用的配置过期"""
+import os
+import sys
+
+os.environ['FLASK_ENV'] = 'testing'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import stats
+from app import app, db
+
+
+@pytest.fixture
+def app_context():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        stats._cache.clear()
+        yield
+        stats._cache.clear()
+
+
+@pytest.mark.parametrize('cache_seconds,cached', [(0, False), (60, True)])
+def test_cache_ttl_follows_app_config(app_context, monkeypatch, cache_seconds, cached):
+    monkeypatch.setitem(app.config, 'ADMIN_STATS_CACHE_SECONDS', cache_seconds)
+    result = stats.dashboard_stats()
+    assert result['userCount'] == 0
+    assert (stats._cache.get('dashboard') is not None) == cached
@@ -0,0 +1,68 @@
+"""自动保存的版本合并
+
+请求带 autosave 时，同一用户在合并窗口内的连续自动保存只保留一个版本；
+手动保存不合并，手动保存的内容也不会被之后的自动保存合并掉。
+"""
+import os
+import sys
+
+os.environ['FLASK_ENV'] = 'testing'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app import app, db
+from models import User, NoteVersion
+
+
+@pytest.fixture
+def note(monkeypatch):
+    monkeypatch.setitem(app.config, 'VERSION_COALESCE_MINUTES', 5)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='owner')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        headers = {'Authorization': 'Bearer ' + create_access_token(identity=user.id)}
+        client = app.test_client()
+        note = client.post('/api/notes', json={'title': '笔记', 'content': 'v0'}, headers=headers).get_json()['data']
+
+        def save(content, autosave=False):
+            response = client.put(f"/api/notes/{note['id']}", json={'content': content, 'autosave': autosave},
+                                  headers=headers)
+            assert response.status_code == 200
+
+        yield note['id'], save
+
+
+def contents(note_id):
+    db.session.expire_all()
+    versions = NoteVersion.query.filter_by(note_id=note_id).order_by(NoteVersion.id).all()
+    return [version.get_content() for version in versions]
+
+
+def test_autosaves_coalesce(note):
+    note_id, save = note
+    save('v1', autosave=True)
+    save('v2', autosave=True)
+    save('v3', autosave=True)
+    assert contents(note_id) == ['v0']
+
+
+def test_manual_saves_are_kept(note):
+    note_id, save = note
+    save('v1')
+    save('v2')
+    assert contents(note_id) == ['v0', 'v1']
+
+
+def test_autosave_does_not_absorb_manual_save(note):
+    note_id, save = note
+    save('v1', autosave=True)
+    save('v2')
+    save('v3', autosave=True)
+    save('v4', autosave=True)
+    assert contents(note_id) == ['v0', 'v1', 'v2']
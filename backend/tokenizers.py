@@ -0,0 +1,103 @@
+"""检索分词器
+
+内容以中文为主，按空格切分毫无意义。这里提供可替换的分词层：
+默认的 bigram 分词不依赖任何词典，中文按相邻两个字切分；安装了 jieba 时可以改用词典分词。
+通过配置项 SEARCH_TOKENIZER 选择分词器，更换分词器后需要执行 flask rebuild-search-index 重建索引。
+"""
+import logging
+import re
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+# 中日韩文字：按字切分，其余文字按单词切分
+_CJK_CHARS = '぀-ヿ㐀-䶿一-鿿가-힯豈-﫿'
+_RUN_PATTERN = re.compile(rf'([{_CJK_CHARS}]+)|([^\W_{_CJK_CHARS}]+)')
+_WORD_PATTERN = re.compile(r'[^\W_]')
+
+
+class Tokenizer(ABC):
+    """分词器基类：把文本切分为小写的检索词序列"""
+
+    # 查询时多个检索词是否按短语匹配（在正文中连续出现）
+    phrase = True
+    # 长度小于该值的检索词无法通过索引命中，需要改用子串匹配
+    min_token_length = 1
+
+    @abstractmethod
+    def tokenize(self, text):
+        """索引时使用的分词"""
+
+    def query_tokens(self, term):
+        """查询时使用的分词，默认与索引一致"""
+        return self.tokenize(term)
+
+
+class BigramTokenizer(Tokenizer):
+    """中文按相邻两个字切分（单独的一个字作为一个词），英文和数字按单词切分"""
+
+    min_token_length = 2
+
+    def tokenize(self, text):
+        tokens = []
+        for cjk, word in _RUN_PATTERN.findall((text or '').lower()):
+            if word:
+                tokens.append(word)
+            elif len(cjk) == 1:
+                tokens.append(cjk)
+            else:
+                tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        return tokens
+
+
+class JiebaTokenizer(Tokenizer):
+    """jieba 词典分词（可选依赖）
+
+    索引时使用搜索引擎模式，长词会同时切出其中的短词；查询时使用精确模式，
+    查询词之间不再要求连续出现
+    """
+
+    phrase = False
+
+    def __init__(self):
+        import jieba
+        self._jieba = jieba
+
+    def _clean(self, words):
+        return [word for word in (word.strip().lower() for word in words) if _WORD_PATTERN.search(word)]
+
+    def tokenize(self, text):
+        return self._clean(self._jieba.cut_for_search(text or ''))
+
+    def query_tokens(self, term):
+        return self._clean(self._jieba.cut(term or ''))
+
+
+# 分词器名称 -> 分词器类，新的分词器通过 register_tokenizer 注册
+TOKENIZERS = {
+    'bigram': BigramTokenizer,
+    'jieba': JiebaTokenizer,
+}
+
+_instances = {}
+
+
+def register_tokenizer(name, tokenizer_class):
+    """注册自定义分词器"""
+    TOKENIZERS[name] = tokenizer_class
+    _instances.pop(name, None)
+
+
+def get_tokenizer(name='bigram'):
+    """按名称获取分词器实例，未知名称或依赖缺失时退回 bigram 分词"""
+    if name not in _instances:
+        tokenizer_class = TOKENIZERS.get(name)
+        if tokenizer_class is None:
+            logger.warning(f"未知的分词器 {name}，使用bigram分词")
+            tokenizer_class = BigramTokenizer
+        try:
+            _instances[name] = tokenizer_class()
+        except ImportError:
+            logger.warning(f"分词器 {name} 的依赖未安装，使用bigram分词")
+            _instances[name] = BigramTokenizer()
+    return _instances[name]
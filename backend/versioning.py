@@ -0,0 +1,246 @@
+"""版本存储编解码：关键帧 + 差量 + zlib 压缩
+
+历史版本不再每次保存全文，而是每隔若干版本保存一个完整关键帧，
+其余版本只保存与上一版本之间的差量，两者都经过 zlib 压缩后写入数据库。
+笔记正文使用文本差量，流程图、脑图、白板和表格使用 RFC 6902 风格的 JSON Patch。
+"""
+import copy
+import hashlib
+import json
+import re
+import zlib
+from difflib import SequenceMatcher
+
+# 默认关键帧间隔：每隔多少个差量版本强制保存一次全文
+DEFAULT_KEYFRAME_INTERVAL = 20
+
+# 差量压缩后超过全文压缩大小的该比例时，直接保存关键帧更划算
+DELTA_KEYFRAME_RATIO = 0.5
+
+# 版本列表中预览文字的最大长度
+PREVIEW_LENGTH = 150
+
+# 文本切分规则：在换行、HTML标签结尾、JSON分隔符和中文句号之后断开，
+# 兼顾纯文本、富文本HTML和Quill Delta JSON 三种笔记内容
+_TOKEN_PATTERN = re.compile(r'[^\n>},。]*[\n>},。]|[^\n>},。]+')
+
+
+def dumps(obj):
+    """紧凑序列化为UTF-8字节"""
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def content_digest(obj):
+    """内容摘要：字段顺序不同但内容相同的快照得到相同的摘要"""
+    raw = json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()
+
+
+def pack(obj):
+    """序列化并压缩为二进制"""
+    return zlib.compress(dumps(obj), 6)
+
+
+def unpack(payload):
+    """解压并反序列化"""
+    if payload is None:
+        return None
+    return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+
+def _tokenize(text):
+    return _TOKEN_PATTERN.findall(text)
+
+
+def diff_text(old, new):
+    """计算文本差量
+
+    返回操作列表：[start, end] 表示复制旧文本的 old[start:end]，字符串表示插入的新文本
+    """
+    old = old or ''
+    new = new or ''
+
+    # 先去掉公共前后缀，编辑通常只发生在局部，可以大幅缩小比较范围
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+
+    ops = []
+    if prefix:
+        ops.append([0, prefix])
+
+    old_mid = old[prefix:len(old) - suffix]
+    new_mid = new[prefix:len(new) - suffix]
+    old_tokens = _tokenize(old_mid)
+    new_tokens = _tokenize(new_mid)
+
+    # 记录每个旧token在原文中的起始偏移，便于把token区间换算为字符区间
+    offsets = [prefix]
+    for token in old_tokens:
+        offsets.append(offsets[-1] + len(token))
+
+    matcher = SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            start, end = offsets[i1], offsets[i2]
+            if ops and isinstance(ops[-1], list) and ops[-1][1] == start:
+                ops[-1][1] = end
+            else:
+                ops.append([start, end])
+        elif tag in ('replace', 'insert'):
+            inserted = ''.join(new_tokens[j1:j2])
+            if ops and isinstance(ops[-1], str):
+                ops[-1] += inserted
+            else:
+                ops.append(inserted)
+
+    if suffix:
+        start, end = len(old) - suffix, len(old)
+        if ops and isinstance(ops[-1], list) and ops[-1][1] == start:
+            ops[-1][1] = end
+        else:
+            ops.append([start, end])
+    return ops
+
+
+def patch_text(old, ops):
+    """把 diff_text 生成的差量应用到旧文本上"""
+    old = old or ''
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.append(old[op[0]:op[1]])
+    return ''.join(parts)
+
+
+def _escape_pointer(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def _unescape_pointer(token):
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def _json_key(value):
+    return json.dumps(value, sort_keys=True, ensure_ascii=False)
+
+
+def diff_json(old, new, path=''):
+    """计算两个JSON快照之间的结构化差量，返回 RFC 6902 风格的操作列表"""
+    if old == new and type(old) is type(new):
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({'op': 'remove', 'path': f'{path}/{_escape_pointer(key)}'})
+        for key, value in new.items():
+            child = f'{path}/{_escape_pointer(key)}'
+            if key not in old:
+                ops.append({'op': 'add', 'path': child, 'value': value})
+            else:
+                ops.extend(diff_json(old[key], value, child))
+        return ops
+    if isinstance(old, list) and isinstance(new, list):
+        return _diff_list(old, new, path)
+    return [{'op': 'replace', 'path': path, 'value': new}]
+
+
+def _diff_list(old, new, path):
+    # 白板笔画、表格行等数组通常只在局部增删，先按元素内容对齐再逐段生成操作
+    ops = []
+    matcher = SequenceMatcher(None, [_json_key(v) for v in old], [_json_key(v) for v in new], autojunk=False)
+    # 按从左到右的顺序处理，处理到 j1 时结果数组的前 j1 个元素已与新数组一致
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        paired = min(i2 - i1, j2 - j1)
+        for k in range(paired):
+            ops.extend(diff_json(old[i1 + k], new[j1 + k], f'{path}/{j1 + k}'))
+        for _ in range(i2 - i1 - paired):
+            ops.append({'op': 'remove', 'path': f'{path}/{j1 + paired}'})
+        for k in range(paired, j2 - j1):
+            ops.append({'op': 'add', 'path': f'{path}/{j1 + k}', 'value': new[j1 + k]})
+    return ops
+
+
+def patch_json(doc, ops):
+    """把 diff_json 生成的操作列表应用到快照上，返回新的快照，不修改传入对象"""
+    doc = copy.deepcopy(doc)
+    for op in ops:
+        path = op['path']
+        if path == '':
+            doc = copy.deepcopy(op.get('value'))
+            continue
+        tokens = [_unescape_pointer(token) for token in path.split('/')[1:]]
+        parent = doc
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+        last = tokens[-1]
+        if isinstance(parent, list):
+            index = len(parent) if last == '-' else int(last)
+            if op['op'] == 'add':
+                parent.insert(index, copy.deepcopy(op['value']))
+            elif op['op'] == 'remove':
+                del parent[index]
+            else:
+                parent[index] = copy.deepcopy(op['value'])
+        else:
+            if op['op'] == 'remove':
+                del parent[last]
+            else:
+                parent[last] = copy.deepcopy(op['value'])
+    return doc
+
+
+def text_preview(text):
+    """笔记版本预览：截取开头部分正文"""
+    text = text or ''
+    return text[:PREVIEW_LENGTH] + '...' if len(text) > PREVIEW_LENGTH else text
+
+
+def json_preview(data):
+    """JSON快照预览：列出顶层字段及其元素个数，例如 nodes: 12, edges: 11"""
+    if isinstance(data, dict):
+        parts = []
+        for key, value in data.items():
+            if isinstance(value, (list, dict)):
+                parts.append(f'{key}: {len(value)}')
+        if parts:
+            return text_preview(', '.join(parts))
+    elif isinstance(data, list):
+        return f'items: {len(data)}'
+    return text_preview(dumps(data).decode('utf-8'))
+
+
+def table_preview(snapshot):
+    """表格版本预览：行数和列数"""
+    snapshot = snapshot or {}
+    return f"行数: {len(snapshot.get('rows') or [])}, 列数: {len(snapshot.get('columns') or [])}"
+
+
+def encode_version(data, previous, chain_length, diff, interval=DEFAULT_KEYFRAME_INTERVAL):
+    """选择版本的存储方式，返回 (storage, payload)
+
+    chain_length 为上一个关键帧及其之后已有的版本数，0 表示这是该文档的第一个版本
+    """
+    full = pack(data)
+    if chain_length == 0 or chain_length >= interval:
+        return 'full', full
+    delta = pack(diff(previous, data))
+    if len(delta) >= len(full) * DELTA_KEYFRAME_RATIO:
+        return 'full', full
+    return 'delta', delta
+
+
+def decode_version(storage, payload, previous, patch):
+    """还原版本数据，差量版本需要传入上一版本的数据"""
+    if storage == 'full':
+        return unpack(payload)
+    return patch(previous, unpack(payload))
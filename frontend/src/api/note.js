@@ -46,6 +46,13 @@ export const noteAPI = {
     })
   },
   
+  getVersion(noteId, versionId) {
+    return request({
+      url: `/api/notes/${noteId}/versions/${versionId}`,
+      method: 'get'
+    })
+  },
+  
   saveVersion(id) {
     return request({
       url: `/api/notes/${id}/versions`,
@@ -0,0 +1,160 @@
+// 协作编辑客户端：基于 Quill Delta 的操作变换（OT）
+// 本地编辑只发送操作，同一时间最多有一个操作等待服务端确认，
+// 确认之前的本地编辑先合并到缓冲区；收到其他人的操作时与未确认的操作互相变换后再应用。
+// 断线期间的本地编辑同样先缓冲，重连后按版本号补取错过的操作（catchUp），再发送未确认的操作；
+// 每个操作带有唯一的 op_id，断线前已被服务端合并的操作会在补取的操作中被识别为已确认
+import { Quill } from '@vueup/vue-quill'
+
+const Delta = Quill.import('delta')
+
+export class CollabSession {
+  constructor({ send, apply, resync }) {
+    this.send = send        // 发送操作：(ops, 基于的版本号, 操作ID)
+    this.apply = apply      // 应用其他人的操作：(delta)
+    this.resync = resync    // 版本不连续时补取错过的操作：(当前版本号)
+    this.version = 0
+    this.ready = false
+    this.online = true      // 断线期间不发送操作
+    this.inflight = null    // 已发送、等待确认的操作
+    this.inflightId = null
+    this.buffer = null      // 等待发送的本地操作
+    this.catchingUp = false // 已请求补取，等待服务端返回
+    this.latestSeen = 0     // 收到过的最大版本号
+    this.clientId = Math.random().toString(36).slice(2, 10)
+    this.seq = 0
+  }
+
+  // 收到完整的文档状态，之前未确认的本地操作作废
+  reset(version) {
+    this.version = version
+    this.latestSeen = version
+    this.inflight = null
+    this.inflightId = null
+    this.buffer = null
+    this.online = true
+    this.catchingUp = false
+    this.ready = true
+  }
+
+  // 本地编辑
+  local(delta) {
+    if (!this.ready || !delta.ops.length) return
+    if (this.inflight || !this.online) {
+      this.buffer = this.buffer ? this.buffer.compose(delta) : delta
+      return
+    }
+    this.sendBuffer(delta)
+  }
+
+  sendBuffer(delta) {
+    this.inflight = delta
+    this.inflightId = `${this.clientId}-${++this.seq}`
+    this.buffer = null
+    this.send(delta.ops, this.version, this.inflightId)
+  }
+
+  // 服务端确认了本客户端的操作；opId 不是当前等待确认的操作时（例如重复的确认）忽略
+  ack(version, opId) {
+    if (!this.inflight || (opId && opId !== this.inflightId)) return
+    if (!this.checkVersion(version)) return
+    this.version = version
+    this.inflight = null
+    this.inflightId = null
+    if (this.buffer && this.online) {
+      this.sendBuffer(this.buffer)
+    }
+  }
+
+  // 连接断开
+  pause() {
+    this.online = false
+  }
+
+  // 重连后补取的操作：[{ version, ops, op_id }]，版本号从当前版本之后连续
+  catchUp(operations) {
+    for (const operation of operations) {
+      if (operation.version <= this.version) continue
+      if (this.inflight && operation.op_id === this.inflightId) {
+        this.ack(operation.version, operation.op_id)
+      } else {
+        this.remote(operation.ops, operation.version)
+      }
+    }
+    this.catchingUp = false
+    // 等待补取期间又收到了更新的版本，继续补取
+    if (this.latestSeen > this.version) {
+      this.checkVersion(this.latestSeen)
+      return
+    }
+    this.online = true
+    // 断线前发出但服务端没有收到的操作重新发送（同一个操作ID），否则发送断线期间的编辑
+    if (this.inflight) {
+      this.send(this.inflight.ops, this.version, this.inflightId)
+    } else if (this.buffer) {
+      this.sendBuffer(this.buffer)
+    }
+  }
+
+  // 其他人的操作：服务端已先于本地未确认的操作接收
+  remote(ops, version) {
+    if (!this.checkVersion(version)) return
+    let delta = new Delta(ops)
+    if (this.inflight) {
+      const transformed = this.inflight.transform(delta, false)
+      this.inflight = delta.transform(this.inflight, true)
+      delta = transformed
+    }
+    if (this.buffer) {
+      const transformed = this.buffer.transform(delta, false)
+      this.buffer = delta.transform(this.buffer, true)
+      delta = transformed
+    }
+    this.version = version
+    this.apply(delta)
+  }
+
+  // 已处理过的版本（补取的操作与广播重叠）直接忽略；中间缺少版本时暂停发送，补取错过的操作
+  checkVersion(version) {
+    this.latestSeen = Math.max(this.latestSeen, version)
+    if (version === this.version + 1) return true
+    if (version > this.version + 1 && !this.catchingUp) {
+      this.online = false
+      this.catchingUp = true
+      this.resync(this.version)
+    }
+    return false
+  }
+}
+
+// 服务端发来的完整文档状态（压缩的快照及其后的操作）合成为当前内容
+export function stateContent(state) {
+  return (state.operations || []).reduce(
+    (content, operation) => content.compose(new Delta(operation.ops)),
+    new Delta(state.snapshot.ops)
+  )
+}
+
+// 纯文本（Markdown 笔记）前后两个版本之间的差异转换为 Delta
+export function textDelta(oldText, newText) {
+  let start = 0
+  const maxStart = Math.min(oldText.length, newText.length)
+  while (start < maxStart && oldText[start] === newText[start]) start++
+  let end = 0
+  const maxEnd = maxStart - start
+  while (end < maxEnd && oldText[oldText.length - 1 - end] === newText[newText.length - 1 - end]) end++
+
+  const delta = new Delta().retain(start)
+  if (oldText.length - start - end > 0) delta.delete(oldText.length - start - end)
+  if (newText.length - start - end > 0) delta.insert(newText.slice(start, newText.length - end))
+  return delta.chop()
+}
+
+// Delta 中的纯文本
+export function deltaText(delta) {
+  return delta.ops.map(op => (typeof op.insert === 'string' ? op.insert : '')).join('')
+}
+
+// 在纯文本上应用 Delta
+export function applyTextDelta(text, delta) {
+  return deltaText(new Delta().insert(text).compose(delta))
+}
@@ -1,6 +1,20 @@
 // WebSocket服务
 import { ref, reactive, onMounted, onUnmounted } from 'vue'
 import { io } from 'socket.io-client'
+import { deflate, inflate } from 'pako'
+
+// 二进制消息第一个字节的标志位，与服务端 payload_codec 一致
+const MSGPACK = 0x01
+const DEFLATE = 0x02
+
+// 解码服务端发来的二进制消息（deflate 压缩的 JSON），普通对象原样返回
+export function decodePayload(data) {
+  if (!(data instanceof ArrayBuffer || ArrayBuffer.isView(data))) return data
+  const bytes = data instanceof ArrayBuffer ? new Uint8Array(data) : new Uint8Array(data.buffer, data.byteOffset, data.byteLength)
+  if (bytes[0] & MSGPACK) throw new Error('不支持msgpack编码的消息')
+  const body = bytes[0] & DEFLATE ? inflate(bytes.subarray(1)) : bytes.subarray(1)
+  return JSON.parse(new TextDecoder().decode(body))
+}
 
 class SocketService {
   constructor() {
@@ -8,7 +22,12 @@ class SocketService {
     this.url = 'http://localhost:5000'
     this.isConnected = false
     this.roomId = null
+    this.shareToken = null  // 加入房间所用的共享链接token，房间所有者可以为空
+    this.since = null       // 重新加入房间时客户端已有的文档版本号（函数），用于只补取错过的操作
     this.userInfo = null
+    this.heartbeatTimer = null
+    this.encoding = null    // 连接时与服务端协商的消息编码
+    this.handlers = new WeakMap()
   }
 
   // 初始化Socket.io连接
@@ -22,6 +41,14 @@ class SocketService {
     try {
       this.socket = io(this.url, {
         transports: ['websocket'],
+        // 登录用户携带JWT，未登录时作为访客连接；声明支持的消息编码，大文档以压缩的二进制消息收发
+        // 使用函数以便重连时读取最新的token
+        auth: (callback) => {
+          callback({
+            token: localStorage.getItem('token') || undefined,
+            encodings: ['deflate']
+          })
+        },
         cors: {
           origin: '*',
         },
@@ -30,11 +57,38 @@ class SocketService {
       this.socket.on('connect', () => {
         console.log('Socket.io连接已建立')
         this.isConnected = true
+        // 重连后服务端已不记得之前的房间，重新加入
+        if (this.roomId) {
+          this.joinRoom(this.roomId, this.shareToken, this.since)
+        }
       })
 
       this.socket.on('disconnect', () => {
         console.log('Socket.io连接已关闭')
         this.isConnected = false
+        this.stopHeartbeat()
+      })
+
+      // 服务端告知心跳间隔，长时间没有心跳的连接会被移出房间
+      this.socket.on('connected', (data) => {
+        this.encoding = data.encoding || null
+        this.startHeartbeat((data.heartbeat_interval || 30) * 1000)
+      })
+
+      // 服务端按房间（只发给本连接的事件单独成帧）批量发送的事件，逐条分发给对应事件的处理器
+      this.socket.on('room_batch', (frame) => {
+        for (const entry of frame.events) {
+          if (entry.skip === this.socket.id) continue
+          this.socket.listeners(entry.event).forEach(handler => handler(entry.data))
+        }
+      })
+
+      // 共享链接被删除或关闭了协作，服务端已把连接移出房间
+      this.socket.on('room_revoked', (data) => {
+        if (data.room_id === this.roomId) {
+          this.roomId = null
+          this.shareToken = null
+        }
       })
 
       this.socket.on('connect_error', (error) => {
@@ -45,6 +99,21 @@ class SocketService {
     }
   }
 
+  // 定期发送心跳；被服务端清理过的连接会凭房间信息重新加入
+  startHeartbeat(interval) {
+    this.stopHeartbeat()
+    this.heartbeatTimer = setInterval(() => {
+      this.emit('heartbeat', this.roomId ? { room_id: this.roomId, share_token: this.shareToken, user_info: this.userInfo } : {})
+    }, interval)
+  }
+
+  stopHeartbeat() {
+    if (this.heartbeatTimer) {
+      clearInterval(this.heartbeatTimer)
+      this.heartbeatTimer = null
+    }
+  }
+
   // 发送消息
   emit(event, data) {
     if (this.isConnected && this.socket) {
@@ -54,25 +123,46 @@ class SocketService {
     }
   }
 
-  // 注册消息处理器
+  // 超过协商阈值的消息体压缩为二进制，放在 payload 字段中发送；
+  // room_id、doc_id、doc_type 由调用方放在外层，服务端检查权限后才解码消息体
+  encodePayload(data) {
+    if (!this.encoding || !this.encoding.deflate) return data
+    const text = JSON.stringify(data)
+    if (text.length < this.encoding.threshold) return data
+    const body = deflate(new TextEncoder().encode(text))
+    const bytes = new Uint8Array(body.length + 1)
+    bytes[0] = DEFLATE
+    bytes.set(body, 1)
+    return { payload: bytes }
+  }
+
+  // 注册消息处理器，二进制消息解码后再交给处理器
   on(event, handler) {
     if (this.socket) {
-      this.socket.on(event, handler)
+      const wrapped = (data) => handler(decodePayload(data))
+      this.handlers.set(handler, wrapped)
+      this.socket.on(event, wrapped)
     }
   }
 
   // 取消注册消息处理器
   off(event, handler) {
     if (this.socket) {
-      this.socket.off(event, handler)
+      this.socket.off(event, this.handlers.get(handler) || handler)
     }
   }
 
-  // 加入房间
-  joinRoom(roomId) {
+  // 加入房间，shareToken 为打开的共享链接的token；加入后服务端直接发送房间文档的状态，
+  // since 返回客户端已有的版本号时只发送之后的操作
+  joinRoom(roomId, shareToken = null, since = null) {
     this.roomId = roomId
+    this.shareToken = shareToken
+    this.since = since
+    const version = typeof since === 'function' ? since() : since
     this.emit('join_room', {
       room_id: roomId,
+      share_token: shareToken,
+      since: version ?? undefined,
       user_info: this.userInfo
     })
   }
@@ -84,28 +174,37 @@ class SocketService {
         room_id: this.roomId
       })
       this.roomId = null
+      this.shareToken = null
+      this.since = null
     }
   }
 
-  // 同步文档
-  syncDocument(docId, docType, content, version) {
+  // 发送文档编辑操作（Quill Delta），version 为操作所基于的文档版本，opId 用于服务端识别重发的操作
+  sendOperation(docId, docType, ops, version, opId) {
     if (this.roomId) {
       this.emit('sync_document', {
         room_id: this.roomId,
         doc_id: docId,
         doc_type: docType,
-        content: content,
-        version: version
+        ...this.encodePayload({
+          ops: ops,
+          version: version,
+          op_id: opId
+        })
       })
     }
   }
 
-  // 获取文档状态
-  getDocumentState(docId, docType) {
-    this.emit('get_document_state', {
+  // 获取文档状态；指定 since 时服务端只返回该版本之后的操作（document_operations）
+  getDocumentState(docId, docType, since = null) {
+    const data = {
       doc_id: docId,
       doc_type: docType
-    })
+    }
+    if (since !== null) {
+      data.since = since
+    }
+    this.emit('get_document_state', data)
   }
 
   // 发送消息
@@ -113,14 +212,35 @@ class SocketService {
     if (this.roomId) {
       this.emit('send_message', {
         room_id: this.roomId,
-        message: message,
-        sender_id: this.userInfo.id || this.socket.id
+        message: message
+      })
+    }
+  }
+
+  // 发送光标位置，服务端只转发每个用户最新的位置
+  sendCursor(docId, range) {
+    if (this.roomId) {
+      this.emit('cursor', {
+        room_id: this.roomId,
+        doc_id: docId,
+        range: range
+      })
+    }
+  }
+
+  // 发送输入状态
+  sendTyping(typing) {
+    if (this.roomId) {
+      this.emit('typing', {
+        room_id: this.roomId,
+        typing: typing
       })
     }
   }
 
   // 断开连接
   disconnect() {
+    this.stopHeartbeat()
     if (this.socket) {
       this.socket.disconnect()
       this.socket = null
@@ -174,8 +294,8 @@ export function useSocket(userInfo = {}) {
   }
   
   // 加入房间
-  const joinRoom = (roomId) => {
-    socketService.joinRoom(roomId)
+  const joinRoom = (roomId, shareToken = null, since = null) => {
+    socketService.joinRoom(roomId, shareToken, since)
   }
   
   // 离开房间
@@ -185,14 +305,14 @@ export function useSocket(userInfo = {}) {
     messages.value = []
   }
   
-  // 同步文档
-  const syncDocument = (docId, docType, content, version) => {
-    socketService.syncDocument(docId, docType, content, version)
+  // 发送文档编辑操作
+  const sendOperation = (docId, docType, ops, version, opId) => {
+    socketService.sendOperation(docId, docType, ops, version, opId)
   }
   
   // 获取文档状态
-  const getDocumentState = (docId, docType) => {
-    socketService.getDocumentState(docId, docType)
+  const getDocumentState = (docId, docType, since = null) => {
+    socketService.getDocumentState(docId, docType, since)
   }
   
   // 发送消息
@@ -200,14 +320,24 @@ export function useSocket(userInfo = {}) {
     socketService.sendMessage(message)
   }
   
-  // 监听文档更新
-  const onDocumentUpdated = (handler) => {
-    socketService.on('document_updated', handler)
+  // 监听其他人的编辑操作
+  const onDocumentOperation = (handler) => {
+    socketService.on('document_operation', handler)
+  }
+  
+  // 取消监听编辑操作
+  const offDocumentOperation = (handler) => {
+    socketService.off('document_operation', handler)
+  }
+  
+  // 监听服务端对本地操作的确认
+  const onDocumentAck = (handler) => {
+    socketService.on('document_ack', handler)
   }
   
-  // 取消监听文档更新
-  const offDocumentUpdated = (handler) => {
-    socketService.off('document_updated', handler)
+  // 取消监听操作确认
+  const offDocumentAck = (handler) => {
+    socketService.off('document_ack', handler)
   }
   
   // 监听文档状态
@@ -220,6 +350,16 @@ export function useSocket(userInfo = {}) {
     socketService.off('document_state', handler)
   }
   
+  // 监听重连后补取的操作
+  const onDocumentOperations = (handler) => {
+    socketService.on('document_operations', handler)
+  }
+  
+  // 取消监听补取的操作
+  const offDocumentOperations = (handler) => {
+    socketService.off('document_operations', handler)
+  }
+  
   // 组件卸载时断开连接
   onUnmounted(() => {
     leaveRoom()
@@ -232,13 +372,17 @@ export function useSocket(userInfo = {}) {
     initSocket,
     joinRoom,
     leaveRoom,
-    syncDocument,
+    sendOperation,
     getDocumentState,
     sendMessage,
-    onDocumentUpdated,
-    offDocumentUpdated,
+    onDocumentOperation,
+    offDocumentOperation,
+    onDocumentAck,
+    offDocumentAck,
     onDocumentState,
-    offDocumentState
+    offDocumentState,
+    onDocumentOperations,
+    offDocumentOperations
   }
 }
 